@@ -0,0 +1,190 @@
+from py_particle_processor_qt.dataset import ImportExportDriver
+from concurrent.futures import ProcessPoolExecutor
+from PyQt5 import QtCore
+import multiprocessing
+import os
+
+__author__ = "Daniel Winklehner, Philip Weigel"
+__doc__ = """Parallel import of many particle files. The files are parsed in a pool of worker
+processes which write the columns into the on-disk cache of each file. The GUI process then only
+memory maps the cache, so no particle data has to be pickled between the processes.
+"""
+
+
+def import_to_cache(filename, driver_name, species, load_options=None):
+    """
+    Runs in a worker process: parses a file and writes it to its on-disk cache.
+    :param filename:
+    :param driver_name:
+    :param species: IonSpecies
+    :param load_options: driver specific import options
+    :return: 0 if the cache was written (or existed already), 1 otherwise
+    """
+    if load_options is None:
+        load_options = {}
+
+    new_ied = ImportExportDriver(driver_name=driver_name)
+
+    # A memory budget of 0 sends every import to the on-disk cache
+    _data = new_ied.import_data(filename, species=species, memory_budget=0, **load_options)
+
+    if _data is None:
+        return 1
+
+    return 0
+
+
+class BatchImporter(object):
+    """
+    Imports a list of files without blocking the GUI. Cacheable files are parsed in parallel by a process pool,
+    everything else (e.g. h5 files, which are read lazily anyway) is loaded in the GUI process one file at a time.
+    Finished files are handed to the parent in the order they complete.
+    The worker processes import the main script, which therefore has to start the GUI
+    under if __name__ == "__main__": (see README.md).
+    """
+
+    def __init__(self, parent, max_workers=None, poll_interval=100, debug=False):
+        """
+        :param parent: object with send_status(message) and batch_file_imported(filename, driver, name, species)
+        :param max_workers: number of worker processes (default: number of cpus)
+        :param poll_interval: time between checks of the workers (ms)
+        :param debug:
+        """
+        self._parent = parent
+        self._debug = debug
+        self._max_workers = max_workers or os.cpu_count() or 1
+
+        self._executor = None
+        self._futures = {}  # future: (filename, name)
+        self._in_process = []  # (filename, name) to load in the GUI process
+        self._driver = None
+        self._species = None
+        self._load_options = {}
+        self._nfiles = 0
+        self._ndone = 0
+        self._failed = []
+
+        self._timer = QtCore.QTimer()
+        self._timer.setInterval(poll_interval)
+        self._timer.timeout.connect(self.poll)
+
+    def failed(self):
+        return self._failed
+
+    def is_running(self):
+        return self._timer.isActive()
+
+    def start(self, filenames, driver, species, load_options=None):
+        """
+        Starts importing the files
+        :param filenames: list of filenames
+        :param driver: driver name
+        :param species: IonSpecies used for all files
+        :param load_options: driver specific import options
+        :return: 0
+        """
+        self._driver = driver
+        self._species = species
+        self._load_options = load_options or {}
+        self._nfiles = len(filenames)
+        self._ndone = 0
+        self._failed = []
+
+        ied = ImportExportDriver(driver_name=driver, debug=self._debug)
+
+        pool_files = []
+
+        for filename in filenames:
+            name = os.path.splitext(os.path.split(filename)[1])[0]
+            if ied.can_cache(filename):
+                pool_files.append((filename, name))
+            else:
+                self._in_process.append((filename, name))
+
+        # Only start worker processes if there is more than one file to parse
+        if len(pool_files) > 1:
+
+            # Spawn instead of fork, forked copies of a running Qt application are not safe.
+            # Spawned workers import the main script, so it has to start the GUI under if __name__ == "__main__":
+            self._executor = ProcessPoolExecutor(max_workers=min(self._max_workers, len(pool_files)),
+                                                 mp_context=multiprocessing.get_context("spawn"))
+
+            for filename, name in pool_files:
+                future = self._executor.submit(import_to_cache, filename, driver, species, self._load_options)
+                self._futures[future] = (filename, name)
+
+        else:
+            self._in_process = pool_files + self._in_process
+
+        self._parent.send_status("Batch import: Loading {} files with driver: {}".format(self._nfiles, driver))
+
+        self._timer.start()
+
+        return 0
+
+    def poll(self):
+        """
+        Called by the timer: attaches the files the workers have finished and loads at most one
+        of the remaining files in the GUI process, so the GUI stays responsive in between.
+        """
+        for future in [future for future in self._futures.keys() if future.done()]:
+
+            filename, name = self._futures.pop(future)
+
+            try:
+                result = future.result()
+            except Exception as e:
+                if self._debug:
+                    print("Batch import of {} failed in the worker process: {}".format(filename, e))
+                result = 1
+
+            if result == 0:
+                self.file_imported(filename, name)
+            else:
+                # Try again in the GUI process
+                self._in_process.append((filename, name))
+
+        if len(self._in_process) > 0:
+            filename, name = self._in_process.pop(0)
+            self.file_imported(filename, name)
+
+        if len(self._futures) == 0 and len(self._in_process) == 0:
+            self.stop()
+
+            if len(self._failed) > 0:
+                self._parent.send_status("Batch import finished, {} of {} files failed!".format(len(self._failed),
+                                                                                                 self._nfiles))
+            else:
+                self._parent.send_status("Batch import finished, {} files loaded.".format(self._nfiles))
+
+    def file_imported(self, filename, name):
+
+        # Files from the workers are found in the on-disk cache, all others are parsed here
+        if self._parent.batch_file_imported(filename, self._driver, name, self._species) != 0:
+            self._failed.append(filename)
+            state = "failed to load"
+        else:
+            state = "loaded"
+
+        self._ndone += 1
+
+        self._parent.send_status("Batch import: {}/{} files done ({} {})".format(self._ndone, self._nfiles,
+                                                                                 os.path.split(filename)[1], state))
+
+    def stop(self):
+        """
+        Stops the import, files that are still being parsed are dropped
+        :return: 0
+        """
+        self._timer.stop()
+
+        if self._executor is not None:
+            for future in self._futures.keys():
+                future.cancel()
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+        self._futures = {}
+        self._in_process = []
+
+        return 0
@@ -0,0 +1,237 @@
+from py_particle_processor_qt.drivers.h5datasource import LRUCache
+import numpy as np
+
+__author__ = "Daniel Winklehner, Philip Weigel"
+__doc__ = """Transformation of the particle data into the frame of the bunch. In the local frame
+the bunch is centered and rotated around z, so that its mean momentum points along y
+(x: transversal, y: longitudinal, z: vertical, as in a cyclotron). The centroids come from
+the summary table of the dataset, so a single step or any number of steps can be transformed
+without another pass over the data. Steps with the same number of particles are transformed
+all at once.
+"""
+
+FRAMES = ("global", "centered", "local")
+FRAME_CACHE_BYTES = 256 * 1024 ** 2  # Memory for cached transformed steps per dataset
+BATCH_BYTES = 64 * 1024 ** 2  # Memory for the steps that are transformed at once
+
+# Rows of a local frame block in the order (transversal, vertical, longitudinal), i.e. with the direction
+# of motion third, as expected by the emittance calculations
+MOTION_ORDER = {"global": (0, 1, 2, 3, 4, 5),
+                "centered": (0, 1, 2, 3, 4, 5),
+                "local": (0, 2, 1, 3, 5, 4)}
+
+_PAIRS = {"x": "y", "y": "x", "px": "py", "py": "px"}  # Coordinates that are mixed by the rotation
+
+
+def frame_angles(px_mean, py_mean):
+    """
+    Returns the rotation angles that turn the mean momentum onto the y axis
+    :param px_mean: mean px of one or several steps
+    :param py_mean: mean py of one or several steps
+    :return: angle(s) (rad)
+    """
+    px_mean, py_mean = np.asarray(px_mean, dtype=float), np.asarray(py_mean, dtype=float)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        theta = np.arccos(py_mean / np.sqrt(np.square(px_mean) + np.square(py_mean)))
+
+    return np.where(px_mean < 0, -theta, theta)
+
+
+def required_keys(keys):
+    """
+    Returns the keys that have to be read to transform the given keys (the rotation mixes x with y and px with py)
+    """
+    required = list(keys)
+
+    for key in keys:
+        if key in _PAIRS and _PAIRS[key] not in required:
+            required.append(_PAIRS[key])
+
+    return required
+
+
+def transform(columns, keys, mean, theta, out, work, frame="local"):
+    """
+    Transforms particle data into a frame. Works for a single step ((npart,) columns, scalar means and angle)
+    and for several steps at once ((nsteps, npart) columns, (nsteps, 1) means and angles).
+    :param columns: dictionary of key: values, has to contain required_keys(keys)
+    :param keys: keys to transform
+    :param mean: dictionary of the means of "x", "y" and "z"
+    :param theta: rotation angle(s), see frame_angles()
+    :param out: sequence of output arrays, one per key (must not be the input arrays)
+    :param work: buffer of the shape of the columns
+    :param frame: "global", "centered" or "local"
+    :return: out
+    """
+    if frame == "local":
+        c, s = np.cos(theta), np.sin(theta)
+    else:
+        c, s = 1.0, 0.0
+
+    for k, key in enumerate(keys):
+
+        if frame == "global":
+            out[k][...] = columns[key]
+            continue
+
+        if key in ("x", "px"):
+            # x' = x cos - y sin (positions are centered)
+            np.multiply(columns[key], c, out=out[k])
+            np.multiply(columns[_PAIRS[key]], s, out=work)
+            out[k] -= work
+            if key == "x":
+                out[k] -= mean["x"] * c - mean["y"] * s
+
+        elif key in ("y", "py"):
+            # y' = x sin + y cos
+            np.multiply(columns[key], c, out=out[k])
+            np.multiply(columns[_PAIRS[key]], s, out=work)
+            out[k] += work
+            if key == "y":
+                out[k] -= mean["x"] * s + mean["y"] * c
+
+        elif key == "z":
+            np.subtract(columns[key], mean["z"], out=out[k])
+
+        else:
+            out[k][...] = columns[key]
+
+    return out
+
+
+class BeamFrame(object):
+    """
+    Transforms the steps of a dataset into the global, centered or local frame. Single transformed steps
+    are cached by (step, frame, keys) until clear() is called (e.g. when the data changes).
+    """
+
+    def __init__(self, dataset, max_bytes=FRAME_CACHE_BYTES):
+        self._dataset = dataset
+        self._cache = LRUCache(max_bytes=max_bytes)
+
+    def _means(self, steps, frame="local"):
+
+        if frame == "global":
+            # Nothing is centered or rotated, so the summary (a pass over all steps) isn't needed
+            return 0.0, 0.0, 0.0, 0.0
+
+        means = self._dataset.summary()["mean"][steps]  # (nsteps, 6): x, y, z, px, py, pz
+        return means[..., 0], means[..., 1], means[..., 2], frame_angles(means[..., 3], means[..., 4])
+
+    def clear(self):
+        self._cache.clear()
+
+    def transform(self, block, keys, step, frame="local", out=None, out_keys=None):
+        """
+        Transforms a block of particle data of one step that was read already
+        :param block: (nkeys, npart) array, rows in the order of keys
+        :param keys: keys of the rows, has to contain required_keys(out_keys)
+        :param step: step number of the block
+        :param frame: "global", "centered" or "local"
+        :param out: optional (len(out_keys), npart) array or sequence of rows
+        :param out_keys: keys to transform (default: all keys of the block)
+        :return: out
+        """
+        if out_keys is None:
+            out_keys = keys
+
+        if out is None:
+            out = np.empty((len(out_keys), np.shape(block)[1]))
+
+        x_mean, y_mean, z_mean, theta = self._means(step, frame)
+        columns = dict((key, block[k]) for k, key in enumerate(keys))
+
+        # The work buffer belongs to the call, the plot and read-ahead threads transform steps at the same time
+        return transform(columns, out_keys, {"x": x_mean, "y": y_mean, "z": z_mean}, theta, out,
+                         np.empty(np.shape(block[0])), frame=frame)
+
+    def block(self, step, frame="local", keys=("x", "y")):
+        """
+        Returns one step in a frame (cached, read-only)
+        :param step: step number
+        :param frame: "global", "centered" or "local"
+        :param keys: keys to return
+        :return: (nkeys, npart) array
+        """
+        cache_key = (step, frame, tuple(keys))
+        value = self._cache.get(cache_key)
+
+        if value is None:
+
+            read_keys = required_keys(keys)
+            raw = self._dataset.read_step(step, read_keys)
+
+            value = np.empty((len(keys), raw.shape[1]))
+            self.transform(raw, read_keys, step, frame=frame, out=value, out_keys=keys)
+            value.flags.writeable = False
+            self._cache.put(cache_key, value)
+
+        return value
+
+    def blocks(self, steps, frame="local", keys=("x", "y"), out=None):
+        """
+        Transforms several steps at once. If all steps have the same number of particles, they are returned as one
+        (nsteps, nkeys, npart) array (written into out if given), otherwise as a list of (nkeys, npart) arrays.
+        Nothing is cached.
+        :param steps: step numbers
+        :param frame: "global", "centered" or "local"
+        :param keys: keys to return
+        :param out: optional (nsteps, nkeys, npart) array
+        :return: array or list of arrays
+        """
+        steps = np.asarray(steps, dtype=int)
+
+        if frame == "global":
+            return self._global_blocks(steps, keys, out)
+
+        read_keys = required_keys(keys)
+        npart = set(self._dataset.summary()["npart"][steps])
+
+        if len(npart) != 1:
+            return [np.array(self.block(step, frame=frame, keys=keys)) for step in steps]
+
+        npart = int(npart.pop())
+
+        if out is None:
+            out = np.empty((len(steps), len(keys), npart))
+
+        x_mean, y_mean, z_mean, theta = self._means(steps)
+
+        # The steps are read into a buffer of a few steps, which are then transformed at once
+        nbatch = int(max(1, min(len(steps), BATCH_BYTES // max(1, 8 * len(read_keys) * npart))))
+        raw = np.empty((nbatch, len(read_keys), npart))
+        work = np.empty((nbatch, npart))  # Per call, like in transform()
+
+        for start in range(0, len(steps), nbatch):
+
+            batch = slice(start, min(start + nbatch, len(steps)))
+            _raw = raw[:batch.stop - batch.start]
+
+            for i, step in enumerate(steps[batch]):
+                self._dataset.read_step(step, read_keys, out=_raw[i])
+
+            columns = dict((key, _raw[:, k]) for k, key in enumerate(read_keys))
+            mean = {"x": x_mean[batch, np.newaxis], "y": y_mean[batch, np.newaxis], "z": z_mean[batch, np.newaxis]}
+
+            transform(columns, keys, mean, theta[batch, np.newaxis], [out[batch, k] for k in range(len(keys))],
+                      work[:batch.stop - batch.start], frame=frame)
+
+        return out
+
+    def _global_blocks(self, steps, keys, out=None):
+        """
+        blocks() in the global frame, the steps are only read (without the summary)
+        """
+        values = [self._dataset.read_step(step, keys) for step in steps]
+
+        if len(set([np.shape(value)[1] for value in values])) != 1:
+            return values
+
+        if out is None:
+            return np.stack(values)
+
+        for i, value in enumerate(values):
+            out[i] = value
+
+        return out
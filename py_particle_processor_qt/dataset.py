@@ -3,6 +3,14 @@
 from dans_pymodules import *
 from scipy import constants as const
 from py_particle_processor_qt.drivers import *
+from py_particle_processor_qt.drivers.h5datasource import H5DataSource, LRUCache
+from py_particle_processor_qt.drivers import diskcache
+from py_particle_processor_qt.particle_index import ParticleIndex
+from py_particle_processor_qt.moments import MomentEngine
+from py_particle_processor_qt.beamframe import BeamFrame, MOTION_ORDER
+from py_particle_processor_qt.transforms import AffineTransform, TransformedSource
+from py_particle_processor_qt.emittance import PARTICLE_KEYS, PHASE_SPACE_KEYS, PLANES, phase_space_block, \
+    twiss_from_covariance, courant_snyder_invariant, fractional_emittance, halo_count
 
 __author__ = "Daniel Winklehner, Philip Weigel"
 __doc__ = """A container that holds a single dataset with 
@@ -18,6 +26,9 @@ clight = const.value("speed of light in vacuum")
 
 colors = MyColors()
 
+DERIVED_CACHE_BYTES = 128 * 1024 ** 2  # Memory for cached derived quantities (r, pr, energy) per dataset
+SUMMARY_KEYS = ("x", "y", "z", "px", "py", "pz")  # Quantities in the per-step summary table
+
 
 class ImportExportDriver(object):
     """
@@ -35,14 +46,48 @@ class ImportExportDriver(object):
     def load_driver(self):
         self._driver = driver_mapping[self._driver_name]['driver'](debug=self._debug)
 
+    def can_cache(self, filename):
+        return self._driver.can_cache(filename)
+
     def get_driver_name(self):
         return self._driver_name
 
-    def import_data(self, filename, species):
-        return self._driver.import_data(filename, species=species)
+    def import_species(self, species):
+        return self._driver.import_species(species)
+
+    def import_data(self, filename, species, memory_budget=None, use_cache=True, **kwargs):
+        """
+        Imports a file with the driver. If the file was spilled to disk by an earlier import and hasn't
+        changed since, the on-disk cache is memory mapped and the file is not parsed again.
+        :param filename:
+        :param species: IonSpecies
+        :param memory_budget: RSS (bytes) above which the imported columns are moved to the on-disk cache
+        :param use_cache: set False to always parse the file and never spill to disk
+        :param kwargs: driver specific import options
+        :return: data dictionary or None
+        """
+        if not use_cache:
+            return self._driver.import_data(filename, species=species, **kwargs)
+
+        _data = self._driver.load_from_cache(filename, species)
+
+        if _data is not None:
+            return _data
 
-    def export_data(self, dataset, filename):
-        return self._driver.export_data(dataset=dataset, filename=filename)
+        if memory_budget is not None:
+            self._driver.set_memory_budget(memory_budget)
+
+        spill = self._driver.check_memory(filename)
+
+        _data = self._driver.import_data(filename, species=species, **kwargs)
+
+        if _data is not None and spill == 1:
+            _data = self._driver.spill_to_disk(filename, _data)
+
+        return _data
+
+    def export_data(self, dataset, filename, **kwargs):
+        return self._driver.export_data(dataset=dataset, filename=filename, **kwargs)
 
 
 class Dataset(object):
@@ -51,6 +96,10 @@ class Dataset(object):
         self._draw = False
         self._selected = False
 
+        # Generated data comes in the old {"Step#N": {...}} format, keep everything columnar internally
+        if isinstance(data, dict):
+            data = ColumnStore.from_steps(data)
+
         self._datasource = data
         self._filename = None
         self._driver = None
@@ -63,6 +112,25 @@ class Dataset(object):
         self._orbit = None
         self._center_orbit = False
 
+        # Derived quantities are computed once per (step, key, orbit center) until the data changes
+        self._derived = LRUCache(max_bytes=DERIVED_CACHE_BYTES)
+        self._data_version = 0
+
+        self._particle_index = None  # Sorted particle IDs per step, see particle_index()
+        self._beam_frame = None  # Transformation into the frame of the bunch, see beam_frame()
+
+        # Pending transformations (applied when the data is read), undone transformations and the combined view
+        self._transforms = []
+        self._undone = []
+        self._transformed = None
+
+        # Per-step summary table, persisted next to the source file as long as the data is unchanged
+        self._summary = None
+        self._summary_checked = False
+        self._load_options = {}
+        self._import_species = None  # Species the file was parsed with, part of the key of the persisted summary
+        self._file_version = None
+
         self._properties = {"name": None,
                             "ion": species,
                             "multispecies": None,
@@ -106,22 +174,79 @@ class Dataset(object):
     def color(self):
         return self._color
 
+    def column(self, key):
+        """
+        Returns the whole trajectory of a coordinate as a (nsteps, npart) array, which allows
+        vectorized slicing over all steps, e.g. ds.column("x")[:, ids]
+        :param key: "id", "x", "y", "z", "px", "py", "pz"
+        :return: (nsteps, npart) array
+        """
+
+        if self._datasource is None:
+
+            if self._debug:
+                print("column(key): No data loaded yet!")
+
+            return 1
+
+        if isinstance(self.get_datasource(), ColumnStore):
+            return self._datasource.column(key)
+
+        # Other datasources (h5 files, pending transformations) have to be stacked step by step,
+        # which needs a constant number of particles
+        try:
+            return np.stack([self.get_datasource().get("Step#{}".format(step)).get(key)[()]
+                             for step in range(self.get_nsteps())])
+
+        except ValueError:
+
+            if self._debug:
+                print("column(key): Number of particles changes between steps, can't create a single column!")
+
+            return 1
+
     def assign_color(self, i):
         self._color = colors[i]
 
-    def export_to_file(self, filename, driver):
+    def export_to_file(self, filename, driver, **kwargs):
+        """
+        :param filename:
+        :param driver:
+        :param kwargs: driver specific export options (e.g. compression, chunks and float32 for OPAL h5 files)
+        :return:
+        """
         if driver is not None:
             new_ied = ImportExportDriver(driver_name=driver, debug=self._debug)
-            new_ied.export_data(dataset=self, filename=filename)
+            return new_ied.export_data(dataset=self, filename=filename, **kwargs)
         elif driver is None:
             return 1
 
     def get_property(self, key):
         return self._properties[key]
 
+    def data_changed(self):
+        """
+        Has to be called whenever the particle data is modified in place (e.g. by a tool),
+        drops all cached derived quantities.
+        :return: new data version
+        """
+        self._derived.clear()
+        self._summary = None
+        self._summary_checked = False
+        self._data_version += 1
+
+        if self._beam_frame is not None:
+            self._beam_frame.clear()
+
+        return self._data_version
+
+    def data_version(self):
+        return self._data_version
+
     def xy_orbit(self, triplet, center=False):
         # Uses a triplet of step numbers to find the center of an orbit
         self._center_orbit = center
+        self._derived.clear()
 
         # Source: https://math.stackexchange.com/questions/213658/get-the-equation-of-a-circle-when-given-3-points
         _x, _y = [], []
@@ -155,6 +280,10 @@ class Dataset(object):
 
     def set_property(self, key, value):
         self._properties[key] = value
+
+        if key == "ion":  # The energy depends on the mass
+            self._derived.clear()
+
         return 0
 
     def is_native_property(self, key):
@@ -172,16 +301,19 @@ class Dataset(object):
     def set_selected(self, selected):
         self._selected = selected
 
-    def get(self, key):
+    def get(self, key, frame="global"):
         """
-        Returns the values for the currently set step and given key ("id", "x", "y", "z", "r", "px", "py", "pz")
+        Returns the values for the currently set step and given key ("id", "x", "y", "z", "r", "px", "py", "pz").
+        Derived quantities ("r", "pr", "energy") are cached and returned read-only.
+        :param key:
+        :param frame: "global", or "centered"/"local" for coordinates in the frame of the bunch (see beamframe.py)
         :return: 
         """
 
-        if key not in ["id", "x", "y", "z", "r", "px", "py", "pz", "pr"]:
+        if key not in ["id", "x", "y", "z", "r", "px", "py", "pz", "pr", "energy"]:
 
             if self._debug:
-                print("get(key): Key was not one of 'id', 'x', 'y', 'z', 'r', 'px', 'py', 'pz', 'pr'")
+                print("get(key): Key was not one of 'id', 'x', 'y', 'z', 'r', 'px', 'py', 'pz', 'pr', 'energy'")
 
             return 1
 
@@ -192,69 +324,604 @@ class Dataset(object):
 
             return 1
 
-        if key is "r":
-            data_x = self._data.get("x")[()]
-            data_y = self._data.get("y")[()]
+        if key in ["r", "pr", "energy"]:
+            return self._derived_value(self._properties["curstep"], key, self._data)
+
+        elif frame != "global" and key in ["x", "y", "z", "px", "py", "pz"]:
+            return self.beam_frame().block(self._properties["curstep"], frame=frame, keys=(key,))[0]
+
+        else:
+            data = self._data.get(key)
+            return data[()]
+
+    def _derived_value(self, step, key, step_data):
+        """
+        Returns a derived quantity ("r", "pr", "energy") of a step (cached, read-only)
+        :param step: step number
+        :param key:
+        :param step_data: the data of the step
+        :return: array
+        """
+        if self._orbit is not None and self._center_orbit is True:
+            center = (self._orbit[0], self._orbit[1])
+        else:
+            center = None
+
+        # The version is part of the key: a value calculated while the data changes is never used again
+        cache_key = (step, key, center, self._data_version)
+        data = self._derived.get(cache_key)
+
+        if data is None:
+            data = self._calculate_derived(key, center, step_data)
+            data.flags.writeable = False  # Shared by all callers
+            self._derived.put(cache_key, data)
+
+        return data
+
+    def _calculate_derived(self, key, center, step_data):
+
+        if key == "energy":
+            # Kinetic energy (MeV) from the momentum (beta * gamma)
+            data_px = step_data.get("px")[()]
+            data_py = step_data.get("py")[()]
+            data_pz = step_data.get("pz")[()]
 
-            if self._orbit is not None and self._center_orbit is True:
-                data = np.sqrt((data_x - self._orbit[0]) ** 2.0 + (data_y - self._orbit[1]) ** 2.0)
+            gamma = np.sqrt(1.0 + data_px ** 2.0 + data_py ** 2.0 + data_pz ** 2.0)
+
+            return (gamma - 1.0) * self._properties["ion"].mass_mev()
+
+        data_x = step_data.get("x")[()]
+        data_y = step_data.get("y")[()]
+
+        if center is not None:
+            r = np.sqrt((data_x - center[0]) ** 2.0 + (data_y - center[1]) ** 2.0)
+        else:
+            r = np.sqrt(data_x ** 2.0 + data_y ** 2.0)
+
+        if key == "r":
+            return r
+
+        data_px = step_data.get("px")[()]
+        data_py = step_data.get("py")[()]
+        p = np.sqrt(data_px ** 2.0 + data_py ** 2.0)
+
+        factor = (data_px * data_x + data_py * data_y)/(abs(p) * abs(r))
+
+        return p * factor
+
+    def read_step(self, step, keys=("x", "y", "z", "px", "py", "pz"), out=None):
+        """
+        Reads several quantities of one step into a single (nkeys, npart) block. The step view is not changed,
+        so this can be called from other threads (e.g. to prepare plot data in the background).
+        :param step: step number
+        :param keys: quantities to read, derived quantities ("r", "pr", "energy") are possible as well
+        :param out: optional (nkeys, n) buffer to reuse, a view of its first npart columns is returned if it is
+                    large enough
+        :return: (nkeys, npart) array
+        """
+        step_data = self.get_datasource().get("Step#{}".format(step))
+        block = None
+
+        for i, key in enumerate(keys):
+
+            if key in ["r", "pr", "energy"]:
+                value = self._derived_value(step, key, step_data)
             else:
-                data = np.sqrt(data_x ** 2.0 + data_y ** 2.0)
+                value = step_data.get(key)[()]
+
+            if block is None:
+                npart = len(value)
+                if out is not None and out.shape[0] >= len(keys) and out.shape[1] >= npart:
+                    block = out[:len(keys), :npart]
+                else:
+                    block = np.empty((len(keys), npart))
 
-            return data
+            block[i] = value
 
-        elif key is "pr":
+        if block is None:
+            block = np.empty((0, 0))
 
-            data_px = self._data.get("px")[()]
-            data_py = self._data.get("py")[()]
-            p = np.sqrt(data_px ** 2.0 + data_py ** 2.0)
+        return block
 
-            data_x = self._data.get("x")[()]
-            data_y = self._data.get("y")[()]
+    def prefetch(self, step, keys=("x", "y")):
+        """
+        Reads quantities of a step into the caches of the datasource, so showing the step later doesn't have to
+        wait for the file. The step view is not changed, so this can be called from other threads.
+        :param step: step number
+        :param keys: quantities to read, derived quantities ("r", "pr", "energy") are possible as well
+        :return: 0, 1 if the step doesn't exist
+        """
+        step_data = self.get_datasource().get("Step#{}".format(step))
+
+        if step_data is None:
+            return 1
 
-            if self._orbit is not None and self._center_orbit is True:
-                r = np.sqrt((data_x - self._orbit[0]) ** 2.0 + (data_y - self._orbit[1]) ** 2.0)
+        for key in keys:
+            if key in ["r", "pr", "energy"]:
+                self._derived_value(step, key, step_data)
             else:
-                r = np.sqrt(data_x ** 2.0 + data_y ** 2.0)
+                step_data.get(key)
+
+        return 0
+
+    def apply_transform(self, transform, steps=None):
+        """
+        Applies an affine transformation (see transforms.py) to the particle data right away, one matrix product
+        per step. Only the coordinates that change are written (h5 files keep them in memory, the file isn't
+        modified). Pending transformations are baked first. This can't be undone, see push_transform().
+        :param transform: AffineTransform
+        :param steps: step numbers (default: all steps)
+        :return: 0 if successful, 1 if no data is loaded
+        """
+        if self._datasource is None:
+
+            if self._debug:
+                print("apply_transform(transform): No data loaded yet!")
+
+            return 1
+
+        if len(self._transforms) > 0:
+            self.bake_transforms()
+
+        if transform.is_identity():
+            return 0
+
+        if steps is None:
+            steps = range(self.get_nsteps())
+
+        write_keys, read_keys = transform.keys()
+
+        # Buffers that are reused for every step
+        block, out = None, None
+
+        for step in steps:
+
+            block = self.read_step(step, read_keys, out=block)
+            npart = block.shape[1]
+
+            if out is None or out.shape[1] < npart:
+                out = np.empty((len(write_keys), npart))
+
+            _out = transform.apply_block(block, out=out[:, :npart])
+            step_data = self._datasource["Step#{}".format(step)]
+
+            for k, key in enumerate(write_keys):
+                step_data[key] = _out[k]
+
+        self.data_changed()
+
+        return 0
+
+    def push_transform(self, transform):
+        """
+        Adds a transformation to the stack of pending transformations. The data itself isn't modified: all pending
+        transformations are combined into one, which is applied whenever a step is read, until they are baked.
+        :param transform: AffineTransform
+        :return: 0
+        """
+        self._transforms.append(transform)
+        self._undone = []
+
+        return self._transforms_changed()
+
+    def undo_transform(self):
+        """
+        Removes the last pending transformation
+        :return: 0 if successful, 1 if there is nothing to undo
+        """
+        if len(self._transforms) == 0:
+            return 1
+
+        self._undone.append(self._transforms.pop())
+
+        return self._transforms_changed()
+
+    def redo_transform(self):
+        """
+        Restores the last undone transformation
+        :return: 0 if successful, 1 if there is nothing to redo
+        """
+        if len(self._undone) == 0:
+            return 1
+
+        self._transforms.append(self._undone.pop())
+
+        return self._transforms_changed()
+
+    def bake_transforms(self):
+        """
+        Applies all pending transformations to the data in a single pass (see apply_transform()) and clears the
+        stack, so they can't be undone anymore.
+        :return: 0 if successful, 1 if no data is loaded
+        """
+        if self._transformed is None:
+            self._transforms, self._undone = [], []
+            return 0
+
+        transform = self._transformed.transform()
+        self._transformed.detach()
+        self._transforms, self._undone, self._transformed = [], [], None
+
+        if self._properties["curstep"] is not None:
+            self.set_step_view(self._properties["curstep"])
+
+        return self.apply_transform(transform)
 
-            factor = (data_px * data_x + data_py * data_y)/(abs(p) * abs(r))
+    def transforms(self):
+        """
+        :return: list of the pending transformations, first to last
+        """
+        return list(self._transforms)
 
-            data = p * factor
+    def _transforms_changed(self):
 
-            return data
+        combined = AffineTransform()
 
+        for transform in self._transforms:
+            combined = combined.then(transform)
+
+        if combined.is_identity():
+            self._transformed = None
         else:
-            data = self._data.get(key)
-            return data[()]
+            self._transformed = TransformedSource(self._datasource, combined, bake=self.bake_transforms)
+
+        if self._properties["curstep"] is not None:
+            self.set_step_view(self._properties["curstep"])
+
+        self.data_changed()
+
+        return 0
+
+    def moments(self, keys=("x", "y", "z", "px", "py", "pz"), steps=None, order=4, covariance=True):
+        """
+        Computes centroid, central moments and covariance matrix of a set of quantities for every step,
+        reading each step only once (see moments.MomentEngine).
+        :param keys: quantities
+        :param steps: step numbers (default: all steps)
+        :param order: highest central moment (1 to 4)
+        :param covariance: compute the covariance matrices as well
+        :return: dictionary of results (see MomentEngine.results()), plus the "steps"
+        """
+        if steps is None:
+            steps = np.arange(self.get_nsteps())
+        else:
+            steps = np.asarray(steps, dtype=int)
+
+        engine = MomentEngine(keys, len(steps), order=order, covariance=covariance)
+        buffer = None
+
+        for i, step in enumerate(steps):
+            block = self.read_step(step, keys, out=buffer)
+            engine.add_step(i, block)
+
+            if buffer is None or block.shape[1] > buffer.shape[1]:
+                buffer = block
+
+        results = engine.results()
+        results["steps"] = steps
+
+        return results
+
+    def twiss(self, steps=None, fractions=(), halo_factor=None, max_particles=None, seed=None, frame="global"):
+        """
+        Calculates rms emittances and Twiss parameters in the x-x', y-y' and z-delta planes for every step,
+        reading each step only once. z is taken as the direction of motion (see emittance.py). In the local frame
+        of the bunch, where y is the direction of motion, the planes are x-x', z-z' and y-delta instead.
+        Fractional emittances and halo counts rank the particles by their Courant-Snyder invariant. For large
+        distributions the ranking can be done with a random sample of the particles, the results then come
+        with 95% confidence bounds.
+        :param steps: step numbers (default: all steps)
+        :param fractions: optional fractions for fractional emittances (e.g. (0.9, 0.99))
+        :param halo_factor: optional, count the particles outside halo_factor times the rms emittance (e.g. 9.0)
+        :param max_particles: rank at most this many (randomly chosen) particles per step (default: all)
+        :param seed: seed of the random sample
+        :param frame: "global", "centered" or "local" (see beamframe.py)
+        :return: dictionary of
+                 "steps", "npart": (nsteps,) arrays,
+                 "betagamma": (nsteps,) mean beta * gamma,
+                 "emittance", "alpha", "beta", "gamma": (nsteps, 3) arrays for the planes x, y, z,
+                 "emittance_norm": (nsteps, 3) normalized rms emittances (beta * gamma * emittance),
+                 "fractional", "fractional_norm", "fractional_lower", "fractional_upper":
+                 {fraction: (nsteps, 3) array},
+                 "halo_count", "halo_count_error": (nsteps, 3) arrays (if halo_factor is given),
+                 "nranked": (nsteps,) number of particles used for the ranking.
+                 Emittances are in m rad, beta in m/rad and gamma in rad/m.
+        """
+        if steps is None:
+            steps = np.arange(self.get_nsteps())
+        else:
+            steps = np.asarray(steps, dtype=int)
+
+        nsteps = len(steps)
+        nplanes = len(PLANES)
+        rank = len(fractions) > 0 or halo_factor is not None
+        rng = np.random.default_rng(seed)
+
+        engine = MomentEngine(PHASE_SPACE_KEYS, nsteps, order=1, covariance=True)
+        betagamma = np.full(nsteps, np.nan)
+        nranked = np.zeros(nsteps, dtype=int)
+        fractional = np.full((3, nsteps, len(fractions), nplanes), np.nan)  # value, lower, upper
+        halo = np.full((2, nsteps, nplanes), np.nan)  # count, error
+
+        # Buffers that are reused for every step
+        block, phase_space, invariants, particles = None, None, None, None
+
+        # Rows of the transformed block in the order that puts the direction of motion third
+        rows = np.argsort(MOTION_ORDER[frame])
+
+        for i, step in enumerate(steps):
+
+            block = self.read_step(step, PARTICLE_KEYS, out=block)
+            npart = block.shape[1]
+
+            if npart == 0:
+                continue
+
+            if phase_space is None or phase_space.shape[1] < npart:
+                phase_space = np.empty((len(PHASE_SPACE_KEYS), npart))
+                invariants = np.empty(npart)
+                particles = np.empty((len(PARTICLE_KEYS), npart)) if frame != "global" else None
+
+            if frame != "global":
+                _particles = particles[:, :npart]
+                self.beam_frame().transform(block, PARTICLE_KEYS, step, frame=frame,
+                                            out=[_particles[rows[k]] for k in range(len(PARTICLE_KEYS))])
+            else:
+                _particles = block
+
+            _phase_space, betagamma[i] = phase_space_block(_particles, out=phase_space[:, :npart])
+            engine.add_step(i, _phase_space)
+
+            if not rank:
+                continue
+
+            sampled = max_particles is not None and npart > max_particles
+
+            if sampled:
+                _phase_space = _phase_space[:, rng.choice(npart, int(max_particles), replace=False)]
+
+            nranked[i] = _phase_space.shape[1]
+            _invariants = invariants[:nranked[i]]
+
+            for j in range(nplanes):
+                _twiss = twiss_from_covariance(engine.cov[i, 2 * j:2 * j + 2, 2 * j:2 * j + 2])
+
+                # Centered in place, the phase space block isn't needed anymore after this plane
+                u = _phase_space[2 * j]
+                up = _phase_space[2 * j + 1]
+                u -= engine.mean[i, 2 * j]
+                up -= engine.mean[i, 2 * j + 1]
+
+                courant_snyder_invariant(u, up, _twiss["alpha"], _twiss["beta"], _twiss["gamma"], out=_invariants)
+
+                if len(fractions) > 0:
+                    if sampled:
+                        fractional[:, i, :, j] = fractional_emittance(_invariants, fractions, z_score=1.96)
+                    else:
+                        fractional[:, i, :, j] = fractional_emittance(_invariants, fractions)
+
+                if halo_factor is not None:
+                    halo[:, i, j] = halo_count(_invariants, _twiss["emittance"], halo_factor, npart=npart)
+
+        planes = [engine.cov[:, 2 * j:2 * j + 2, 2 * j:2 * j + 2] for j in range(nplanes)]
+        twiss = twiss_from_covariance(np.stack(planes, axis=1))  # (nsteps, 3, 2, 2) --> (nsteps, 3)
+
+        results = {"steps": steps,
+                   "npart": engine.npart,
+                   "betagamma": betagamma,
+                   "emittance_norm": twiss["emittance"] * betagamma[:, np.newaxis],
+                   "nranked": nranked}
+
+        for name, values in [("fractional", fractional[0]), ("fractional_norm", fractional[0]),
+                             ("fractional_lower", fractional[1]), ("fractional_upper", fractional[2])]:
+            if name == "fractional_norm":
+                values = values * betagamma[:, np.newaxis, np.newaxis]
+            results[name] = dict((fraction, values[:, k]) for k, fraction in enumerate(fractions))
+
+        if halo_factor is not None:
+            results["halo_count"], results["halo_count_error"] = halo
+
+        results.update(twiss)
+
+        return results
+
+    def summary(self, build=True):
+        """
+        Returns a table of per-step summaries of the particle data. The table is built with one pass over all steps
+        on first use and saved next to the source file, so later loads of the same file get it without reading
+        any particle data. It is dropped when the data changes (see data_changed()).
+        :param build: if False, only return a table that is in memory or on disk already (None otherwise)
+        :return: dictionary of
+                 "keys": the quantities (x, y, z, px, py, pz),
+                 "npart": (nsteps,) number of particles,
+                 "mean", "rms", "min", "max": (nsteps, nkeys) arrays (rms around the mean),
+                 "cov": (nsteps, nkeys, nkeys) covariance matrices,
+                 "emittance": (nsteps, 3) normalized rms emittances (m rad) in the x-px, y-py and z-pz planes
+        """
+        if self._summary is not None:
+            return self._summary
+
+        # Only the data as it is in the file can be stored with the file. A random sample without a seed
+        # is different on every import, so its summary can't be reused.
+        reproducible = self._load_options.get("sample_fraction") is None or self._load_options.get("seed") is not None
+
+        persist = self._filename is not None and self._driver is not None and reproducible and \
+            self._data_version == self._file_version
+
+        if persist and not self._summary_checked:
+
+            self._summary_checked = True
+
+            try:
+                summary = diskcache.load_summary(self._filename, self._driver, self._load_options,
+                                                 self._import_species)
+            except Exception as e:
+                summary = None
+                if self._debug:
+                    print("summary(): Couldn't read the summary of {}: {}".format(self._filename, e))
+
+            if summary is not None and len(summary["npart"]) == self.get_nsteps():
+                self._summary = summary
+                return self._summary
+
+        if not build:
+            return None
+
+        self._summary = self._calculate_summary()
+
+        if persist:
+            try:
+                diskcache.save_summary(self._filename, self._driver, self._summary, self._load_options,
+                                       self._import_species)
+            except Exception as e:
+                if self._debug:
+                    print("summary(): Couldn't save the summary of {}: {}".format(self._filename, e))
+
+        return self._summary
+
+    def _calculate_summary(self):
+
+        nsteps = self.get_nsteps()
+        keys = SUMMARY_KEYS
+
+        engine = MomentEngine(keys, nsteps, order=2, covariance=True)
+        minimum = np.full((nsteps, len(keys)), np.nan)
+        maximum = np.full((nsteps, len(keys)), np.nan)
+        buffer = None
+
+        for step in range(nsteps):
+            block = self.read_step(step, keys, out=buffer)
+            engine.add_step(step, block)
+
+            if block.shape[1] > 0:
+                np.min(block, axis=1, out=minimum[step])
+                np.max(block, axis=1, out=maximum[step])
+
+            if buffer is None or block.shape[1] > buffer.shape[1]:
+                buffer = block
+
+        cov = engine.cov
+        emittance = np.empty((nsteps, 3))
+
+        for i in range(3):
+            # Square root of the determinant of the (q, p_q) covariance matrix, p is beta * gamma (normalized)
+            emittance[:, i] = np.sqrt(np.maximum(cov[:, i, i] * cov[:, i + 3, i + 3] - cov[:, i, i + 3] ** 2.0, 0.0))
+
+        return {"keys": np.array(keys),
+                "npart": engine.npart,
+                "mean": engine.mean,
+                "rms": np.sqrt(engine.m2),
+                "min": minimum,
+                "max": maximum,
+                "cov": cov,
+                "emittance": emittance}
+
+    def beam_frame(self):
+        """
+        Returns the transformation of this dataset into the frame of the bunch (created on first use)
+        """
+        if self._beam_frame is None:
+            self._beam_frame = BeamFrame(self)
+
+        return self._beam_frame
+
+    def particle_index(self):
+        """
+        Returns the particle ID index of this dataset (created on first use)
+        """
+        if self._particle_index is None:
+            self._particle_index = ParticleIndex(self._datasource, self.get_nsteps())
+
+        return self._particle_index
 
     def get_particle(self, particle_id, get_color=False):
-        particle = {"x": [], "y": [], "z": []}
+        trajectories, lengths = self.get_trajectories([particle_id])
+        length = lengths[0]
         max_step = self.get_nsteps()
         color = None
 
-        for step in range(max_step):
-            self.set_step_view(step)
-
-            for key in ["x", "y", "z"]:
-                dat = self._data.get(key)[()][particle_id]
-
-                if np.isnan(dat) or dat == 0.0:  # TODO: A better way to figure out when a particle terminates
-                    if get_color == "step":
-                        factor = float(step) / float(max_step)
-                        color = ((1 - factor) * 255.0, factor * 255.0, 0.0)
-                    elif get_color == "random":
-                        color = colors[particle_id]
-                    return particle, color
-                else:
-                    particle[key].append(dat)
+        particle = dict((key, list(trajectories[key][:length, 0])) for key in ["x", "y", "z"])
 
         if get_color == "step":
-            color = (0.0, 255.0, 0.0)
+            if length < max_step:
+                factor = float(length) / float(max_step)
+                color = ((1 - factor) * 255.0, factor * 255.0, 0.0)
+            else:
+                color = (0.0, 255.0, 0.0)
         elif get_color == "random":
             color = colors[particle_id]
 
         return particle, color
 
+    def get_trajectories(self, particle_ids=None, keys=("x", "y", "z"), steps=None):
+        """
+        Returns the trajectories of a set of particles, reading every step only once.
+        Particles are followed by their ID (if the data has IDs), so particles that are lost in a later step
+        are NaN there. A particle is terminated at the first step where it is lost or x, y or z is NaN or 0.0.
+        :param particle_ids: rows of the particles in the first step (default: all particles)
+        :param keys: quantities to return, derived quantities ("r", "pr", "energy") are possible as well
+        :param steps: step numbers (default: all steps)
+        :return: dictionary of key: (nsteps, k) arrays, (k,) array of the number of valid steps per particle
+        """
+        if steps is None:
+            steps = np.arange(self.get_nsteps())
+        else:
+            steps = np.asarray(steps, dtype=int)
+
+        index = self.particle_index()
+
+        if particle_ids is None:
+            particle_ids = np.arange(index.npart(steps[0]) if len(steps) > 0 else self.get_npart())
+
+        particle_ids = np.asarray(particle_ids, dtype=int)
+
+        # Rows of the particles in every step, -1 where a particle is missing
+        if len(steps) > 0 and index.has_ids():
+            ids = index.ids(steps[0])[particle_ids]
+            rows = np.array([index.rows(step, ids) for step in steps]).reshape(len(steps), len(particle_ids))
+        else:
+            rows = np.empty((len(steps), len(particle_ids)), dtype=int)
+            for i, step in enumerate(steps):
+                rows[i] = np.where(particle_ids < index.npart(step), particle_ids, -1)
+
+        found = rows >= 0
+
+        read_keys = list(keys) + [key for key in ["x", "y", "z"] if key not in keys]
+        trajectories = dict((key, np.full((len(steps), len(particle_ids)), np.nan)) for key in read_keys)
+
+        for key in read_keys:
+
+            if isinstance(self.get_datasource(), ColumnStore) and key in self._datasource.columns():
+                trajectories[key][found] = self._datasource.column(key)[np.broadcast_to(steps[:, np.newaxis],
+                                                                                        rows.shape)[found],
+                                                                        rows[found]]
+                continue
+
+            for i, step in enumerate(steps):
+
+                # Read in row order (needed for h5 reads), return in the requested order
+                order = np.argsort(rows[i][found[i]], kind="mergesort")
+                sorted_rows = rows[i][found[i]][order]
+
+                if isinstance(self.get_datasource(), H5DataSource) and key in self._datasource.column_names(step):
+                    values = self._datasource.read_particles(step, key, sorted_rows)
+                else:
+                    values = self.read_step(step, (key,))[0][sorted_rows]
+
+                unsorted = np.empty(len(values))
+                unsorted[order] = values
+                trajectories[key][i, found[i]] = unsorted
+
+        terminated = ~found
+
+        # TODO: A better way to figure out when a particle terminates
+        for key in ["x", "y", "z"]:
+            terminated |= np.isnan(trajectories[key]) | (trajectories[key] == 0.0)
+
+        lengths = np.where(terminated.any(axis=0), terminated.argmax(axis=0), len(steps))
+
+        return dict((key, trajectories[key]) for key in keys), lengths
+
     # noinspection PyUnresolvedReferences
     def get_a(self):
         if isinstance(self._properties, IonSpecies):
@@ -266,6 +933,13 @@ class Dataset(object):
         return self._properties["curstep"]
 
     def get_datasource(self):
+        """
+        Returns the datasource with all pending transformations applied (see push_transform()).
+        Assigning a column of a step (datasource["Step#N"][key] = values) bakes the pending transformations first.
+        """
+        if self._transformed is not None:
+            return self._transformed
+
         return self._datasource
 
     def get_driver(self):
@@ -299,7 +973,7 @@ class Dataset(object):
     def indices(self):
         return self._indices
 
-    def load_from_file(self, filename, name, driver=None):
+    def load_from_file(self, filename, name, driver=None, **kwargs):
         """
         Load a dataset from file. If the file is h5 already, don't load into memory.
         Users can write their own drivers but they have to be compliant with the 
@@ -308,6 +982,7 @@ class Dataset(object):
         :param filename:
         :param driver:
         :param name: dataset label
+        :param kwargs: driver specific import options (e.g. cache_bytes and rdcc_nbytes for OPAL h5 files)
         :return: 
         """
         self._driver = driver
@@ -316,7 +991,7 @@ class Dataset(object):
         if driver is not None:
 
             new_ied = ImportExportDriver(driver_name=driver, debug=self._debug)
-            _data = new_ied.import_data(self._filename, species=self._species)
+            _data = new_ied.import_data(self._filename, species=self._species, **kwargs)
 
             # if self._debug:
             #     print("_data is {}".format(_data))
@@ -324,6 +999,11 @@ class Dataset(object):
             if _data is not None:
 
                 self._datasource = _data["datasource"]
+                self._particle_index = None
+                self._transforms, self._undone, self._transformed = [], [], None
+                self._load_options = kwargs
+                self._import_species = new_ied.import_species(self._species)
+                self._file_version = self.data_changed()
 
                 for k in _data.keys():
                     self._properties[k] = _data[k]
@@ -361,6 +1041,6 @@ class Dataset(object):
 
         self._properties["curstep"] = step
 
-        self._data = self._datasource.get("Step#{}".format(step))
+        self._data = self.get_datasource().get("Step#{}".format(step))
 
         return 0
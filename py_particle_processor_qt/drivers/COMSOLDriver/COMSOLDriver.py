@@ -1,4 +1,5 @@
-from ..arraywrapper import ArrayWrapper
+from ..columnstore import ColumnStore
+from ..textparser import read_columns
 from ..abstractdriver import AbstractDriver
 from dans_pymodules import IonSpecies, clight
 import numpy as np
@@ -17,117 +18,95 @@ class COMSOLDriver(AbstractDriver):
 
     def import_data(self, filename, species):
 
-        # TODO: There is a lot of looping going on, the fewer instructions the better. -PW
-
         if self._debug:
             print("Importing data from program: {}".format(self._program_name))
 
         try:
 
-            datasource = {}
             data = {}
 
-            with open(filename, 'rb') as infile:
-
-                _n = 7  # Length of the n-tuples to unpack from the values list
-                key_list = ["x", "y", "z", "px", "py", "pz", "E"]  # Things we want to save
+            _n = 7  # Length of the n-tuples per step in each line
+            key_list = ["x", "y", "z", "px", "py", "pz", "E"]  # Things we want to save
 
-                firstline = infile.readline()
-                lines = infile.readlines()
-                raw_values = [float(item) for item in firstline.strip().split()]
-                nsteps = int((len(raw_values) - 1) / _n) # Number of steps
-                npart = len(lines) + 1
+            # One line per particle: ID, then (x, y, z, vx, vy, vz, E) for each step
+            raw_values = read_columns(filename)
+            ids = raw_values[0].astype(int)  # Particle ID numbers
+            nsteps = int((raw_values.shape[0] - 1) / _n)  # Number of steps
+            npart = raw_values.shape[1]
 
-                # Fill in the values for the first line now
-                _id = int(raw_values.pop(0))
+            # (nsteps, 7, npart) view of the whole matrix, converted for all steps at once
+            values = raw_values[1:1 + nsteps * _n].reshape(nsteps, _n, npart)
 
-                for step in range(nsteps):
-                    step_str = "Step#{}".format(step)
+            gamma = values[:, 6] / species.mass_mev() + 1.0
+            beta = np.sqrt(1.0 - gamma ** (-2.0))
+            v_tot = np.sqrt(values[:, 3] ** 2.0 + values[:, 4] ** 2.0 + values[:, 5] ** 2.0)
 
-                    datasource[step_str] = {}
+            datasource = ColumnStore(nsteps, npart, keys=key_list)
 
-                    for key in key_list:
-                        datasource[step_str][key] = ArrayWrapper(np.zeros(npart))
+            for idx, key in enumerate(key_list):
+                if 3 <= idx < 6:
+                    # Convert velocity to momentum
+                    datasource.column(key)[:, ids - 1] = beta * gamma * values[:, idx] / v_tot
+                else:
+                    datasource.column(key)[:, ids - 1] = values[:, idx]
 
-                    values = raw_values[(step * _n):(_n + step * _n)]
+            species.calculate_from_energy_mev(datasource["Step#0"]["E"][0])
 
-                    gamma = values[6] / species.mass_mev() + 1.0
-                    beta = np.sqrt(1.0 - np.power(gamma, -2.0))
-                    v_tot = np.sqrt(values[3] ** 2.0 + values[4] ** 2.0 + values[5] ** 2.0)
+            data["datasource"] = datasource
+            data["ion"] = species
+            data["mass"] = species.a()
+            data["charge"] = species.q()
+            data["steps"] = len(datasource.keys())
+            data["current"] = None
+            data["particles"] = len(datasource["Step#0"]["x"])
 
-                    values[0:3] = [r for r in values[0:3]]
-                    values[3:6] = [beta * gamma * v / v_tot for v in values[3:6]]  # Convert velocity to momentum
+            if self._debug:
+                print("Found {} steps in the file.".format(data["steps"]))
+                print("Found {} particles in the file.".format(data["particles"]))
 
-                    for idx, key in enumerate(key_list):
-                        datasource[step_str][key][_id - 1] = values[idx]
+            return data
 
-                # Now for every other line
-                for line in lines:
+        except Exception as e:
 
-                    raw_values = [float(item) for item in line.strip().split()]  # Data straight from the text file
-                    _id = int(raw_values.pop(0))  # Particle ID number
+            print("Exception happened during particle loading with {} "
+                  "ImportExportDriver: {}".format(self._program_name, e))
 
-                    for step in range(nsteps):
-                        step_str = "Step#{}".format(step)
-                        values = raw_values[(step * _n):(_n + step * _n)]
+        return None
 
-                        gamma = values[6] / species.mass_mev() + 1.0
-                        beta = np.sqrt(1.0 - gamma ** (-2.0))
-                        v_tot = np.sqrt(values[3] ** 2.0 + values[4] ** 2.0 + values[5] ** 2.0)
+    def export_data(self, dataset, filename):
 
-                        values[0:3] = [r for r in values[0:3]]
-                        values[3:6] = [beta * gamma * v / v_tot for v in values[3:6]]  # Convert velocity to momentum
+        if self._debug:
+            print("Exporting data for program: {}".format(self._program_name))
 
-                        for idx, key in enumerate(key_list):
-                            datasource[step_str][key][_id - 1] = values[idx]
+        ion = dataset.get_ion()
 
-                species.calculate_from_energy_mev(datasource["Step#0"]["E"][0])
+        px = dataset.column("px")
 
-                data["datasource"] = datasource
-                data["ion"] = species
-                data["mass"] = species.a()
-                data["charge"] = species.q()
-                data["steps"] = len(datasource.keys())
-                data["current"] = None
-                data["particles"] = len(datasource["Step#0"]["x"])
+        # Dataset.column() returns 1 if the number of particles changes between steps
+        if not isinstance(px, np.ndarray):
+            print("Sorry, the COMSOL format needs the same number of particles in every step!")
+            return 1
 
-                if self._debug:
-                    print("Found {} steps in the file.".format(data["steps"]))
-                    print("Found {} particles in the file.".format(data["particles"]))
+        nsteps, npart = px.shape
 
-                return data
+        # One line per particle: ID, then (x, y, z, vx, vy, vz, E) for each step
+        values = np.empty((npart, nsteps, 7))
 
-        except Exception as e:
+        py, pz = dataset.column("py"), dataset.column("pz")
+        gamma = np.sqrt(1.0 + px ** 2.0 + py ** 2.0 + pz ** 2.0)
 
-            print("Exception happened during particle loading with {} "
-                  "ImportExportDriver: {}".format(self._program_name, e))
+        for idx, key in enumerate(["x", "y", "z"]):
+            values[:, :, idx] = dataset.column(key).T
 
-        return None
+        # Momentum (beta * gamma) to velocity (m/s)
+        values[:, :, 3] = (clight * px / gamma).T
+        values[:, :, 4] = (clight * py / gamma).T
+        values[:, :, 5] = (clight * pz / gamma).T
+        values[:, :, 6] = ((gamma - 1.0) * ion.mass_mev()).T  # Kinetic energy (MeV)
 
-    def export_data(self, dataset, filename):
+        ids = np.arange(1, npart + 1)  # COMSOL particle IDs start at 1
+        matrix = np.column_stack((ids, values.reshape(npart, 7 * nsteps)))
 
-        if self._debug:
-            print("Exporting data for program: {}".format(self._program_name))
+        np.savetxt(filename + ".txt", matrix, fmt=["%d"] + ["%.17g"] * (7 * nsteps), delimiter=" ")
 
-        datasource = dataset.get_datasource()
-        ion = dataset.get_ion()
-        nsteps = dataset.get_nsteps()
-        npart = dataset.get_npart()
-
-        with open(filename + ".txt", "w") as outfile:
-            for i in range(npart):
-                outstring = "{} ".format(i)
-                for step in range(nsteps):
-                    _px = datasource.get("Step#{}".format(step)).get("px")[i]
-                    _py = datasource.get("Step#{}".format(step)).get("py")[i]
-                    _pz = datasource.get("Step#{}".format(step)).get("pz")[i]
-
-                    _vx, _vy, _vz = (clight * _px / np.sqrt(_px ** 2.0 + 1.0),
-                                     clight * _py / np.sqrt(_py ** 2.0 + 1.0),
-                                     clight * _pz / np.sqrt(_pz ** 2.0 + 1.0))
-
-                    outstring += "{} {} {} {} {} {} {} ".format(datasource.get("Step#{}".format(step)).get("x")[i],
-                                                                datasource.get("Step#{}".format(step)).get("y")[i],
-                                                                datasource.get("Step#{}".format(step)).get("z")[i],
-                                                                _vx, _vy, _vz, ion.energy_mev())
-                outfile.write(outstring + "\n")
+        return 0
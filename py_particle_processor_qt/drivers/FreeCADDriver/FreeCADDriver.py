@@ -33,37 +33,31 @@ class FreeCADDriver(AbstractDriver):
 
         datasource = dataset.get_datasource()
         nsteps = dataset.get_nsteps()
-        maxnumpart = len(datasource.get("Step#0").get("x").value)
+        index = dataset.particle_index()
 
-        _chosen = np.random.choice(maxnumpart, ntrj)
+        _ids = index.ids(0)
+        _chosen = np.random.choice(_ids, min(ntrj, len(_ids)), replace=False)
 
         with open(os.path.splitext(filename)[0] + ".dat", "w") as outfile:
 
             outfile.write("step, ID, x (m), y (m), z (m)\n")
 
-            for step in range(nsteps):
+            for step in range(0, nsteps, freq):
 
-                if step % freq == 0:
+                _stepdata = datasource.get("Step#{}".format(step))
 
-                    _stepdata = datasource.get("Step#{}".format(step))
-                    _ids = _stepdata.get("id").value
-                    # npart = len(_ids)
+                # Rows of the chosen particles that are still there, in the order of the file
+                indices = np.sort(index.rows(step, _chosen))
+                indices = indices[indices >= 0]
 
-                    indices = np.nonzero(np.isin(_ids, _chosen))[0]
+                if self._debug:
+                    print("Saving step {} of {}, found {} matching ID's".format(step, nsteps, len(indices)))
 
-                    if self._debug:
-                        print("Saving step {} of {}, found {} matching ID's".format(step, nsteps, len(indices)))
+                block = np.column_stack((np.full(len(indices), step), index.ids(step)[indices],
+                                         _stepdata.get("x")[()][indices],
+                                         _stepdata.get("y")[()][indices],
+                                         _stepdata.get("z")[()][indices]))
 
-                    for i in indices:
-
-                        # if datasource.get("Step#{}".format(step)).get("id")[i] in _chosen:
-
-                        outstring = "{} {} ".format(step, datasource.get("Step#{}".format(step)).get("id")[i])
-
-                        outstring += "{} {} {}\n".format(datasource.get("Step#{}".format(step)).get("x")[i],
-                                                         datasource.get("Step#{}".format(step)).get("y")[i],
-                                                         datasource.get("Step#{}".format(step)).get("z")[i])
-
-                        outfile.write(outstring)
+                np.savetxt(outfile, block, fmt=["%d", "%d", "%.17g", "%.17g", "%.17g"], delimiter=" ")
 
         return 0
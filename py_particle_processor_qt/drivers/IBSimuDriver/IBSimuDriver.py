@@ -1,9 +1,10 @@
-from ..arraywrapper import ArrayWrapper
+from ..columnstore import ColumnStore
+from ..textparser import read_columns
 from ..abstractdriver import AbstractDriver
 from dans_pymodules import IonSpecies, ParticleDistribution
 import numpy as np
 import scipy.constants as const
-from PyQt5.QtWidgets import QInputDialog
+from PyQt5.QtWidgets import QApplication, QInputDialog
 
 
 amu_kg = const.value("atomic mass constant")  # (kg)
@@ -18,6 +19,7 @@ class IBSimuDriver(AbstractDriver):
 
         self._debug = debug
         self._program_name = "IBSimu"
+        self._species_from_file = True  # The species is determined from the masses in the file
         self._parent = parent
 
     def import_data(self, filename, species):
@@ -29,27 +31,10 @@ class IBSimuDriver(AbstractDriver):
 
         try:
 
-            datasource = {}
             data = {}
 
-            with open(filename, 'rb') as infile:
-
-                lines = infile.readlines()
-
-            npart = len(lines)
-
-            current = np.empty(npart)
-            mass = np.empty(npart)
-            x = np.empty(npart)
-            y = np.empty(npart)
-            z = np.empty(npart)
-            vx = np.empty(npart)
-            vy = np.empty(npart)
-            vz = np.empty(npart)
-
-            for i, line in enumerate(lines):
-                current[i], mass[i], _, x[i], vx[i], y[i], vy[i], z[i], vz[i] = [float(item) for item in
-                                                                                 line.strip().split()]
+            # Columns: I (A), M (kg), t, x (m), vx (m/s), y (m), vy (m/s), z (m), vz (m/s)
+            current, mass, _, x, vx, y, vy, z, vz = read_columns(filename)
 
             masses = np.sort(np.unique(mass))  # mass in MeV, sorted in ascending order (protons before h2+)
 
@@ -84,7 +69,14 @@ class IBSimuDriver(AbstractDriver):
 
             n_species = len(particle_distributions)
 
-            if n_species > 1:
+            if n_species > 1 and QApplication.instance() is None:
+
+                # No GUI to ask (e.g. batch import in a worker process), the file is imported again in the GUI
+                print("Found {} ion species in {}, can't choose one without the GUI".format(n_species, filename))
+
+                return None
+
+            elif n_species > 1:
 
                 items = []
                 for dist in particle_distributions:
@@ -105,17 +97,17 @@ class IBSimuDriver(AbstractDriver):
             species = pd.ion
             npart = len(pd.x)
 
-            step_str = "Step#{}".format(0)
-            datasource[step_str] = {}
-            datasource[step_str]["x"] = ArrayWrapper(pd.x)
-            datasource[step_str]["y"] = ArrayWrapper(pd.y)
-            datasource[step_str]["z"] = ArrayWrapper(pd.z)
-            datasource[step_str]["px"] = ArrayWrapper(pd.vx/clight / np.sqrt(1.0 - (pd.vx/clight)**2.0))
-            datasource[step_str]["py"] = ArrayWrapper(pd.vy/clight / np.sqrt(1.0 - (pd.vy/clight)**2.0))
-            datasource[step_str]["pz"] = ArrayWrapper(pd.vz/clight / np.sqrt(1.0 - (pd.vz/clight)**2.0))
             v_mean_sq = pd.vx**2.0 + pd.vy**2.0 + pd.vz**2.0
-            datasource[step_str]["E"] = ArrayWrapper(
-                (1.0 / np.sqrt(1.0 - (v_mean_sq / clight ** 2.0)) - 1.0) * species.mass_mev())
+
+            # For a single timestep, the column store holds one row per column (supports .get("Step#0"))
+            datasource = ColumnStore.from_arrays({"x": pd.x,
+                                                  "y": pd.y,
+                                                  "z": pd.z,
+                                                  "px": pd.vx/clight / np.sqrt(1.0 - (pd.vx/clight)**2.0),
+                                                  "py": pd.vy/clight / np.sqrt(1.0 - (pd.vy/clight)**2.0),
+                                                  "pz": pd.vz/clight / np.sqrt(1.0 - (pd.vz/clight)**2.0),
+                                                  "E": (1.0 / np.sqrt(1.0 - (v_mean_sq / clight ** 2.0)) - 1.0)
+                                                  * species.mass_mev()})
 
             data["datasource"] = datasource
             data["ion"] = species
@@ -125,6 +117,7 @@ class IBSimuDriver(AbstractDriver):
             data["steps"] = 1
             data["current"] = species.current()
             data["particles"] = npart
+            data["species_count"] = n_species
 
             if self._debug:
                 print("Found {} steps in the file.".format(data["steps"]))
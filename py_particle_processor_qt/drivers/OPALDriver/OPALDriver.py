@@ -1,4 +1,6 @@
-from ..arraywrapper import ArrayWrapper
+from ..columnstore import ColumnStore
+from ..textparser import read_columns
+from ..h5datasource import H5DataSource, DEFAULT_CACHE_BYTES, DEFAULT_RDCC_NBYTES
 from ..abstractdriver import AbstractDriver
 from dans_pymodules import IonSpecies
 import numpy as np
@@ -15,7 +17,30 @@ class OPALDriver(AbstractDriver):
     def get_program_name(self):
         return self._program_name
 
-    def import_data(self, filename, species):
+    def can_cache(self, filename):
+        # h5 files are read lazily from disk anyway
+        return self._cacheable and not h5py.is_hdf5(filename)
+
+    def import_data(self, filename, species, mode="r", cache_bytes=DEFAULT_CACHE_BYTES,
+                    rdcc_nbytes=DEFAULT_RDCC_NBYTES, step_start=0, step_stop=None, step_stride=1,
+                    particle_ids=None, sample_fraction=None, seed=None):
+        """
+        Imports an OPAL h5 or .dat file. h5 files are not loaded into memory, but accessed through
+        a read-through cache. For h5 files, a range of steps and a subset of particles can be selected,
+        everything else is never read from the file.
+        :param filename:
+        :param species:
+        :param mode: h5py file mode, read-only by default so the simulation output is never modified
+        :param cache_bytes: byte budget of the (step, column) LRU cache
+        :param rdcc_nbytes: size of the h5py raw data chunk cache (bytes)
+        :param step_start: first step to load (h5 only)
+        :param step_stop: load the steps before this one (h5 only, default: all)
+        :param step_stride: load every n-th step (h5 only)
+        :param particle_ids: ids of the particles to load (h5 only)
+        :param sample_fraction: load a random fraction of the particles (h5 only)
+        :param seed: seed for the random sample (h5 only)
+        :return: data dictionary or None
+        """
 
         if self._debug:
             print("Importing data from program: {}".format(self._program_name))
@@ -25,7 +50,8 @@ class OPALDriver(AbstractDriver):
             if self._debug:
                 print("Opening h5 file..."),
 
-            _datasource = h5py.File(filename, "r+")
+            _datasource = H5DataSource(filename, mode=mode, cache_bytes=cache_bytes, rdcc_nbytes=rdcc_nbytes,
+                                       debug=self._debug)
 
             if self._debug:
                 print("Done!")
@@ -42,6 +68,22 @@ class OPALDriver(AbstractDriver):
                 if self._debug:
                     print("Found {} steps in the file.".format(data["steps"]))
 
+                if step_start != 0 or step_stop is not None or step_stride != 1 or particle_ids is not None \
+                        or sample_fraction is not None:
+
+                    if step_stop is None:
+                        step_stop = data["steps"]
+
+                    data["steps"] = _datasource.select(step_start=step_start, step_stop=step_stop,
+                                                       step_stride=step_stride, particle_ids=particle_ids,
+                                                       sample_fraction=sample_fraction, seed=seed)
+
+                    if data["steps"] == 0:
+                        if self._debug:
+                            print("No steps in the selected range.")
+                        _datasource.close()
+                        return None
+
                 _data = _datasource.get("Step#0")
 
                 # for _key in _data.keys():
@@ -60,7 +102,7 @@ class OPALDriver(AbstractDriver):
                 data["mass"] = species.a()
                 data["charge"] = species.q()
                 data["current"] = None  # TODO: Get actual current! -DW
-                data["particles"] = len(_data.get("x")[()])
+                data["particles"] = _datasource.npart(0)  # Only the shape, don't read the column
 
                 return data
 
@@ -75,64 +117,82 @@ class OPALDriver(AbstractDriver):
                 data["particles"] = int(infile.readline().rstrip().lstrip())
                 data["steps"] = 1
 
-                _distribution = []
-                mydtype = [('x', float), ('xp', float),
-                           ('y', float), ('yp', float),
-                           ('z', float), ('zp', float)]
-
-                for line in infile.readlines():
-                    values = line.strip().split()
-                    _distribution.append(tuple(values))
+            x, xp, y, yp, z, zp = read_columns(filename, skip_header=1, usecols=range(6))
 
-                _distribution = np.array(_distribution, dtype=mydtype)
+            distribution = {'x': x,
+                            'px': xp,
+                            'y': y,
+                            'py': yp,
+                            'z': z,
+                            'pz': zp}
 
-                distribution = {'x': ArrayWrapper(_distribution['x']),
-                                'px': ArrayWrapper(_distribution['xp']),
-                                'y': ArrayWrapper(_distribution['y']),
-                                'py': ArrayWrapper(_distribution['yp']),
-                                'z': ArrayWrapper(_distribution['z']),
-                                'pz': ArrayWrapper(_distribution['zp'])}
+            # For a single timestep, the column store holds one row per column (supports .get("Step#0"))
+            data["datasource"] = ColumnStore.from_arrays(distribution)
 
-                # For a single timestep, we just define a Step#0 entry in a dictionary (supports .get())
-                data["datasource"] = {"Step#0": distribution}
-
-                # TODO: OPAL apparently doesn't save the charge per particle, but per macroparticle without frequency,
-                # TODO: we have no way of telling what the species is! Add manual input. And maybe fix OPAL... -DW
-                data["current"] = 0.0
+            # TODO: OPAL apparently doesn't save the charge per particle, but per macroparticle without frequency,
+            # TODO: we have no way of telling what the species is! Add manual input. And maybe fix OPAL... -DW
+            data["current"] = 0.0
 
             return data
 
         return None
 
-    def export_data(self, dataset, filename):
+    def export_data(self, dataset, filename, compression=None, compression_opts=None, chunks=None,
+                    float32=False):
+        """
+        Exports a dataset to an OPAL h5 file (all steps) or .dat file (current step).
+        :param dataset:
+        :param filename:
+        :param compression: h5 only: None, "gzip" or "lzf"
+        :param compression_opts: h5 only: gzip level (0-9)
+        :param chunks: h5 only: number of particles per chunk, True for automatic chunking (default: contiguous,
+                       automatic if compressed)
+        :param float32: h5 only: store the coordinates as single precision
+        :return: 0 if successful, 1 otherwise
+        """
 
         datasource = dataset.get_datasource()
         nsteps = dataset.get_nsteps()
-        npart = dataset.get_npart()
 
         if ".h5" in filename:
 
             if self._debug:
                 print("Exporting data for program: {}...".format(self._program_name))
 
-            outfile = h5py.File(filename, "w")  # The file dialog will make sure they want to overwrite -PW
+            dtype = np.float32 if float32 else np.float64
+
+            mass_mev = dataset.get_ion().mass_mev()
+            charge = dataset.get_ion().q()
+
+            with h5py.File(filename, "w") as outfile:  # The file dialog will make sure they want to overwrite -PW
+
+                for step in range(nsteps):
+                    step_str = "Step#{}".format(step)
+                    step_grp = outfile.create_group(step_str)
+                    step_data = datasource[step_str]
 
-            m = [dataset.get_ion().mass_mev() for _ in range(npart)]
-            q = [dataset.get_ion().q() for _ in range(npart)]
-            id_list = [i for i in range(npart)]
+                    for key in ["x", "y", "z", "px", "py", "pz"]:
+                        values = np.asarray(step_data[key])
+                        self._create_dataset(step_grp, key, values, dtype, compression, compression_opts, chunks)
 
-            for step in range(nsteps):
-                step_str = "Step#{}".format(step)
-                step_grp = outfile.create_group(step_str)
-                for key in ["x", "y", "z", "px", "py", "pz"]:
-                    step_grp.create_dataset(key, data=datasource[step_str][key])
-                step_grp.create_dataset("id", data=id_list)
-                step_grp.create_dataset("mass", data=m)
-                step_grp.create_dataset("q", data=q)
-                step_grp.attrs.__setitem__("ENERGY", dataset.get_ion().energy_mev())
+                    # The per-particle arrays are sized by the step, the number of particles can vary between steps
+                    _npart = len(values)
 
-            outfile.attrs.__setitem__("OPAL_version", b"OPAL 1.9.0")
-            outfile.close()
+                    # Keep the IDs of the source, so particles can still be matched across steps (see ParticleIndex)
+                    if step_data.get("id") is not None:
+                        id_list = np.asarray(step_data.get("id")).astype(np.int64)
+                    else:
+                        id_list = np.arange(_npart)
+
+                    m = np.full(_npart, mass_mev)
+                    q = np.full(_npart, charge)
+
+                    self._create_dataset(step_grp, "id", id_list, id_list.dtype, compression, compression_opts, chunks)
+                    self._create_dataset(step_grp, "mass", m, m.dtype, compression, compression_opts, chunks)
+                    self._create_dataset(step_grp, "q", q, q.dtype, compression, compression_opts, chunks)
+                    step_grp.attrs.__setitem__("ENERGY", dataset.get_ion().energy_mev())
+
+                outfile.attrs.__setitem__("OPAL_version", b"OPAL 1.9.0")
 
             if self._debug:
                 print("Export successful!")
@@ -150,17 +210,13 @@ class OPALDriver(AbstractDriver):
             else:
                 step = 0
 
+            data = datasource["Step#{}".format(step)]
+
+            # One (npart, 6) block written in one go
+            block = np.column_stack([data[key] for key in ["x", "px", "y", "py", "z", "pz"]])
+
             # The file dialog will make sure they want to overwrite -PW
-            with open(filename, "w") as outfile:
-                data = datasource["Step#{}".format(step)]
-                outfile.write(str(npart) + "\n")
-                for particle in range(npart):
-                    outfile.write(str(data["x"][particle]) + "  " +
-                                  str(data["px"][particle]) + "  " +
-                                  str(data["y"][particle]) + "  " +
-                                  str(data["py"][particle]) + "  " +
-                                  str(data["z"][particle]) + "  " +
-                                  str(data["pz"][particle]) + "\n")
+            np.savetxt(filename, block, fmt="%.17g", delimiter="  ", header=str(len(block)), comments="")
 
             if self._debug:
                 print("Export successful!")
@@ -172,3 +228,19 @@ class OPALDriver(AbstractDriver):
             print("Something went wrong when exporting to: {}".format(self._program_name))
 
             return 1
+
+    @staticmethod
+    def _create_dataset(group, key, values, dtype, compression, compression_opts, chunks):
+
+        if isinstance(chunks, bool) or chunks is None:
+            _chunks = chunks
+        else:
+            _chunks = (int(max(min(chunks, len(values)), 1)),)
+
+        if len(values) == 0:
+            _chunks = None  # Empty datasets can't be chunked
+
+        return group.create_dataset(key, data=values, dtype=dtype, chunks=_chunks,
+                                    compression=compression if len(values) > 0 else None,
+                                    compression_opts=compression_opts if compression == "gzip" else None,
+                                    shuffle=compression is not None and len(values) > 0)
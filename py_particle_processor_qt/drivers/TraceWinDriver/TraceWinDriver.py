@@ -1,7 +1,22 @@
-from ..arraywrapper import ArrayWrapper
+from ..columnstore import ColumnStore
+from ..textparser import read_columns
 from ..abstractdriver import AbstractDriver
 from dans_pymodules import IonSpecies
+from scipy import constants as const
 import numpy as np
+import os
+
+clight = const.value("speed of light in vacuum")
+
+# Binary .dst distribution: 2 chars, int Np, double Ib (mA), double freq (MHz), 1 char,
+# then Np x (x (cm), x' (rad), y (cm), y' (rad), phase (rad), energy (MeV)) and finally double mc2 (MeV)
+dst_header_dtype = np.dtype([("dummy1", "i1", 2),
+                             ("npart", "<i4"),
+                             ("current", "<f8"),
+                             ("frequency", "<f8"),
+                             ("dummy2", "i1")])
+
+default_frequency = 32.8  # MHz, used for the phase if the dataset doesn't know its bunch frequency
 
 
 class TraceWinDriver(AbstractDriver):
@@ -16,6 +31,9 @@ class TraceWinDriver(AbstractDriver):
         if self._debug:
             print("Importing data from program: {}".format(self._program_name))
 
+        if os.path.splitext(filename)[1].lower() == ".dst":
+            return self.import_dst(filename, species)
+
         try:
 
             with open(filename, 'rb') as infile:
@@ -42,41 +60,33 @@ class TraceWinDriver(AbstractDriver):
                 data["mass"] = data["ion"].a()
                 data["charge"] = data["ion"].q()
                 data["current"] = current  # (A)
-                data["particles"] = 0
 
-                _distribution = []
-                mydtype = [('x', float), ('xp', float),
-                           ('y', float), ('yp', float),
-                           ('z', float), ('zp', float),
-                           ('ph', float), ('t', float),
-                           ('e', float), ('l', float)]
+            # Columns: x (mm), x' (mrad), y (mm), y' (mrad), z (mm), z' (mrad), phase, time, energy (MeV), loss flag
+            x, xp, y, yp, z, ekin, loss = read_columns(filename, skip_header=3, usecols=(0, 1, 2, 3, 4, 8, 9))
 
-                for line in infile.readlines():
-                    values = line.strip().split()
-                    if int(values[-1]) == 0:
-                        data["particles"] += 1
-                        _distribution.append(tuple(values))
+            # Only keep particles that were not lost
+            if np.any(loss != 0):
+                x, xp, y, yp, z, ekin = [item[loss == 0] for item in (x, xp, y, yp, z, ekin)]
 
-                _distribution = np.array(_distribution, dtype=mydtype)
+            data["particles"] = len(x)
 
-                gamma = _distribution['e'] / data["ion"].mass_mev() + 1.0
-                beta = np.sqrt(1.0 - gamma**(-2.0))
+            gamma = ekin / data["ion"].mass_mev() + 1.0
+            beta = np.sqrt(1.0 - gamma**(-2.0))
 
-                distribution = {'x': ArrayWrapper(_distribution['x'] * 0.001),
-                                'px': ArrayWrapper(gamma * beta * np.sin(_distribution['xp'] * 0.001)),
-                                'y': ArrayWrapper(_distribution['y'] * 0.001),
-                                'py': ArrayWrapper(gamma * beta * np.sin(_distribution['yp'] * 0.001)),
-                                'z': ArrayWrapper(_distribution['z'] * 0.001)}
+            distribution = {'x': x * 0.001,
+                            'px': gamma * beta * np.sin(xp * 0.001),
+                            'y': y * 0.001,
+                            'py': gamma * beta * np.sin(yp * 0.001),
+                            'z': z * 0.001}
 
-                distribution['pz'] = ArrayWrapper(np.sqrt(beta**2.0 * gamma**2.0
-                                                          - distribution['px'].value**2.0
-                                                          - distribution['py'].value**2.0
-                                                          ))
+            distribution['pz'] = np.sqrt(beta**2.0 * gamma**2.0
+                                         - distribution['px']**2.0
+                                         - distribution['py']**2.0)
 
-                # For a single timestep, we just define a Step#0 entry in a dictionary (supports .get())
-                data["datasource"] = {"Step#0": distribution}
+            # For a single timestep, the column store holds one row per column (supports .get("Step#0"))
+            data["datasource"] = ColumnStore.from_arrays(distribution)
 
-                return data
+            return data
 
         except Exception as e:
 
@@ -85,13 +95,120 @@ class TraceWinDriver(AbstractDriver):
 
         return None
 
-    def export_data(self, data):
+    def import_dst(self, filename, species):
+        """
+        Reads a binary TraceWin .dst distribution file, no text parsing involved.
+        :param filename:
+        :param species: IonSpecies
+        :return: data dictionary or None
+        """
 
-        # TODO
+        try:
+
+            with open(filename, 'rb') as infile:
+                header = np.fromfile(infile, dtype=dst_header_dtype, count=1)[0]
+                npart = int(header["npart"])
+                particles = np.fromfile(infile, dtype="<f8", count=6 * npart).reshape(npart, 6)
+                mc2 = np.fromfile(infile, dtype="<f8", count=1)
+
+            if self._debug:
+                print("Found {} particles, I = {} mA, f = {} MHz in .dst file".format(npart, header["current"],
+                                                                                       header["frequency"]))
+
+            mc2 = mc2[0] if len(mc2) > 0 else species.mass_mev()
+            x, xp, y, yp, phase, ekin = particles.T
+
+            gamma = ekin / mc2 + 1.0
+            betagamma = np.sqrt(gamma ** 2.0 - 1.0)
+            beta = betagamma / gamma
+
+            # x' and y' are px/pz and py/pz
+            pz = betagamma / np.sqrt(1.0 + xp ** 2.0 + yp ** 2.0)
+
+            # Phase (rad) --> time offset --> longitudinal position (m)
+            z = -phase / (2.0 * np.pi * header["frequency"] * 1.0e6) * beta * clight
+
+            species.calculate_from_energy_mev(np.mean(ekin) / species.a())  # MeV/amu
+
+            data = {"steps": 1,
+                    "ion": species,
+                    "mass": species.a(),
+                    "charge": species.q(),
+                    "current": header["current"] * 1.0e-3,  # mA --> A
+                    "energy": np.mean(ekin),
+                    "frequency": header["frequency"],
+                    "particles": npart,
+                    "datasource": ColumnStore.from_arrays({'x': x * 0.01,  # cm --> m
+                                                           'px': xp * pz,
+                                                           'y': y * 0.01,  # cm --> m
+                                                           'py': yp * pz,
+                                                           'z': z,
+                                                           'pz': pz})}
+
+            return data
+
+        except Exception as e:
+
+            print("Exception happened during particle loading with {} "
+                  "ImportExportDriver: {}".format(self._program_name, e))
+
+        return None
+
+    def export_data(self, dataset, filename):
 
         if self._debug:
             print("Exporting data for program: {}".format(self._program_name))
 
-        print("Export not yet implemented :(")
+        if os.path.splitext(filename)[1].lower() != ".dst":
+            print("Export is only implemented for binary .dst files :(")
+            return 1
+
+        if dataset.get_nsteps() > 1:
+            print("The .dst format only supports one step! Using the selected step...")
+            step = dataset.get_current_step()
+        else:
+            step = 0
+
+        data = dataset.get_datasource().get("Step#{}".format(step))
+        ion = dataset.get_ion()
+        mc2 = ion.mass_mev()
+
+        x, y, z = data.get("x")[()], data.get("y")[()], data.get("z")[()]
+        px, py, pz = data.get("px")[()], data.get("py")[()], data.get("pz")[()]
+
+        current = dataset.get_property("current")
+        frequency = dataset.properties().get("frequency")
+
+        if frequency is None:
+            frequency = default_frequency
+            if self._debug:
+                print("Dataset has no frequency, using {} MHz to calculate phases.".format(frequency))
+
+        gamma = np.sqrt(1.0 + px ** 2.0 + py ** 2.0 + pz ** 2.0)
+        beta = np.sqrt(1.0 - gamma ** (-2.0))
+
+        particles = np.empty((len(x), 6))
+        particles[:, 0] = x * 100.0  # m --> cm
+        particles[:, 1] = px / pz
+        particles[:, 2] = y * 100.0  # m --> cm
+        particles[:, 3] = py / pz
+        particles[:, 4] = -2.0 * np.pi * frequency * 1.0e6 * z / (beta * clight)
+        particles[:, 5] = (gamma - 1.0) * mc2
+
+        header = np.zeros(1, dtype=dst_header_dtype)
+        header["dummy1"] = (125, 100)
+        header["npart"] = len(x)
+        header["current"] = 0.0 if current is None else current * 1.0e3  # A --> mA
+        header["frequency"] = frequency
+        header["dummy2"] = 125
+
+        # The file dialog will make sure they want to overwrite -PW
+        with open(filename, "wb") as outfile:
+            header.tofile(outfile)
+            particles.tofile(outfile)
+            np.array([mc2], dtype="<f8").tofile(outfile)
+
+        if self._debug:
+            print("Export successful!")
 
-        return data
+        return 0
@@ -1,4 +1,5 @@
-from ..arraywrapper import ArrayWrapper
+from ..columnstore import ColumnStore
+from ..textparser import read_columns
 from ..abstractdriver import AbstractDriver
 from dans_pymodules import IonSpecies
 import numpy as np
@@ -39,8 +40,6 @@ class TrackDriver(AbstractDriver):
                 if self._debug:
                     print(header1)
 
-                lines = infile.readlines()
-
             data = {}
             emean = e_mean_total/species.a()  # MeV/amu  (70 keV)
             # current = 0.01  # mA
@@ -54,18 +53,10 @@ class TrackDriver(AbstractDriver):
             data["energy"] = emean * species.a()
             data["particles"] = 0
 
-            npart = len(lines)
-
-            dt = np.zeros(npart)
-            dw = np.zeros(npart)
-            x = np.zeros(npart)
-            xp = np.zeros(npart)
-            y = np.zeros(npart)
-            yp = np.zeros(npart)
+            # Data: Nseed, iq, dt (ns), dW (MeV/amu), x (cm), x' (mrad), y (cm), y' (mrad)
+            dt, dw, x, xp, y, yp = read_columns(filename, skip_header=1, usecols=range(2, 8))
 
-            for i, line in enumerate(lines):
-                # Data: Nseed, iq, dt (ns), dW (MeV/amu), x (cm), x' (mrad), y (cm), y' (mrad)
-                _, _, dt[i], dw[i], x[i], xp[i], y[i], yp[i] = [float(value) for value in line.strip().split()]
+            npart = len(dt)
 
             # Apply cut:
             indices = np.where(dt <= t_cut)
@@ -149,15 +140,15 @@ class TrackDriver(AbstractDriver):
 
             z = z_center - dt * 1e-9 * vz
 
-            distribution = {'x': ArrayWrapper(x),
-                            'px': ArrayWrapper(px),
-                            'y': ArrayWrapper(y),
-                            'py': ArrayWrapper(py),
-                            'z': ArrayWrapper(z),
-                            'pz': ArrayWrapper(pz)}
+            distribution = {'x': x,
+                            'px': px,
+                            'y': y,
+                            'py': py,
+                            'z': z,
+                            'pz': pz}
 
-            # For a single timestep, we just define a Step#0 entry in a dictionary (supports .get())
-            data["datasource"] = {"Step#0": distribution}
+            # For a single timestep, the column store holds one row per column (supports .get("Step#0"))
+            data["datasource"] = ColumnStore.from_arrays(distribution)
             data["particles"] = npart_new
 
             return data
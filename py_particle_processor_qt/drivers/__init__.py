@@ -1,3 +1,5 @@
+from py_particle_processor_qt.drivers.arraywrapper import *
+from py_particle_processor_qt.drivers.columnstore import *
 from py_particle_processor_qt.drivers.OPALDriver import *
 from py_particle_processor_qt.drivers.TraceWinDriver import *
 from py_particle_processor_qt.drivers.COMSOLDriver import *
@@ -14,7 +16,7 @@ several extensions can be specified for one driver
 driver_mapping = {'OPAL': {'driver': OPALDriver,
                            'extensions': ['.h5', '.dat']},
                   'TraceWin': {'driver': TraceWinDriver,
-                               'extensions': ['.txt', '.dat']},
+                               'extensions': ['.txt', '.dat', '.dst']},
                   'COMSOL': {'driver': COMSOLDriver,
                              'extensions': ['.txt']},
                   'IBSimu': {'driver': IBSimuDriver,
@@ -1,13 +1,20 @@
 from abc import ABC, abstractmethod
+from .columnstore import ColumnStore
+from . import diskcache
 import os
 
 # TODO: WIP -PW
 
+DEFAULT_MEMORY_BUDGET = 5e8  # 500 MB
+
 
 class AbstractDriver(ABC):
     def __init__(self):
         self._program_name = None
         self._debug = None
+        self._memory_budget = DEFAULT_MEMORY_BUDGET  # (bytes)
+        self._cacheable = True  # Drivers that ask the user for import parameters can't reuse a cache
+        self._species_from_file = False  # True if the driver determines the species from the file itself
 
     def get_program_name(self):
         return self._program_name
@@ -24,11 +31,17 @@ class AbstractDriver(ABC):
     # different-ways-to-get-memory-consumption-or-lessons-learned-from-memory_profiler/
     @staticmethod
     def _memory_usage_ps():
+        """
+        Resident set size of this process in MB, 0.0 if ps is not available (e.g. on Windows)
+        """
         import subprocess
-        out = subprocess.Popen(['ps', 'v', '-p', str(os.getpid())],
-                               stdout=subprocess.PIPE).communicate()[0].split("\n")
-        vsz_index = out[0].split().index("RSS")
-        mem = float(out[1].split()[vsz_index]) / 1024.0
+        try:
+            out = subprocess.Popen(['ps', 'v', '-p', str(os.getpid())],
+                                   stdout=subprocess.PIPE).communicate()[0].decode().split("\n")
+            vsz_index = out[0].split().index("RSS")
+            mem = float(out[1].split()[vsz_index]) / 1024.0
+        except (OSError, ValueError, IndexError):
+            return 0.0
         return mem
 
     # Source: https://stackoverflow.com/questions/2104080/how-to-check-file-size-in-python
@@ -36,16 +49,114 @@ class AbstractDriver(ABC):
     def _get_file_size(filename):
         return os.stat(filename).st_size
 
+    def can_cache(self, filename):
+        """
+        Whether imports of this file can be written to (and reused from) the on-disk cache
+        """
+        return self._cacheable
+
+    def import_species(self, species):
+        """
+        The species the imported data depends on (e.g. momenta calculated from its mass), part of the cache key
+        :param species: IonSpecies passed to import_data
+        :return: IonSpecies or None if the driver determines the species from the file itself
+        """
+        if self._species_from_file:
+            return None
+
+        return species
+
+    def set_memory_budget(self, memory_budget):
+        self._memory_budget = memory_budget
+
     def check_memory(self, filename):
-        current_usage = self._memory_usage_ps()
+        """
+        Checks if importing a file would push this process over the memory budget
+        :param filename:
+        :return: 1 if the import should be spilled to disk, 0 otherwise
+        """
+        current_usage = self._memory_usage_ps() * 1024.0 ** 2  # MB -> bytes
         file_size = self._get_file_size(filename)
-        if current_usage + file_size > 5e8:  # 500 MB
-            self.convert_to_h5()
-        else:
-            return 0
 
-    def convert_to_h5(self):
-        pass
+        if current_usage + file_size > self._memory_budget:
+            return 1
+
+        return 0
+
+    def load_from_cache(self, filename, species):
+        """
+        Re-opens the on-disk cache of a previous import of the (unchanged) file as memory maps
+        :param filename: source file
+        :param species: IonSpecies, its energy is restored from the cache
+        :return: data dictionary like import_data or None if there is no cache (for this species)
+        """
+        if not self.can_cache(filename):
+            return None
+
+        datasource, properties, cached_species = diskcache.load(filename, self._program_name,
+                                                                import_species=self.import_species(species))
+
+        if datasource is None:
+            return None
+
+        if self._debug:
+            print("Using the cached import of {}".format(filename))
+
+        data = dict(properties)
+
+        energy = data.pop("ion_energy_mev", None)
+
+        if self._species_from_file and cached_species is not None:
+            species = cached_species
+        elif energy is not None:
+            species.calculate_from_energy_mev(energy)
+
+        data["ion"] = species
+        data["datasource"] = datasource
+
+        return data
+
+    def spill_to_disk(self, filename, data):
+        """
+        Writes the imported columns into the on-disk cache and replaces them with memory maps of the cache
+        :param filename: source file
+        :param data: data dictionary returned by import_data
+        :return: data dictionary with the memory mapped datasource
+        """
+        if not self.can_cache(filename) or not isinstance(data.get("datasource"), ColumnStore):
+            return data
+
+        if self._species_from_file and data.get("species_count", 1) > 1:
+            # The user picked one of several species in the file, the next import has to ask again
+            return data
+
+        properties = dict((key, value) for key, value in data.items() if key not in ["datasource", "ion"])
+
+        if data.get("ion") is not None:
+            properties["ion_energy_mev"] = data["ion"].energy_mev()
+
+        import_species = self.import_species(data.get("ion"))
+
+        try:
+            path = diskcache.save(filename, self._program_name, data["datasource"], properties,
+                                  species=data.get("ion"), import_species=import_species)
+            datasource, _, _ = diskcache.load(filename, self._program_name, import_species=import_species)
+        except Exception as e:  # The data is in memory already, the cache is optional
+            if self._debug:
+                print("Could not write the on-disk cache for {}: {}".format(filename, e))
+            return data
+
+        if datasource is None:
+            if self._debug:
+                print("Could not read back the on-disk cache for {}, keeping it in memory".format(filename))
+            return data
+
+        if self._debug:
+            print("Spilled the import of {} to {}".format(filename, path))
+
+        data["datasource"] = datasource
+
+        return data
 
     def get_species(self):
         pass
@@ -1,29 +1,78 @@
 import numpy as np
 
+__doc__ = """A growable 1D column that wraps numpy arrays without copying them."""
+
 
 class ArrayWrapper(object):
+    """
+    Wraps a 1D array without copying. append() writes into spare capacity that is doubled when it runs out,
+    so appending is amortized O(1). np.asarray() returns a view of the valid part of the buffer.
+    """
+
+    __slots__ = ("_array", "_size")
+
+    def __init__(self, array_like=(), dtype=None):
+        self._array = np.asarray(array_like, dtype=dtype).reshape(-1)  # No copy for 1D arrays of the right dtype
+        self._size = len(self._array)
+
+    def __array__(self, dtype=None, copy=None):
+        value = self._array[:self._size]
+
+        if dtype is not None and np.dtype(dtype) != value.dtype:
+            return value.astype(dtype)
 
-    def __init__(self, array_like):
-        if type(array_like) is not np.array:
-            self._array = np.array(array_like)
-        else:
-            self._array = array_like
+        if copy:
+            return value.copy()
 
-    def __get__(self):
-        return self
+        return value
+
+    def __buffer__(self, flags):
+        return memoryview(self._array[:self._size])
 
     def __getitem__(self, key):
-        return self._array[key]
+        return self._array[:self._size][key]
 
-    def __setitem__(self, key, item):
-        self._array[key] = item
+    def __iter__(self):
+        return iter(self._array[:self._size])
 
     def __len__(self):
-        return len(self._array)
+        return self._size
+
+    def __setitem__(self, key, item):
+        self._array[:self._size][key] = item
+
+    @property
+    def dtype(self):
+        return self._array.dtype
+
+    @property
+    def shape(self):
+        return self._size,
 
     @property
     def value(self):
-        return self._array
+        return self._array[:self._size]
 
     def append(self, value):
-        self._array = np.append(self._array, value)
\ No newline at end of file
+        """
+        Appends a value or an array of values. The dtype is promoted if necessary (like np.append).
+        :param value: scalar or array_like
+        :return: 0
+        """
+        value = np.asarray(value).reshape(-1)
+        size = self._size + len(value)
+        dtype = np.result_type(self._array.dtype, value.dtype)
+
+        if size > len(self._array) or dtype != self._array.dtype:
+            # Never write into the array that was wrapped, always grow into a new buffer
+            new_array = np.empty(max(size, 2 * len(self._array), 16), dtype=dtype)
+            new_array[:self._size] = self._array[:self._size]
+            self._array = new_array
+
+        self._array[self._size:size] = value
+        self._size = size
+
+        return 0
+
+    def capacity(self):
+        return len(self._array)
@@ -0,0 +1,189 @@
+import numpy as np
+
+__doc__ = """A columnar, step-major particle store. Every coordinate is held in a single
+contiguous (nsteps, npart) block, and a 'Step#N' view adapter keeps the
+{"Step#N": {"x": ...}} access pattern of the old dict datasources working.
+"""
+
+
+def _as_array(value):
+    try:
+        return np.asarray(value[()])
+    except (TypeError, IndexError, KeyError):
+        return np.asarray(value)
+
+
+def step_index(step):
+    """
+    Converts a step key ("Step#N") or an integer step into the integer step number
+    :param step: "Step#N" string or int
+    :return: int
+    """
+    if isinstance(step, str):
+        return int(step.split("#")[1])
+
+    return int(step)
+
+
+class StepView(object):
+    """
+    A lightweight view of a single step of a ColumnStore. Item access returns row views
+    into the underlying column blocks, so writes go straight through to the store.
+    """
+
+    __slots__ = ("_store", "_step", "attrs")
+
+    def __init__(self, store, step):
+        self._store = store
+        self._step = step
+        self.attrs = {}
+
+    def __contains__(self, key):
+        return key in self._store.columns()
+
+    def __getitem__(self, key):
+        return self._store.column(key)[self._step]
+
+    def __setitem__(self, key, value):
+        self._store.column(key)[self._step] = value
+
+    def __iter__(self):
+        return iter(self._store.columns())
+
+    def __len__(self):
+        return len(self._store.columns())
+
+    def get(self, key, default=None):
+        if key not in self._store.columns():
+            return default
+        return self[key]
+
+    def items(self):
+        return [(key, self[key]) for key in self._store.columns()]
+
+    def keys(self):
+        return self._store.columns()
+
+    def step(self):
+        return self._step
+
+
+class ColumnStore(object):
+    """
+    Holds all particle data of a dataset as one (nsteps, npart) float64 block per column.
+    Supports .get("Step#N") like the h5py files and dicts used as datasources before.
+    """
+
+    def __init__(self, nsteps, npart, keys=("x", "y", "z", "px", "py", "pz"), dtype=np.float64):
+        self._nsteps = int(nsteps)
+        self._npart = int(npart)
+        self._columns = {}
+
+        for key in keys:
+            self._columns[key] = np.zeros((self._nsteps, self._npart), dtype=dtype)
+
+    @classmethod
+    def from_arrays(cls, columns):
+        """
+        Creates a ColumnStore from a dictionary of arrays. 1D arrays are treated as a single step,
+        2D arrays have to be (nsteps, npart). Contiguous float64 arrays are not copied.
+        :param columns: dict of key: array_like
+        :return: ColumnStore
+        """
+        blocks = {}
+
+        for key, value in columns.items():
+            block = np.ascontiguousarray(value, dtype=np.float64)
+            if block.ndim == 1:
+                block = block[np.newaxis, :]
+            blocks[key] = block
+
+        shapes = set(block.shape for block in blocks.values())
+
+        assert len(shapes) == 1, "All columns of a ColumnStore need the same (nsteps, npart) shape, got {}".format(
+            shapes)
+
+        nsteps, npart = shapes.pop()
+
+        store = cls(nsteps, npart, keys=())
+        store._columns = blocks
+
+        return store
+
+    @classmethod
+    def from_steps(cls, steps):
+        """
+        Converts an old-style {"Step#N": {"x": array_like, ...}} dictionary into a ColumnStore.
+        Entries that are not one value per particle (e.g. 'attrs') are ignored.
+        :param steps: dict
+        :return: ColumnStore
+        """
+        step_keys = sorted(steps.keys(), key=step_index)
+        nsteps = len(step_keys)
+        first = dict((key, _as_array(value)) for key, value in steps[step_keys[0]].items())
+        npart = len(first["x"])
+        keys = [key for key, value in first.items() if value.ndim == 1 and len(value) == npart]
+
+        if nsteps == 1:
+            # A single step (e.g. generated data) is wrapped without copying
+            return cls.from_arrays(dict((key, first[key]) for key in keys))
+
+        store = cls(nsteps, npart, keys=keys)
+
+        for i, step_key in enumerate(step_keys):
+            for key in keys:
+                store._columns[key][i] = _as_array(steps[step_key][key])
+
+        return store
+
+    def __contains__(self, step):
+        try:
+            return 0 <= step_index(step) < self._nsteps
+        except (IndexError, ValueError):
+            return False
+
+    def __getitem__(self, step):
+        _step = step_index(step)
+
+        if not 0 <= _step < self._nsteps:
+            raise KeyError(step)
+
+        return StepView(self, _step)
+
+    def __len__(self):
+        return self._nsteps
+
+    def add_column(self, key, block=None):
+        if block is None:
+            block = np.zeros((self._nsteps, self._npart))
+
+        self._columns[key] = np.asarray(block, dtype=np.float64).reshape(self._nsteps, self._npart)
+
+        return self._columns[key]
+
+    def close(self):
+        return 0
+
+    def column(self, key):
+        return self._columns[key]
+
+    def columns(self):
+        return list(self._columns.keys())
+
+    def get(self, step, default=None):
+        if step not in self:
+            return default
+        return self[step]
+
+    def keys(self):
+        return ["Step#{}".format(i) for i in range(self._nsteps)]
+
+    @property
+    def nbytes(self):
+        return sum(block.nbytes for block in self._columns.values())
+
+    def npart(self):
+        return self._npart
+
+    def nsteps(self):
+        return self._nsteps
@@ -0,0 +1,286 @@
+from .columnstore import ColumnStore
+from dans_pymodules import IonSpecies
+import numpy as np
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+__doc__ = """A sidecar on-disk cache for imported datasets. The columns of a ColumnStore are
+written as .npy files and re-opened as memory maps, so the data lives in the page cache
+instead of the process memory. The cache is keyed by the path, modification time and size
+of the source file (and the mass and charge of the species it was parsed with), so a second import
+of an unchanged file can skip the parsing entirely.
+Only .npy, .npz and JSON files are read back from the cache, never pickles, as the cache
+directory may be writable by others.
+Small per-step summary tables are kept in the same directory as .npz files.
+"""
+
+CACHE_DIRNAME = ".ppp_cache"
+META_FILENAME = "meta.json"
+SUMMARY_SUFFIX = ".summary.npz"
+
+
+def _cache_roots(filename):
+    """
+    The cache lives next to the source file if possible, otherwise in the temp directory
+    """
+    return [os.path.join(os.path.dirname(os.path.abspath(filename)), CACHE_DIRNAME),
+            os.path.join(tempfile.gettempdir(), "ppp_cache")]
+
+
+def _cache_prefix(filename, driver_name):
+    """
+    The part of the cache name that is the same for all versions of a source file.
+    Contains a digest of the absolute path, so files with the same name in different directories
+    don't replace each other's caches in the shared temp directory.
+    """
+    path_digest = hashlib.sha1(os.path.abspath(filename).encode("utf-8")).hexdigest()[:16]
+
+    return "{}-{}-{}-".format(os.path.basename(filename), driver_name, path_digest)
+
+
+def _species_key(species):
+    """
+    Mass and charge of the species the file was parsed with, the momenta of some formats depend on them
+    """
+    if species is None:
+        return ""
+
+    return "{!r}|{!r}".format(float(species.mass_mev()), float(species.q()))
+
+
+def cache_name(filename, driver_name, import_species=None):
+    """
+    Returns the name of the cache directory for the current version of the source file
+    :param filename: source file
+    :param driver_name: name of the program/driver that parses the file
+    :param import_species: IonSpecies the file was parsed with (None if the data doesn't depend on it)
+    :return: directory name
+    """
+    stat = os.stat(filename)
+    key = "{}|{}|{}".format(stat.st_mtime_ns, stat.st_size, _species_key(import_species))
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+    return _cache_prefix(filename, driver_name) + digest
+
+
+def _options_digest(options):
+    """
+    Digest of the import options. Arrays (e.g. particle_ids) are hashed by their contents,
+    as repr() abbreviates large arrays.
+    """
+    digest = hashlib.sha1()
+
+    for key, value in sorted((options or {}).items()):
+        digest.update(repr(key).encode("utf-8"))
+
+        if isinstance(value, (np.ndarray, list, tuple)):
+            value = np.ascontiguousarray(value)
+            digest.update("{}{}".format(value.dtype.str, value.shape).encode("utf-8"))
+            digest.update(value.tobytes())
+        else:
+            digest.update(repr(value).encode("utf-8"))
+
+    return digest.hexdigest()[:8]
+
+
+def _remove_stale(root, prefix, name):
+    """
+    Removes the caches and summaries of older versions of a source file
+    """
+    for entry in os.listdir(root):
+        if entry.startswith(prefix) and not entry.startswith(name):
+            if os.path.isdir(os.path.join(root, entry)):
+                shutil.rmtree(os.path.join(root, entry), ignore_errors=True)
+            else:
+                try:
+                    os.remove(os.path.join(root, entry))
+                except OSError:
+                    pass
+
+
+def _writable_root(filename):
+
+    for root in _cache_roots(filename):
+        try:
+            os.makedirs(root, exist_ok=True)
+        except OSError:
+            continue
+        if os.access(root, os.W_OK):
+            return root
+
+    return None
+
+
+def _serializable(value):
+    if value is None or isinstance(value, (bool, str)):
+        return True
+    return isinstance(value, (int, float, np.integer, np.floating))
+
+
+def _species_to_meta(species):
+    """
+    The parameters of an IonSpecies as a JSON serializable dictionary
+    """
+    return {"name": species.name(),
+            "mass_mev": float(species.mass_mev()),
+            "a": float(species.a()),
+            "z": float(species.z()),
+            "q": float(species.q()),
+            "current": float(species.current()),
+            "energy_mev": float(species.energy_mev())}
+
+
+def _species_from_meta(meta):
+    """
+    Creates the IonSpecies from the parameters written by _species_to_meta
+    """
+    return IonSpecies(meta["name"],
+                      mass_mev=meta["mass_mev"],
+                      a=meta["a"],
+                      z=meta["z"],
+                      q=meta["q"],
+                      current=meta["current"],
+                      energy_mev=meta["energy_mev"])
+
+
+def load(filename, driver_name, mmap_mode="c", import_species=None):
+    """
+    Opens the cached columns of a source file as memory maps.
+    The default copy-on-write mode keeps changes (e.g. by tools) in memory and never writes to the cache.
+    :param filename: source file
+    :param driver_name:
+    :param mmap_mode: mode for np.load
+    :param import_species: IonSpecies the file is parsed with (see cache_name())
+    :return: (ColumnStore, meta dictionary, species) or (None, None, None) if there is no valid cache
+    """
+    name = cache_name(filename, driver_name, import_species)
+
+    for root in _cache_roots(filename):
+        path = os.path.join(root, name)
+        meta_filename = os.path.join(path, META_FILENAME)
+        if os.path.isfile(meta_filename):
+            break
+    else:
+        return None, None, None
+
+    with open(meta_filename, "r") as infile:
+        meta = json.load(infile)
+
+    columns = {}
+    for key in meta["columns"]:
+        columns[key] = np.load(os.path.join(path, "{}.npy".format(key)), mmap_mode=mmap_mode,
+                               allow_pickle=False)
+
+    species = None
+    if meta.get("species") is not None:
+        species = _species_from_meta(meta["species"])
+
+    return ColumnStore.from_arrays(columns), meta["properties"], species
+
+
+def save(filename, driver_name, store, properties, species=None, import_species=None):
+    """
+    Writes the columns of a ColumnStore and the scalar import properties into the cache of a source file.
+    Caches of older versions of the same source file are removed.
+    :param filename: source file
+    :param driver_name:
+    :param store: ColumnStore
+    :param properties: dictionary of import properties, non-scalar entries are skipped
+    :param species: IonSpecies of the import (optional)
+    :param import_species: IonSpecies the file was parsed with (see cache_name())
+    :return: path of the cache
+    """
+    name = cache_name(filename, driver_name, import_species)
+    prefix = _cache_prefix(filename, driver_name)
+
+    root = _writable_root(filename)
+
+    if root is None:
+        raise OSError("No writable cache directory for {}".format(filename))
+
+    path = os.path.join(root, name)
+
+    _remove_stale(root, prefix, name)
+
+    os.makedirs(path, exist_ok=True)
+
+    for key in store.columns():
+        np.save(os.path.join(path, "{}.npy".format(key)), store.column(key))
+
+    meta = {"columns": store.columns(),
+            "properties": dict((key, value.item() if isinstance(value, np.generic) else value)
+                               for key, value in properties.items() if _serializable(value)),
+            "species": None if species is None else _species_to_meta(species)}
+
+    # The meta file marks the cache as complete, so it is written last
+    with open(os.path.join(path, META_FILENAME + ".tmp"), "w") as outfile:
+        json.dump(meta, outfile)
+
+    os.replace(os.path.join(path, META_FILENAME + ".tmp"), os.path.join(path, META_FILENAME))
+
+    return path
+
+
+def summary_name(filename, driver_name, options=None, import_species=None):
+    """
+    Returns the file name of the summary table of the current version of a source file
+    :param filename: source file
+    :param driver_name:
+    :param options: import options that change the data (e.g. a step or particle selection)
+    :param import_species: IonSpecies the file was parsed with (see cache_name())
+    :return: file name
+    """
+    return "{}-{}{}".format(cache_name(filename, driver_name, import_species), _options_digest(options),
+                            SUMMARY_SUFFIX)
+
+
+def load_summary(filename, driver_name, options=None, import_species=None):
+    """
+    Reads the summary table of a source file
+    :param filename: source file
+    :param driver_name:
+    :param options: import options of the dataset
+    :param import_species: IonSpecies the file was parsed with
+    :return: dictionary of arrays or None if there is no summary for this version of the file
+    """
+    name = summary_name(filename, driver_name, options, import_species)
+
+    for root in _cache_roots(filename):
+        if os.path.isfile(os.path.join(root, name)):
+            with np.load(os.path.join(root, name), allow_pickle=False) as npz:
+                return dict((key, npz[key]) for key in npz.files)
+
+    return None
+
+
+def save_summary(filename, driver_name, summary, options=None, import_species=None):
+    """
+    Writes the summary table of a source file, summaries of older versions of the file are removed.
+    :param filename: source file
+    :param driver_name:
+    :param summary: dictionary of arrays
+    :param options: import options of the dataset
+    :param import_species: IonSpecies the file was parsed with
+    :return: path of the summary or None if there is no writable cache directory
+    """
+    root = _writable_root(filename)
+
+    if root is None:
+        return None
+
+    name = summary_name(filename, driver_name, options, import_species)
+
+    _remove_stale(root, _cache_prefix(filename, driver_name), cache_name(filename, driver_name, import_species))
+
+    # Write to a temporary file first, so a summary is either complete or not there at all
+    path = os.path.join(root, name)
+
+    with open(path + ".tmp", "wb") as outfile:
+        np.savez(outfile, **summary)
+
+    os.replace(path + ".tmp", path)
+
+    return path
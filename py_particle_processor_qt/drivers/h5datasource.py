@@ -0,0 +1,456 @@
+from collections import OrderedDict
+from .columnstore import step_index
+import threading
+import numpy as np
+import h5py
+from h5py import h5s
+
+__doc__ = """A lazy, read-through cached access layer for h5 particle files (OPAL).
+Columns are only read from disk on first access and then kept in an LRU cache
+with a byte budget, keyed by (step, column). A subset of steps and particles can
+be selected, only the selected elements are ever read from the file.
+The cache can be shared by threads (e.g. the plot data is read in the background).
+"""
+
+DEFAULT_CACHE_BYTES = 512 * 1024 ** 2  # 512 MB of decoded columns
+DEFAULT_RDCC_NBYTES = 64 * 1024 ** 2  # 64 MB h5py chunk cache (h5py default is 1 MB)
+
+
+def read_selection(dataset, indices=None):
+    """
+    Reads the elements 'indices' of a 1D h5py dataset. Runs of consecutive indices are read as hyperslabs,
+    very fragmented selections (e.g. random samples) as a single point selection.
+    :param dataset: h5py Dataset
+    :param indices: sorted array of ints or None for the whole dataset
+    :return: numpy array
+    """
+    if indices is None:
+        return dataset[()]
+
+    if len(indices) == 0:
+        return np.empty(0, dtype=dataset.dtype)
+
+    breaks = np.flatnonzero(np.diff(indices) != 1) + 1
+    starts = indices[np.r_[0, breaks]]
+    counts = np.diff(np.r_[0, breaks, len(indices)])
+
+    if len(starts) == 1:
+        return dataset[starts[0]:starts[0] + counts[0]]
+
+    file_space = dataset.id.get_space()
+
+    if len(starts) > len(indices) // 4:  # Mostly isolated elements
+        file_space.select_elements(np.asarray(indices, dtype=np.uint64).reshape(-1, 1))
+    else:
+        file_space.select_hyperslab((int(starts[0]),), (int(counts[0]),), op=h5s.SELECT_SET)
+        for start, count in zip(starts[1:], counts[1:]):
+            file_space.select_hyperslab((int(start),), (int(count),), op=h5s.SELECT_OR)
+
+    value = np.empty(len(indices), dtype=dataset.dtype)
+    dataset.id.read(h5s.create_simple((len(indices),)), file_space, value)
+
+    return value
+
+
+class LRUCache(object):
+    """
+    A least-recently-used cache for numpy arrays with a budget in bytes instead of a number of items.
+    All methods are thread-safe.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self._max_bytes = max_bytes
+        self._nbytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.RLock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._nbytes = 0
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value = self._items[key]
+            except KeyError:
+                self.misses += 1
+                return None
+
+            self._items.move_to_end(key)
+            self.hits += 1
+
+        return value
+
+    def max_bytes(self):
+        return self._max_bytes
+
+    def nbytes(self):
+        return self._nbytes
+
+    def pop(self, key):
+        with self._lock:
+            value = self._items.pop(key, None)
+            if value is not None:
+                self._nbytes -= value.nbytes
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            self.pop(key)
+
+            # Arrays that are larger than the whole budget are handed out, but never cached
+            if value.nbytes > self._max_bytes:
+                return value
+
+            self._items[key] = value
+            self._nbytes += value.nbytes
+
+            while self._nbytes > self._max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._nbytes -= evicted.nbytes
+
+        return value
+
+    def set_max_bytes(self, max_bytes):
+        with self._lock:
+            self._max_bytes = max_bytes
+
+            while self._nbytes > self._max_bytes and len(self._items) > 0:
+                _, evicted = self._items.popitem(last=False)
+                self._nbytes -= evicted.nbytes
+
+
+class H5StepView(object):
+    """
+    A view of a single step group in the h5 file. Reading goes through the cache of the datasource.
+    Columns that are assigned (e.g. by a tool) are kept in memory and never written back to the file.
+    """
+
+    __slots__ = ("_source", "_step")
+
+    def __init__(self, source, step):
+        self._source = source
+        self._step = step
+
+    def __contains__(self, key):
+        return key in self._source.column_names(self._step)
+
+    def __getitem__(self, key):
+        value = self._source.read(self._step, key)
+
+        if value is None:
+            raise KeyError(key)
+
+        return value
+
+    def __setitem__(self, key, value):
+        self._source.write(self._step, key, value)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    @property
+    def attrs(self):
+        return self._source.group(self._step).attrs
+
+    def get(self, key, default=None):
+        value = self._source.read(self._step, key)
+
+        if value is None:
+            return default
+
+        return value
+
+    def keys(self):
+        return self._source.column_names(self._step)
+
+    def step(self):
+        return self._step
+
+
+class H5DataSource(object):
+    """
+    Wraps an h5py File in OPAL format ("Step#N" groups with one dataset per column).
+    The file is opened read-only by default and all returned arrays are read-only,
+    so cached data can't be modified by accident.
+    After select(), step numbers are positions in the selected range and columns only hold the selected particles,
+    sorted by their id if they were selected by id.
+    """
+
+    def __init__(self, filename, mode="r", cache_bytes=DEFAULT_CACHE_BYTES, rdcc_nbytes=DEFAULT_RDCC_NBYTES,
+                 debug=False):
+        self._filename = filename
+        self._debug = debug
+        self._file = h5py.File(filename, mode, rdcc_nbytes=rdcc_nbytes)
+        self._cache = LRUCache(max_bytes=cache_bytes)
+        self._overrides = {}  # (step, key): array, assigned columns that live in memory only
+
+        self._steps = None  # File step numbers of the selected steps, None: all steps
+        self._particle_ids = None  # Sorted particle ids to keep, None: all particles
+        self._sample = None  # Sorted particle indices to keep if the file has no ids, None: all particles
+        self._indices = {}  # step: sorted particle indices of the selection in that step
+        self._id_order = {}  # step: order of the selected rows by id, None if they are in id order in the file
+
+    def __contains__(self, step):
+        try:
+            _step = step_index(step)
+        except (IndexError, ValueError):
+            return False
+
+        if self._steps is not None:
+            return 0 <= _step < len(self._steps)
+
+        return "Step#{}".format(_step) in self._file
+
+    def __getitem__(self, step):
+        if step not in self:
+            raise KeyError(step)
+
+        return H5StepView(self, step_index(step))
+
+    def __len__(self):
+        if self._steps is not None:
+            return len(self._steps)
+
+        return len(self._file.keys())
+
+    @property
+    def attrs(self):
+        return self._file.attrs
+
+    def cache(self):
+        return self._cache
+
+    def close(self):
+        self._cache.clear()
+        self._overrides = {}
+        self._indices = {}
+        self._id_order = {}
+        self._file.close()
+
+        return 0
+
+    def column_names(self, step):
+        names = list(self.group(step).keys())
+        names += [key for (_step, key) in self._overrides.keys() if _step == step and key not in names]
+
+        return names
+
+    def file_step(self, step):
+        """
+        Returns the step number in the file of a (selected) step
+        """
+        if self._steps is None:
+            return step
+
+        return int(self._steps[step])
+
+    def filename(self):
+        return self._filename
+
+    def get(self, step, default=None):
+        if step not in self:
+            return default
+
+        return self[step]
+
+    def group(self, step):
+        return self._file["Step#{}".format(self.file_step(step))]
+
+    def h5file(self):
+        return self._file
+
+    def keys(self):
+        if self._steps is not None:
+            return ["Step#{}".format(i) for i in range(len(self._steps))]
+
+        return self._file.keys()
+
+    def npart(self, step=0):
+        """
+        Number of (selected) particles in a step, without reading any column
+        """
+        indices = self.particle_indices(step)
+
+        if indices is None:
+            return self.group(step)["x"].shape[0]
+
+        return len(indices)
+
+    def particle_indices(self, step):
+        """
+        Returns the sorted indices of the selected particles in the datasets of a step
+        :param step: int
+        :return: array of ints or None if all particles are selected
+        """
+        if self._particle_ids is None and self._sample is None:
+            return None
+
+        if step not in self._indices:
+
+            if self._particle_ids is not None:
+                # Particles can change their position in the file between steps, so look them up by id
+                ids = self.group(step)["id"][()]
+                indices = np.flatnonzero(np.isin(ids, self._particle_ids))
+                order = np.argsort(ids[indices], kind="mergesort")
+
+                # The rows are read in file order and then sorted by id (see id_order())
+                self._id_order[step] = None if np.all(order[1:] > order[:-1]) else order
+                self._indices[step] = indices
+            else:
+                npart = self.group(step)["x"].shape[0]
+                self._id_order[step] = None
+                self._indices[step] = self._sample[self._sample < npart]
+
+        return self._indices[step]
+
+    def id_order(self, step):
+        """
+        Returns the order that sorts the selected particles of a step by their id. Selections by id
+        (particle_ids or a sample of a file with ids) are returned sorted by id, so column i is the same particle
+        in every step that contains all of them. If particles are lost, match them by the 'id' column.
+        :param step: int
+        :return: array of ints or None if the selected rows are in id order already
+        """
+        self.particle_indices(step)
+
+        return self._id_order.get(step)
+
+    def read(self, step, key):
+        """
+        Returns the column 'key' of step 'step' from memory if possible, otherwise from disk.
+        :param step: int
+        :param key: column name
+        :return: read-only numpy array or None if the column doesn't exist
+        """
+        if (step, key) in self._overrides:
+            return self._overrides[(step, key)]
+
+        value = self._cache.get((step, key))
+
+        if value is None:
+
+            _dataset = self.group(step).get(key)
+
+            if _dataset is None:
+                return None
+
+            value = read_selection(_dataset, self.particle_indices(step))
+
+            if self.id_order(step) is not None:
+                value = value[self.id_order(step)]
+
+            value.flags.writeable = False
+            self._cache.put((step, key), value)
+
+        return value
+
+    def read_particles(self, step, key, indices):
+        """
+        Returns the column 'key' of step 'step' for some particles only. If the column isn't in memory,
+        only these particles are read from the file.
+        :param step: int
+        :param key: column name
+        :param indices: sorted array of particle indices (positions in the selected particles)
+        :return: numpy array or None if the column doesn't exist
+        """
+        value = self._overrides.get((step, key))
+
+        if value is None:
+            value = self._cache.get((step, key))
+
+        if value is not None:
+            return value[indices]
+
+        _dataset = self.group(step).get(key)
+
+        if _dataset is None:
+            return None
+
+        selection = self.particle_indices(step)
+
+        if selection is None:
+            return read_selection(_dataset, indices)
+
+        order = self.id_order(step)
+
+        if order is None:
+            return read_selection(_dataset, selection[indices])
+
+        # Rows of the particles in the file are not sorted, read them sorted and put them back in id order
+        rows = selection[order[indices]]
+        rows_order = np.argsort(rows, kind="mergesort")
+
+        value = np.empty(len(rows), dtype=_dataset.dtype)
+        value[rows_order] = read_selection(_dataset, rows[rows_order])
+
+        return value
+
+    def select(self, step_start=0, step_stop=None, step_stride=1, particle_ids=None, sample_fraction=None,
+               seed=None):
+        """
+        Restricts the datasource to a range of steps and a subset of the particles.
+        :param step_start: first step (file numbering)
+        :param step_stop: stop before this step (default: all steps)
+        :param step_stride: use every n-th step
+        :param particle_ids: array_like of particle ids to keep (requires an 'id' column)
+        :param sample_fraction: keep a random fraction (0, 1] of the particles of the first selected step
+        :param seed: seed of the random sample
+        :return: number of selected steps
+        """
+        if step_stop is None:
+            step_stop = len([key for key in self._file.keys() if key.startswith("Step#")])
+
+        self._steps = np.arange(step_start, step_stop, step_stride)
+        self._particle_ids = None
+        self._sample = None
+        self._indices = {}
+        self._id_order = {}
+        self._overrides = {}
+        self._cache.clear()
+
+        if particle_ids is not None:
+            self._particle_ids = np.unique(np.asarray(particle_ids))
+
+        elif sample_fraction is not None and sample_fraction < 1.0 and len(self._steps) > 0:
+
+            rng = np.random.RandomState(seed)
+            first = self.group(0)
+            npart = first["x"].shape[0]
+            nsample = max(int(round(sample_fraction * npart)), 1)
+
+            if "id" in first:
+                # Sample ids instead of positions, so the same particles are followed through all steps
+                self._particle_ids = np.sort(rng.choice(first["id"][()], nsample, replace=False))
+            else:
+                self._sample = np.sort(rng.choice(npart, nsample, replace=False))
+
+        if self._debug:
+            print("Selected {} steps of {}".format(len(self._steps), self._filename))
+
+        return len(self._steps)
+
+    def write(self, step, key, value):
+        """
+        Replaces the column 'key' of step 'step' in memory. The file on disk is not touched.
+        :param step: int
+        :param key: column name
+        :param value: array_like
+        :return: 0
+        """
+        value = np.array(value)
+        value.flags.writeable = False
+        self._overrides[(step, key)] = value
+        self._cache.pop((step, key))
+
+        return 0
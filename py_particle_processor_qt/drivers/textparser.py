@@ -0,0 +1,81 @@
+import itertools
+import numpy as np
+
+__doc__ = """Bulk parsing of whitespace separated particle text files.
+The file is parsed in fixed-size chunks of rows straight into a preallocated
+float array, so memory stays bounded by the result plus one chunk.
+"""
+
+DEFAULT_CHUNK_ROWS = 100000
+_BLOCK_BYTES = 16 * 1024 ** 2
+
+
+def count_rows(filename, skip_header=0):
+    """
+    Counts the lines of a file (after skipping the header lines) by scanning it in binary blocks
+    :param filename:
+    :param skip_header: number of header lines
+    :return: number of lines
+    """
+    nlines = 0
+    last = b"\n"
+
+    with open(filename, "rb") as infile:
+        while True:
+            block = infile.read(_BLOCK_BYTES)
+            if not block:
+                break
+            nlines += block.count(b"\n")
+            last = block[-1:]
+
+    if last != b"\n":  # Last line without line break
+        nlines += 1
+
+    return max(nlines - skip_header, 0)
+
+
+def read_columns(filename, skip_header=0, usecols=None, chunk_rows=DEFAULT_CHUNK_ROWS, comments="#"):
+    """
+    Reads a whitespace separated table of numbers into a (ncols, nrows) float64 array,
+    i.e. every column of the file ends up as one contiguous row of the result.
+    :param filename:
+    :param skip_header: number of header lines to skip
+    :param usecols: columns to read (default: all)
+    :param chunk_rows: number of lines parsed at once
+    :param comments: lines starting with this are ignored
+    :return: (ncols, nrows) numpy array
+    """
+    nrows = count_rows(filename, skip_header=skip_header)
+    data = None
+    filled = 0
+
+    with open(filename, "r") as infile:
+
+        for _ in range(skip_header):
+            infile.readline()
+
+        while True:
+
+            lines = list(itertools.islice(infile, chunk_rows))
+
+            if len(lines) == 0:
+                break
+
+            chunk = np.loadtxt(lines, usecols=usecols, comments=comments, ndmin=2)
+
+            if chunk.size == 0:
+                continue
+
+            if data is None:
+                data = np.empty((chunk.shape[1], nrows))
+
+            data[:, filled:filled + chunk.shape[0]] = chunk.T
+            filled += chunk.shape[0]
+
+    if data is None:
+        return np.empty((0 if usecols is None else len(usecols), 0))
+
+    if filled < nrows:  # Blank and comment lines were counted, but not parsed
+        data = np.ascontiguousarray(data[:, :filled])
+
+    return data
@@ -0,0 +1,163 @@
+import numpy as np
+
+__author__ = "Daniel Winklehner, Philip Weigel"
+__doc__ = """Emittance and Twiss parameters of particle distributions. Everything works on
+batches of steps: the Twiss parameters of all steps are calculated at once from the
+(nsteps, 2, 2) covariance matrices of the phase space planes. The planes are x-x', y-y'
+and z-delta with x' = px / pz, y' = py / pz and delta = (p - <p>) / <p>, i.e. z is taken
+as the direction of motion.
+"""
+
+PLANES = ("x", "y", "z")
+PHASE_SPACE_KEYS = ("x", "xp", "y", "yp", "z", "delta")  # Rows of a phase space block
+PARTICLE_KEYS = ("x", "y", "z", "px", "py", "pz")  # Rows of the particle data block it is made from
+
+
+def phase_space_block(block, out=None):
+    """
+    Converts a (6, npart) block of particle data (x, y, z, px, py, pz) into a (6, npart) phase space block
+    (x, x', y, y', z, delta).
+    :param block: particle data, momenta are beta * gamma
+    :param out: optional (6, npart) buffer (not the block itself)
+    :return: phase space block, mean beta * gamma of the particles
+    """
+    if out is None:
+        out = np.empty(block.shape)
+
+    x, y, z, px, py, pz = block
+
+    p = np.sqrt(np.einsum("ij,ij->j", block[3:], block[3:]))
+    p_mean = np.mean(p)
+
+    np.divide(px, pz, out=out[1])
+    np.divide(py, pz, out=out[3])
+
+    out[0] = x
+    out[2] = y
+    out[4] = z
+
+    np.subtract(p, p_mean, out=out[5])
+    out[5] /= p_mean
+
+    return out, p_mean
+
+
+def twiss_from_covariance(cov):
+    """
+    Calculates rms emittance and Twiss parameters from the covariance matrices of a phase space plane
+    :param cov: (..., 2, 2) covariance matrices of (u, u')
+    :return: dictionary of (...) arrays "emittance", "alpha", "beta", "gamma"
+    """
+    cov = np.asarray(cov)
+
+    emittance = np.sqrt(np.maximum(cov[..., 0, 0] * cov[..., 1, 1] - cov[..., 0, 1] ** 2.0, 0.0))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return {"emittance": emittance,
+                "alpha": -cov[..., 0, 1] / emittance,
+                "beta": cov[..., 0, 0] / emittance,
+                "gamma": cov[..., 1, 1] / emittance}
+
+
+def courant_snyder_invariant(u, up, alpha, beta, gamma, out=None):
+    """
+    Calculates the Courant-Snyder invariant (gamma u^2 + 2 alpha u u' + beta u'^2) of every particle.
+    The emittance of the ellipse through a particle is equal to its invariant.
+    :param u: centered positions
+    :param up: centered angles
+    :param alpha:
+    :param beta:
+    :param gamma:
+    :param out: optional buffer
+    :return: array of invariants
+    """
+    if out is None:
+        out = np.empty(len(u))
+
+    np.multiply(u, u, out=out)
+    out *= gamma
+    out += 2.0 * alpha * u * up
+    out += beta * up * up
+
+    return out
+
+
+def _ranks(fractions, npart):
+    return np.array([min(max(int(np.ceil(fraction * npart)), 1), npart) - 1 for fraction in fractions], dtype=int)
+
+
+def fractional_emittance(invariants, fractions, z_score=None):
+    """
+    Returns the emittances of the rms ellipses that contain the given fractions of the particles
+    (e.g. 0.9 for the 90% emittance). The particles are ranked with np.argpartition, which is O(npart).
+    If the invariants are from a random sample of the particles, z_score gives confidence bounds from
+    the order statistics of the sample (e.g. 1.96 for 95%).
+    :param invariants: Courant-Snyder invariants of the particles (with the rms Twiss parameters)
+    :param fractions: fractions (0, 1]
+    :param z_score: optional, also return the lower and upper bounds
+    :return: array of emittances, one per fraction (and arrays of lower and upper bounds if z_score is given)
+    """
+    npart = len(invariants)
+    fractions = np.asarray(fractions, dtype=float)
+
+    if npart == 0:
+        nans = np.full(len(fractions), np.nan)
+        return nans if z_score is None else (nans, nans, nans)
+
+    kth = _ranks(fractions, npart)
+
+    if z_score is None:
+        order = np.argpartition(invariants, np.unique(kth))
+        return invariants[order[kth]]
+
+    # Ranks of the bounds: npart * f -/+ z * sqrt(npart * f * (1 - f)) (normal approximation of the binomial)
+    spread = z_score * np.sqrt(npart * fractions * (1.0 - fractions))
+    kth_lower = np.clip(np.floor(kth - spread).astype(int), 0, npart - 1)
+    kth_upper = np.clip(np.ceil(kth + spread).astype(int), 0, npart - 1)
+
+    order = np.argpartition(invariants, np.unique(np.concatenate((kth_lower, kth, kth_upper))))
+
+    return invariants[order[kth]], invariants[order[kth_lower]], invariants[order[kth_upper]]
+
+
+def core_rows(invariants, fraction):
+    """
+    Returns the rows of the particles inside the ellipse that contains the given fraction of the particles
+    (in no particular order), all other particles are the halo.
+    :param invariants: Courant-Snyder invariants of the particles
+    :param fraction: fraction of particles in the core (0, 1]
+    :return: array of rows
+    """
+    if len(invariants) == 0:
+        return np.array([], dtype=int)
+
+    kth = _ranks([fraction], len(invariants))[0]
+
+    return np.argpartition(invariants, kth)[:kth + 1]
+
+
+def halo_count(invariants, emittance, halo_factor, npart=None, z_score=1.96):
+    """
+    Counts the halo particles, i.e. the particles outside the ellipse of halo_factor times the rms emittance
+    (a halo factor of 9 is an amplitude of 3 rms beam sizes). If the invariants are from a random sample,
+    the count is scaled to npart and an error is estimated from the binomial distribution.
+    :param invariants: Courant-Snyder invariants of all particles or of a random sample
+    :param emittance: rms emittance
+    :param halo_factor:
+    :param npart: total number of particles (default: no sampling)
+    :param z_score: width of the error estimate (1.96 for 95%)
+    :return: number of halo particles, error of the number
+    """
+    nsample = len(invariants)
+
+    if nsample == 0:
+        return 0.0, 0.0
+
+    count = float(np.count_nonzero(invariants > halo_factor * emittance))
+
+    if npart is None or npart == nsample:
+        return count, 0.0
+
+    fraction = count / nsample
+
+    return fraction * npart, z_score * npart * np.sqrt(fraction * (1.0 - fraction) / nsample)
@@ -6,6 +6,7 @@ from py_particle_processor_qt.gui.generate_envelope import Ui_Generate_Envelope
 from py_particle_processor_qt.gui.generate_twiss import Ui_Generate_Twiss
 from dans_pymodules import IonSpecies
 from py_particle_processor_qt.drivers.TraceWinDriver import *
+from py_particle_processor_qt.drivers.arraywrapper import ArrayWrapper
 
 class GenerateDistribution(object):
     """
@@ -127,12 +128,12 @@ class GenerateDistribution(object):
         x = x + self._z * xp
         y = y + self._z * yp
 
-        data = {'Step#0': {'x': ArrayWrapper(0.001 * np.array(x)),
-                           'px': ArrayWrapper(np.array(ion.gamma() * ion.beta() * xp)),
-                           'y': ArrayWrapper(0.001 * np.array(y)),
-                           'py': ArrayWrapper(np.array(ion.gamma() * ion.beta() * yp)),
-                           'z': ArrayWrapper(0.001 * np.array(self._z)),
-                           'pz': ArrayWrapper(np.array(ion.gamma() * ion.beta() * self._zp)),
+        data = {'Step#0': {'x': ArrayWrapper(0.001 * x),
+                           'px': ArrayWrapper(ion.gamma() * ion.beta() * xp),
+                           'y': ArrayWrapper(0.001 * y),
+                           'py': ArrayWrapper(ion.gamma() * ion.beta() * yp),
+                           'z': ArrayWrapper(0.001 * self._z),
+                           'pz': ArrayWrapper(ion.gamma() * ion.beta() * self._zp),
                            'id': ArrayWrapper(range(self._numpart + 1)),
                            'attrs': 0}}
 
@@ -174,12 +175,12 @@ class GenerateDistribution(object):
         x = x + self._z * xp
         y = y + self._z * yp
 
-        data = {'Step#0': {'x': 0.001 * np.array(x),
-                           'px': np.array(ion.gamma() * ion.beta() * xp),
-                           'y': 0.001 * np.array(y),
-                           'py': np.array(ion.gamma() * ion.beta() * yp),
-                           'z': 0.001 * np.array(self._z),
-                           'pz': np.array(ion.gamma() * ion.beta() * self._zp),
+        data = {'Step#0': {'x': 0.001 * x,
+                           'px': ion.gamma() * ion.beta() * xp,
+                           'y': 0.001 * y,
+                           'py': ion.gamma() * ion.beta() * yp,
+                           'z': 0.001 * self._z,
+                           'pz': ion.gamma() * ion.beta() * self._zp,
                            'id': range(self._numpart + 1),
                            'attrs': 0}}
 
@@ -221,12 +222,12 @@ class GenerateDistribution(object):
         x = x + self._z * xp
         y = y + self._z * yp
 
-        data = {'Step#0': {'x': 0.001 * np.array(x),
-                           'px': np.array(ion.gamma() * ion.beta() * xp),
-                           'y': 0.001 * np.array(y),
-                           'py': np.array(ion.gamma() * ion.beta() * yp),
-                           'z': 0.001 * np.array(self._z),
-                           'pz': np.array(ion.gamma() * ion.beta() * self._zp),
+        data = {'Step#0': {'x': 0.001 * x,
+                           'px': ion.gamma() * ion.beta() * xp,
+                           'y': 0.001 * y,
+                           'py': ion.gamma() * ion.beta() * yp,
+                           'z': 0.001 * self._z,
+                           'pz': ion.gamma() * ion.beta() * self._zp,
                            'id': range(self._numpart + 1),
                            'attrs': 0}}
 
@@ -269,12 +270,12 @@ class GenerateDistribution(object):
         x = x + self._z * xp
         y = y + self._z * yp
 
-        data = {'Step#0': {'x': 0.001 * np.array(x),
-                           'px': np.array(ion.gamma() * ion.beta() * xp),
-                           'y': 0.001 * np.array(y),
-                           'py': np.array(ion.gamma() * ion.beta() * yp),
-                           'z': 0.001 * np.array(self._z),
-                           'pz': np.array(ion.gamma() * ion.beta() * self._zp),
+        data = {'Step#0': {'x': 0.001 * x,
+                           'px': ion.gamma() * ion.beta() * xp,
+                           'y': 0.001 * y,
+                           'py': ion.gamma() * ion.beta() * yp,
+                           'z': 0.001 * self._z,
+                           'pz': ion.gamma() * ion.beta() * self._zp,
                            'id': range(self._numpart + 1),
                            'attrs': 0}}
 
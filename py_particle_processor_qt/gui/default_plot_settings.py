@@ -11,7 +11,7 @@ from PyQt5 import QtCore, QtGui, QtWidgets
 class Ui_DefaultPlotSettingsWindow(object):
     def setupUi(self, DefaultPlotSettingsWindow):
         DefaultPlotSettingsWindow.setObjectName("DefaultPlotSettingsWindow")
-        DefaultPlotSettingsWindow.resize(377, 251)
+        DefaultPlotSettingsWindow.resize(377, 281)
         sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Fixed, QtWidgets.QSizePolicy.Fixed)
         sizePolicy.setHorizontalStretch(0)
         sizePolicy.setVerticalStretch(0)
@@ -25,7 +25,7 @@ class Ui_DefaultPlotSettingsWindow(object):
         self.centralwidget.setSizePolicy(sizePolicy)
         self.centralwidget.setObjectName("centralwidget")
         self.verticalLayoutWidget = QtWidgets.QWidget(self.centralwidget)
-        self.verticalLayoutWidget.setGeometry(QtCore.QRect(0, 0, 374, 247))
+        self.verticalLayoutWidget.setGeometry(QtCore.QRect(0, 0, 374, 277))
         self.verticalLayoutWidget.setObjectName("verticalLayoutWidget")
         self.verticalLayout_3 = QtWidgets.QVBoxLayout(self.verticalLayoutWidget)
         self.verticalLayout_3.setSpacing(0)
@@ -147,6 +147,25 @@ class Ui_DefaultPlotSettingsWindow(object):
         self.redraw_enabled.setChecked(True)
         self.redraw_enabled.setObjectName("redraw_enabled")
         self.gridLayout.addWidget(self.redraw_enabled, 5, 1, 1, 1, QtCore.Qt.AlignHCenter|QtCore.Qt.AlignVCenter)
+        self.mode_label = QtWidgets.QLabel(self.verticalLayoutWidget)
+        self.mode_label.setObjectName("mode_label")
+        self.gridLayout.addWidget(self.mode_label, 6, 0, 1, 1, QtCore.Qt.AlignHCenter|QtCore.Qt.AlignVCenter)
+        self.mode_combo = QtWidgets.QComboBox(self.verticalLayoutWidget)
+        self.mode_combo.setObjectName("mode_combo")
+        self.mode_combo.addItem("")
+        self.mode_combo.addItem("")
+        self.gridLayout.addWidget(self.mode_combo, 6, 1, 1, 1, QtCore.Qt.AlignHCenter|QtCore.Qt.AlignVCenter)
+        self.scale_combo = QtWidgets.QComboBox(self.verticalLayoutWidget)
+        self.scale_combo.setObjectName("scale_combo")
+        self.scale_combo.addItem("")
+        self.scale_combo.addItem("")
+        self.gridLayout.addWidget(self.scale_combo, 6, 2, 1, 1, QtCore.Qt.AlignHCenter|QtCore.Qt.AlignVCenter)
+        self.bins_input = QtWidgets.QSpinBox(self.verticalLayoutWidget)
+        self.bins_input.setMinimum(10)
+        self.bins_input.setMaximum(2000)
+        self.bins_input.setProperty("value", 200)
+        self.bins_input.setObjectName("bins_input")
+        self.gridLayout.addWidget(self.bins_input, 6, 3, 1, 1, QtCore.Qt.AlignHCenter|QtCore.Qt.AlignVCenter)
         self.verticalLayout_3.addLayout(self.gridLayout)
         spacerItem1 = QtWidgets.QSpacerItem(20, 10, QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Fixed)
         self.verticalLayout_3.addItem(spacerItem1)
@@ -225,6 +244,12 @@ class Ui_DefaultPlotSettingsWindow(object):
         self.tr_enabled.setText(_translate("DefaultPlotSettingsWindow", "Enabled"))
         self.redraw_label.setText(_translate("DefaultPlotSettingsWindow", "Redraw On Selection: "))
         self.redraw_enabled.setText(_translate("DefaultPlotSettingsWindow", "Enabled"))
+        self.mode_label.setText(_translate("DefaultPlotSettingsWindow", "Mode"))
+        self.mode_combo.setItemText(0, _translate("DefaultPlotSettingsWindow", "Scatter"))
+        self.mode_combo.setItemText(1, _translate("DefaultPlotSettingsWindow", "Heatmap"))
+        self.scale_combo.setItemText(0, _translate("DefaultPlotSettingsWindow", "Linear"))
+        self.scale_combo.setItemText(1, _translate("DefaultPlotSettingsWindow", "Log"))
+        self.bins_input.setToolTip(_translate("DefaultPlotSettingsWindow", "Number of bins per axis of the heatmap"))
         self.redraw_button.setText(_translate("DefaultPlotSettingsWindow", "Redraw"))
         self.cancel_button.setText(_translate("DefaultPlotSettingsWindow", "Cancel"))
         self.apply_button.setText(_translate("DefaultPlotSettingsWindow", "Apply"))
@@ -139,6 +139,22 @@ class Ui_MainWindow(object):
         self.gridLayout_4.addLayout(self.gridLayout_3, 0, 0, 1, 1)
         self.tabWidget.addTab(self.tab, "")
         self.gridLayout.addWidget(self.splitter_2, 0, 0, 1, 1)
+        self.timeline_layout = QtWidgets.QHBoxLayout()
+        self.timeline_layout.setSpacing(6)
+        self.timeline_layout.setObjectName("timeline_layout")
+        self.timeline_label = QtWidgets.QLabel(self.centralWidget)
+        self.timeline_label.setObjectName("timeline_label")
+        self.timeline_layout.addWidget(self.timeline_label)
+        self.timeline_slider = QtWidgets.QSlider(self.centralWidget)
+        self.timeline_slider.setMaximum(0)
+        self.timeline_slider.setOrientation(QtCore.Qt.Horizontal)
+        self.timeline_slider.setObjectName("timeline_slider")
+        self.timeline_layout.addWidget(self.timeline_slider)
+        self.timeline_value = QtWidgets.QLabel(self.centralWidget)
+        self.timeline_value.setMinimumSize(QtCore.QSize(60, 0))
+        self.timeline_value.setObjectName("timeline_value")
+        self.timeline_layout.addWidget(self.timeline_value)
+        self.gridLayout.addLayout(self.timeline_layout, 1, 0, 1, 1)
         MainWindow.setCentralWidget(self.centralWidget)
         self.mainToolBar = QtWidgets.QToolBar(MainWindow)
         sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Minimum)
@@ -245,6 +261,8 @@ class Ui_MainWindow(object):
         self.treeWidget.headerItem().setText(2, _translate("MainWindow", "Name"))
         self.properties_label.setText(_translate("MainWindow", "Properties:"))
         self.tabWidget.setTabText(self.tabWidget.indexOf(self.tab), _translate("MainWindow", "Default Plots"))
+        self.timeline_label.setText(_translate("MainWindow", "Step:"))
+        self.timeline_value.setText(_translate("MainWindow", "0"))
         self.menu_File.setTitle(_translate("MainWindow", "File"))
         self.menuHelp.setTitle(_translate("MainWindow", "Help"))
         self.menuTools.setTitle(_translate("MainWindow", "Tools"))
@@ -11,7 +11,7 @@ from PyQt5 import QtCore, QtGui, QtWidgets
 class Ui_PlotSettingsWindow(object):
     def setupUi(self, PlotSettingsWindow):
         PlotSettingsWindow.setObjectName("PlotSettingsWindow")
-        PlotSettingsWindow.resize(317, 186)
+        PlotSettingsWindow.resize(317, 216)
         sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Fixed, QtWidgets.QSizePolicy.Fixed)
         sizePolicy.setHorizontalStretch(0)
         sizePolicy.setVerticalStretch(0)
@@ -25,7 +25,7 @@ class Ui_PlotSettingsWindow(object):
         self.centralwidget.setSizePolicy(sizePolicy)
         self.centralwidget.setObjectName("centralwidget")
         self.verticalLayoutWidget = QtWidgets.QWidget(self.centralwidget)
-        self.verticalLayoutWidget.setGeometry(QtCore.QRect(0, 0, 317, 183))
+        self.verticalLayoutWidget.setGeometry(QtCore.QRect(0, 0, 317, 213))
         self.verticalLayoutWidget.setObjectName("verticalLayoutWidget")
         self.verticalLayout_3 = QtWidgets.QVBoxLayout(self.verticalLayoutWidget)
         self.verticalLayout_3.setSpacing(0)
@@ -105,6 +105,28 @@ class Ui_PlotSettingsWindow(object):
         self.en_label.setText("")
         self.en_label.setObjectName("en_label")
         self.gridLayout.addWidget(self.en_label, 3, 0, 1, 1, QtCore.Qt.AlignHCenter|QtCore.Qt.AlignVCenter)
+        self.mode_label = QtWidgets.QLabel(self.verticalLayoutWidget)
+        self.mode_label.setObjectName("mode_label")
+        self.gridLayout.addWidget(self.mode_label, 4, 0, 1, 1, QtCore.Qt.AlignHCenter|QtCore.Qt.AlignVCenter)
+        self.horizontalLayout_2 = QtWidgets.QHBoxLayout()
+        self.horizontalLayout_2.setObjectName("horizontalLayout_2")
+        self.mode_combo = QtWidgets.QComboBox(self.verticalLayoutWidget)
+        self.mode_combo.setObjectName("mode_combo")
+        self.mode_combo.addItem("")
+        self.mode_combo.addItem("")
+        self.horizontalLayout_2.addWidget(self.mode_combo)
+        self.scale_combo = QtWidgets.QComboBox(self.verticalLayoutWidget)
+        self.scale_combo.setObjectName("scale_combo")
+        self.scale_combo.addItem("")
+        self.scale_combo.addItem("")
+        self.horizontalLayout_2.addWidget(self.scale_combo)
+        self.bins_input = QtWidgets.QSpinBox(self.verticalLayoutWidget)
+        self.bins_input.setMinimum(10)
+        self.bins_input.setMaximum(2000)
+        self.bins_input.setProperty("value", 200)
+        self.bins_input.setObjectName("bins_input")
+        self.horizontalLayout_2.addWidget(self.bins_input)
+        self.gridLayout.addLayout(self.horizontalLayout_2, 4, 1, 1, 1)
         self.verticalLayout_3.addLayout(self.gridLayout)
         spacerItem1 = QtWidgets.QSpacerItem(20, 10, QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Fixed)
         self.verticalLayout_3.addItem(spacerItem1)
@@ -157,6 +179,12 @@ class Ui_PlotSettingsWindow(object):
         self.param_combo_c.setItemText(4, _translate("PlotSettingsWindow", "PY"))
         self.param_combo_c.setItemText(5, _translate("PlotSettingsWindow", "PZ"))
         self.param_enabled.setText(_translate("PlotSettingsWindow", "Enabled"))
+        self.mode_label.setText(_translate("PlotSettingsWindow", "Mode"))
+        self.mode_combo.setItemText(0, _translate("PlotSettingsWindow", "Scatter"))
+        self.mode_combo.setItemText(1, _translate("PlotSettingsWindow", "Heatmap"))
+        self.scale_combo.setItemText(0, _translate("PlotSettingsWindow", "Linear"))
+        self.scale_combo.setItemText(1, _translate("PlotSettingsWindow", "Log"))
+        self.bins_input.setToolTip(_translate("PlotSettingsWindow", "Number of bins per axis of the heatmap"))
         self.redraw_button.setText(_translate("PlotSettingsWindow", "Redraw"))
         self.cancel_button.setText(_translate("PlotSettingsWindow", "Cancel"))
         self.apply_button.setText(_translate("PlotSettingsWindow", "Apply"))
@@ -0,0 +1,235 @@
+import numpy as np
+import threading
+
+__author__ = "Philip Weigel, Daniel Winklehner"
+__doc__ = """Level of detail for 2D plots of many particles. Depending on the visible range and the
+size of the plot in pixels, the particles of a step are drawn either as a stratified sample of the
+particles in view (every occupied cell of a coarse grid keeps at least one particle, so the halo
+stays visible) or, if there are many more particles in view than pixels, as a density image.
+Every particle has a fixed random key and is drawn if its key is below the sampling probability
+of its cell, so zooming in only adds particles to the ones already drawn. The same binning gives
+the 2D histograms of the heatmap plots.
+"""
+
+MAX_POINTS = 200000  # Most points drawn per scatter plot
+POINTS_PER_PIXEL = 0.5  # Sample size relative to the number of pixels of the plot
+CELL_PIXELS = 8  # Size of the cells of the stratified sample (pixels)
+DENSITY_PARTICLES_PER_PIXEL = 8.0  # Particles in view per pixel above which a density image is drawn
+DENSITY_PIXELS = 2  # Size of the bins of the density image (pixels)
+VIEW_PADDING = 0.02  # Margin around the data in a view, relative to the range of the data
+
+_keys = {}  # Keys of the most particles so far per seed, the keys of fewer particles are a prefix
+_keys_lock = threading.Lock()
+
+
+def sample_keys(npart, seed=0):
+    """
+    Returns the fixed random keys of the particles (cached, read-only)
+    :param npart: number of particles
+    :param seed:
+    :return: (npart,) float32 array of keys in [0, 1)
+    """
+    with _keys_lock:
+        keys = _keys.get(seed)
+
+        if keys is None or len(keys) < npart:
+            keys = np.random.RandomState(seed).random_sample(npart).astype(np.float32)
+            keys.flags.writeable = False
+            _keys[seed] = keys
+
+    return keys[:npart]
+
+
+def same_view(view, other, rtol=1e-6):
+    """
+    :param view: (xrange, yrange, width, height)
+    :param other: (xrange, yrange, width, height) or None
+    :param rtol: tolerance relative to the ranges
+    :return: True if the views only differ by rounding
+    """
+    if other is None or tuple(view[2:]) != tuple(other[2:]):
+        return False
+
+    return all(abs(a - b) <= rtol * (r[1] - r[0]) for r, o in zip(view[:2], other[:2]) for a, b in zip(r, o))
+
+
+def view_range(ranges, padding=VIEW_PADDING):
+    """
+    Returns the view that shows all data ranges with a margin
+    :param ranges: list of ((xmin, xmax), (ymin, ymax))
+    :param padding: margin relative to the range
+    :return: ((xmin, xmax), (ymin, ymax))
+    """
+    ranges = np.array(ranges, dtype=float)
+    view = []
+
+    for vmin, vmax in zip(ranges[:, :, 0].min(axis=0), ranges[:, :, 1].max(axis=0)):
+        vmin, vmax = widen(vmin, vmax)
+        margin = padding * (vmax - vmin)
+        view.append((vmin - margin, vmax + margin))
+
+    return tuple(view)
+
+
+def widen(vmin, vmax):
+    """
+    :return: (min, max), widened if the range is empty
+    """
+    vmin, vmax = float(vmin), float(vmax)
+
+    if vmax <= vmin:
+        width = abs(vmin) * 1e-6 if vmin != 0.0 else 1e-6
+        return vmin - width, vmin + width
+
+    return vmin, vmax
+
+
+def data_range(values):
+    """
+    :return: (min, max) of the finite values, widened if all values are the same
+    """
+    values = values[np.isfinite(values)]
+
+    if len(values) == 0:
+        return 0.0, 1.0
+
+    return widen(values.min(), values.max())
+
+
+def cell_indices(x, y, xrange, yrange, shape, out=None):
+    """
+    Returns the flat index of the grid cell of every particle, -1 for particles outside of the grid
+    :param x:
+    :param y:
+    :param xrange: (min, max) of the grid
+    :param yrange: (min, max) of the grid
+    :param shape: (nx, ny) number of cells
+    :param out: optional (npart,) int64 buffer
+    :return: (npart,) array of indices into the flattened (nx, ny) grid
+    """
+    nx, ny = shape
+
+    if out is None:
+        out = np.empty(len(x), dtype=np.int64)
+
+    with np.errstate(invalid="ignore"):
+        ix = np.floor((x - xrange[0]) * (nx / (xrange[1] - xrange[0])))
+        iy = np.floor((y - yrange[0]) * (ny / (yrange[1] - yrange[0])))
+
+        # The upper edges belong to the last cells (as in np.histogram2d)
+        ix[x == xrange[1]] = nx - 1
+        iy[y == yrange[1]] = ny - 1
+
+        outside = ~((ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny))  # NaN is outside as well
+
+    ix[outside] = 0
+    iy[outside] = 0
+
+    np.multiply(ix, ny, out=ix)
+    ix += iy
+    out[:] = ix
+    out[outside] = -1
+
+    return out
+
+
+def density_image(cells, shape):
+    """
+    Counts the particles per cell
+    :param cells: cell indices from cell_indices()
+    :param shape: (nx, ny)
+    :return: (nx, ny) array of counts
+    """
+    return np.bincount(cells[cells >= 0], minlength=shape[0] * shape[1]).reshape(shape)
+
+
+def histogram(x, y, xrange, yrange, bins):
+    """
+    2D histogram of the particles (as np.histogram2d, but a single pass of bin indices and np.bincount)
+    :param x:
+    :param y:
+    :param xrange: (min, max) in x
+    :param yrange: (min, max) in y
+    :param bins: (nx, ny) number of bins
+    :return: (nx, ny) array of counts
+    """
+    return density_image(cell_indices(x, y, xrange, yrange, bins), bins)
+
+
+def scaled_density(counts, scale="linear"):
+    """
+    Converts counts into image values between 0 (empty) and 1 (maximum)
+    :param counts: array of counts
+    :param scale: "linear" or "log"
+    :return: float array
+    """
+    if scale == "log":
+        values = np.log1p(counts.astype(float))
+    else:
+        values = counts.astype(float)
+
+    vmax = values.max() if values.size > 0 else 0.0
+
+    if vmax > 0.0:
+        values /= vmax
+
+    return values
+
+
+def stratified_sample(cells, keys, nmax, ncells):
+    """
+    Selects about nmax particles, proportionally to the number of particles per cell,
+    but at least one particle of every occupied cell
+    :param cells: cell indices from cell_indices() (particles outside of the grid are never selected)
+    :param keys: random keys of the particles from sample_keys()
+    :param nmax: sample size
+    :param ncells: number of cells
+    :return: rows of the selected particles
+    """
+    inside = cells >= 0
+    counts = np.bincount(cells[inside], minlength=ncells)
+    nview = int(counts.sum())
+
+    if nview <= nmax:
+        return np.flatnonzero(inside)
+
+    with np.errstate(divide="ignore"):
+        probability = np.maximum(nmax / float(nview), 1.0 / counts)
+
+    return np.flatnonzero(inside & (keys < probability[np.where(inside, cells, 0)]))
+
+
+def decimate(x, y, keys, xrange, yrange, width, height, max_points=MAX_POINTS):
+    """
+    Decides how to draw the particles in the view
+    :param x:
+    :param y:
+    :param keys: random keys of the particles from sample_keys()
+    :param xrange: visible (min, max) in x
+    :param yrange: visible (min, max) in y
+    :param width: width of the plot (pixels)
+    :param height: height of the plot (pixels)
+    :param max_points: most points to draw
+    :return: dictionary with "mode" "points" and the "rows" to draw or mode "density" and the "image"
+             (counts per bin) covering the "rect" (x, y, width, height)
+    """
+    width, height = max(int(width), 1), max(int(height), 1)
+
+    density_shape = (max(width // DENSITY_PIXELS, 1), max(height // DENSITY_PIXELS, 1))
+    cells = cell_indices(x, y, xrange, yrange, density_shape)
+    nview = np.count_nonzero(cells >= 0)
+
+    if nview > DENSITY_PARTICLES_PER_PIXEL * width * height:
+        return {"mode": "density",
+                "image": density_image(cells, density_shape),
+                "rect": (xrange[0], yrange[0], xrange[1] - xrange[0], yrange[1] - yrange[0])}
+
+    nmax = int(min(max_points, POINTS_PER_PIXEL * width * height))
+
+    if nview <= nmax:
+        return {"mode": "points", "rows": np.flatnonzero(cells >= 0)}
+
+    cell_shape = (max(width // CELL_PIXELS, 1), max(height // CELL_PIXELS, 1))
+    cells = cell_indices(x, y, xrange, yrange, cell_shape, out=cells)
+
+    return {"mode": "points", "rows": stratified_sample(cells, keys, nmax, cell_shape[0] * cell_shape[1])}
@@ -0,0 +1,110 @@
+import numpy as np
+
+__author__ = "Daniel Winklehner, Philip Weigel"
+__doc__ = """Per-step statistics of the particle distribution. The MomentEngine takes one
+(nkeys, npart) block of particle data per step and computes the centroid, the central
+moments up to fourth order and the covariance matrix of all keys in a single pass over
+the block. All results are written into arrays that are allocated once for all steps.
+"""
+
+
+class MomentEngine(object):
+    """
+    Centroid, central moments (order 2 to 4) and covariance matrix per step for a set of keys.
+    The moments are population moments (normalized by the number of particles), e.g. the
+    rms size of a centered beam is sqrt(m2) and the halo parameter is m4 / m2^2 - 1.
+    """
+
+    def __init__(self, keys, nsteps, order=4, covariance=True):
+        """
+        :param keys: names of the rows of the blocks passed to add_step()
+        :param nsteps: number of steps
+        :param order: highest central moment to compute (1 to 4)
+        :param covariance: compute the (nkeys, nkeys) covariance matrix per step
+        """
+        assert 1 <= order <= 4, "Order of the moments has to be between 1 and 4, got {}".format(order)
+
+        self._keys = list(keys)
+        self._nsteps = int(nsteps)
+        self._order = order
+        self._covariance = covariance
+
+        nkeys = len(self._keys)
+
+        self.npart = np.zeros(self._nsteps, dtype=np.int64)
+        self.mean = np.full((self._nsteps, nkeys), np.nan)
+        self.m2 = np.full((self._nsteps, nkeys), np.nan) if order >= 2 else None
+        self.m3 = np.full((self._nsteps, nkeys), np.nan) if order >= 3 else None
+        self.m4 = np.full((self._nsteps, nkeys), np.nan) if order >= 4 else None
+        self.cov = np.full((self._nsteps, nkeys, nkeys), np.nan) if covariance else None
+
+        # Work buffers for the centered data and its square, grown to the largest step seen
+        self._centered = np.empty((nkeys, 0))
+        self._squared = np.empty((nkeys, 0))
+
+    def _work_buffers(self, npart):
+
+        if self._centered.shape[1] < npart:
+            self._centered = np.empty((len(self._keys), npart))
+            self._squared = np.empty((len(self._keys), npart)) if self._order >= 3 else self._squared
+
+        return self._centered[:, :npart], self._squared[:, :npart]
+
+    def add_step(self, i, block):
+        """
+        Computes the moments of one step
+        :param i: index of the step in the result arrays
+        :param block: (nkeys, npart) array, one row per key
+        :return: 0
+        """
+        block = np.asarray(block)
+        npart = block.shape[1]
+
+        self.npart[i] = npart
+
+        if npart == 0:
+            return 0
+
+        np.mean(block, axis=1, out=self.mean[i])
+
+        if self._order < 2 and not self._covariance:
+            return 0
+
+        centered, squared = self._work_buffers(npart)
+        np.subtract(block, self.mean[i][:, np.newaxis], out=centered)
+
+        if self._order >= 2:
+            np.einsum("ij,ij->i", centered, centered, out=self.m2[i])
+            self.m2[i] /= npart
+
+        if self._order >= 3:
+            np.multiply(centered, centered, out=squared)
+
+            np.einsum("ij,ij->i", squared, centered, out=self.m3[i])
+            self.m3[i] /= npart
+
+            if self._order >= 4:
+                np.einsum("ij,ij->i", squared, squared, out=self.m4[i])
+                self.m4[i] /= npart
+
+        if self._covariance:
+            np.einsum("ij,kj->ik", centered, centered, out=self.cov[i])
+            self.cov[i] /= npart
+
+        return 0
+
+    def keys(self):
+        return self._keys
+
+    def results(self):
+        """
+        :return: dictionary with the (nsteps,) particle numbers, (nsteps, nkeys) arrays "mean", "m2", "m3", "m4",
+                 the (nsteps, nkeys, nkeys) array "cov" (None if not computed) and the list of "keys"
+        """
+        return {"keys": self._keys,
+                "npart": self.npart,
+                "mean": self.mean,
+                "m2": self.m2,
+                "m3": self.m3,
+                "m4": self.m4,
+                "cov": self.cov}
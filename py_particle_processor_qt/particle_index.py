@@ -0,0 +1,101 @@
+from py_particle_processor_qt.drivers.h5datasource import LRUCache
+import numpy as np
+
+__author__ = "Daniel Winklehner, Philip Weigel"
+__doc__ = """An index of the particle IDs of a dataset. Codes like OPAL drop lost particles,
+so row i of one step is not necessarily the same particle as row i of the next step.
+The index holds the sorted IDs of the steps (built lazily, kept in an LRU cache with a
+byte budget) and finds the row of a particle in any step with a binary search.
+"""
+
+INDEX_CACHE_BYTES = 256 * 1024 ** 2  # Memory for the ID tables of the steps per dataset
+
+
+class ParticleIndex(object):
+    """
+    Sorted particle IDs and the matching rows for every step of a datasource.
+    If the datasource has no 'id' column, the row number is used as ID.
+    """
+
+    def __init__(self, datasource, nsteps, max_bytes=INDEX_CACHE_BYTES):
+        self._datasource = datasource
+        self._nsteps = nsteps
+
+        # step: (3, npart) array of the ids in row order, the sorted ids and the rows of the sorted ids
+        self._tables = LRUCache(max_bytes=max_bytes)
+
+    def _table(self, step):
+
+        table = self._tables.get(step)
+
+        if table is not None:
+            return table
+
+        step_data = self._datasource.get("Step#{}".format(step))
+        ids = step_data.get("id")
+
+        if ids is None:
+            ids = np.arange(len(step_data.get("x")[()]))
+        else:
+            ids = np.asarray(ids[()]).astype(np.int64)
+
+        order = np.argsort(ids, kind="mergesort")
+
+        # One array per step, so other threads never see a half-built step
+        table = np.stack([ids, ids[order], order])
+        table.flags.writeable = False
+
+        return self._tables.put(step, table)
+
+    def clear(self):
+        self._tables.clear()
+
+    def has_ids(self):
+        step_data = self._datasource.get("Step#0")
+        return step_data is not None and "id" in step_data
+
+    def ids(self, step):
+        """
+        Returns the particle IDs of a step in row order
+        """
+        return self._table(step)[0]
+
+    def npart(self, step):
+        return len(self.ids(step))
+
+    def row(self, step, particle_id):
+        """
+        Returns the row of a particle in a step or -1 if the particle isn't there (anymore)
+        """
+        return int(self.rows(step, [particle_id])[0])
+
+    def rows(self, step, particle_ids):
+        """
+        Returns the rows of a set of particles in a step
+        :param step: int
+        :param particle_ids: array_like of IDs
+        :return: array of rows, -1 for particles that aren't in this step
+        """
+        _, sorted_ids, order = self._table(step)
+        particle_ids = np.asarray(particle_ids, dtype=np.int64)
+
+        if len(sorted_ids) == 0:
+            return np.full(len(particle_ids), -1, dtype=np.int64)
+
+        positions = np.searchsorted(sorted_ids, particle_ids)
+        positions = np.minimum(positions, len(sorted_ids) - 1)
+        found = sorted_ids[positions] == particle_ids
+
+        return np.where(found, order[positions], -1)
+
+    def survivors(self, step, later_step):
+        """
+        Returns a mask over the rows of 'step' of the particles that are still present in 'later_step'
+        """
+        return self.rows(later_step, self.ids(step)) >= 0
+
+    def lost(self, step, later_step):
+        """
+        Returns a mask over the rows of 'step' of the particles that are gone in 'later_step'
+        """
+        return ~self.survivors(step, later_step)
@@ -1,5 +1,8 @@
 from py_particle_processor_qt.gui.plot_settings import Ui_PlotSettingsWindow
 from py_particle_processor_qt.gui.default_plot_settings import Ui_DefaultPlotSettingsWindow
+from py_particle_processor_qt.dataset import colors
+from py_particle_processor_qt.timeline import Timeline
+from py_particle_processor_qt import lod
 from PyQt5 import QtGui, QtWidgets, QtCore
 import pyqtgraph as pg
 import numpy as np
@@ -7,6 +10,320 @@ import numpy as np
 __author__ = "Philip Weigel, Daniel Winklehner"
 __doc__ = """Plotting objects and associated GUI objects used in the PyParticleProcessor."""
 
+LOD_DELAY_MS = 100  # Time after the last change of the view range before the particles are redrawn
+MODES = ["scatter", "heatmap"]  # Rendering modes of the 2D plots
+SCALES = ["linear", "log"]  # Color scales of the heatmaps
+
+# Color map of the heatmaps (empty bins are transparent)
+HEATMAP_LUT = pg.ColorMap(np.linspace(0.0, 1.0, 5),
+                          np.array([[68, 1, 84, 255], [59, 82, 139, 255], [33, 145, 140, 255],
+                                    [94, 201, 98, 255], [253, 231, 37, 255]], dtype=np.ubyte)).getLookupTable(
+    0.0, 1.0, 256, alpha=True)
+HEATMAP_LUT[0, 3] = 0
+
+
+class LODScatter(object):
+    """
+    A scatter plot of one step of a dataset that draws a level of detail depending on the view (see lod.py):
+    a stratified sample of the particles in view or a density image in the color of the dataset.
+    The first level of detail is prepared with the data (see PlotObject.prepare_data()), it is refined
+    in the thread pool (see LODWorker) whenever the view range or the size of the plot changes.
+    """
+
+    def __init__(self, graphics_view, color, thread_pool):
+        self._graphics_view = graphics_view
+        self._view_box = graphics_view.getViewBox()
+        self._color = color
+        self._thread_pool = thread_pool
+        self._x = np.empty(0)
+        self._y = np.empty(0)
+        self._keys = np.empty(0, dtype=np.float32)
+        self._view = None  # (xrange, yrange, width, height) the drawn level of detail was made for
+        self._generation = 0  # Number of the latest refinement, older ones are dropped
+        self._worker = None  # LODWorker of the latest refinement
+
+        self._scatter = pg.ScatterPlotItem(pen=pg.mkPen(color), brush='b', size=1.0, pxMode=True)
+        self._image = pg.ImageItem()
+        self._image.setVisible(False)
+
+        self._graphics_view.addItem(self._scatter)
+        self._graphics_view.addItem(self._image)
+
+        # Zooming and panning change the range many times, so the refinement waits until the view is still
+        self._timer = QtCore.QTimer()
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(LOD_DELAY_MS)
+        self._timer.timeout.connect(self.refresh)
+        self._view_box.sigRangeChanged.connect(self._timer.start)
+        self._view_box.sigResized.connect(self._timer.start)
+
+    def cancel(self):
+        """
+        Drops the refinement that is still running
+        """
+        self._generation += 1
+        self._worker = None
+
+        return 0
+
+    def data_range(self):
+        """
+        :return: ((xmin, xmax), (ymin, ymax)) of the data
+        """
+        return lod.data_range(self._x), lod.data_range(self._y)
+
+    def detach(self):
+        """
+        Removes the items from the plot and stops following the view
+        """
+        self.cancel()
+        self._timer.stop()
+        self._view_box.sigRangeChanged.disconnect(self._timer.start)
+        self._view_box.sigResized.disconnect(self._timer.start)
+        self._graphics_view.removeItem(self._scatter)
+        self._graphics_view.removeItem(self._image)
+
+    def draw(self, result, view):
+        """
+        Draws a level of detail (only the rows or the image, the particles were decimated already)
+        :param result: result of lod.decimate()
+        :param view: (xrange, yrange, width, height) the result was made for
+        """
+        if result["mode"] == "density":
+            counts = result["image"]
+
+            # Color of the dataset, opacity grows with the log of the density
+            rgba = np.empty(counts.shape + (4,), dtype=np.ubyte)
+            rgba[..., :3] = pg.mkColor(self._color).getRgb()[:3]
+            rgba[..., 3] = 255.0 * np.log1p(counts) / max(np.log1p(counts.max()), 1.0)
+
+            self._image.setImage(rgba, autoLevels=False)
+            self._image.setRect(QtCore.QRectF(*result["rect"]))
+            self._image.setVisible(True)
+            self._scatter.setData(x=[], y=[])
+
+        else:
+            rows = result["rows"]
+            self._scatter.setData(x=self._x[rows], y=self._y[rows])
+            self._image.setVisible(False)
+
+        self._view = view
+
+        return 0
+
+    def refresh(self):
+        """
+        Refines the level of detail for the current view in the thread pool, unless it was made for this view
+        """
+        self._timer.stop()  # A refinement that is still pending would draw the same view again
+
+        xrange, yrange = self._view_box.viewRange()
+        view = (tuple(xrange), tuple(yrange), int(self._view_box.width()), int(self._view_box.height()))
+
+        if lod.same_view(view, self._view):
+            return 0
+
+        self.cancel()
+        generation = self._generation
+
+        self._worker = LODWorker(generation, self._x, self._y, self._keys, view,
+                                 lambda: generation != self._generation)
+        self._worker.signals().ready.connect(self._refined)
+
+        self._thread_pool.start(self._worker)
+
+        return 0
+
+    def _refined(self, generation, worker, view, result):
+        """
+        Draws a refinement that was made by the worker (in the GUI thread)
+        """
+        if generation != self._generation:
+            return 1  # Superseded
+
+        self._worker = None
+
+        return self.draw(result, view)
+
+    def set_data(self, x, y, keys):
+        """
+        Sets the particles to draw, they are drawn with the next draw() or refresh()
+        :param x: x values of all particles
+        :param y: y values of all particles
+        :param keys: random keys of the particles from lod.sample_keys()
+        """
+        self.cancel()  # A refinement of the old particles must not be drawn
+        self._x, self._y, self._keys = np.asarray(x), np.asarray(y), keys
+        self._view = None
+
+        return 0
+
+
+class HeatmapLayer(object):
+    """
+    A 2D histogram of one step of a dataset, drawn as an image. The particles are binned once,
+    zooming and panning only redraw the image.
+    """
+
+    def __init__(self, graphics_view, bins=200, scale="linear"):
+        self._graphics_view = graphics_view
+        self._bins = (int(bins), int(bins))
+        self._scale = scale
+        self._range = ((0.0, 1.0), (0.0, 1.0))
+
+        self._image = pg.ImageItem()
+        self._image.setLookupTable(HEATMAP_LUT)
+        self._graphics_view.addItem(self._image)
+
+    def data_range(self):
+        """
+        :return: ((xmin, xmax), (ymin, ymax)) of the histogram
+        """
+        return self._range
+
+    def cancel(self):
+        return 0
+
+    def detach(self):
+        self._graphics_view.removeItem(self._image)
+
+    def refresh(self):
+        return 0
+
+    @staticmethod
+    def histogram(x, y, bins=200, scale="linear", ranges=None):
+        """
+        Bins the particles (doesn't touch any items, so it can run in a worker thread)
+        :param x: x values of all particles
+        :param y: y values of all particles
+        :param bins: number of bins per axis
+        :param scale: "linear" or "log"
+        :param ranges: optional ((xmin, xmax), (ymin, ymax)) of the histogram, default: range of the data
+        :return: image (values between 0 and 1), ranges of the histogram
+        """
+        if ranges is None:
+            ranges = (lod.data_range(x), lod.data_range(y))
+        else:
+            ranges = (lod.widen(*ranges[0]), lod.widen(*ranges[1]))
+
+        counts = lod.histogram(np.asarray(x), np.asarray(y), ranges[0], ranges[1], (int(bins), int(bins)))
+
+        return lod.scaled_density(counts, scale), ranges
+
+    def set_data(self, x, y, ranges=None):
+        """
+        Bins the particles and draws the histogram
+        :param x: x values of all particles
+        :param y: y values of all particles
+        :param ranges: optional ((xmin, xmax), (ymin, ymax)) of the histogram, default: range of the data
+        """
+        return self.set_image(*self.histogram(x, y, bins=self._bins[0], scale=self._scale, ranges=ranges))
+
+    def set_image(self, image, ranges):
+        """
+        Draws a histogram from histogram()
+        :param image: (nx, ny) values between 0 and 1
+        :param ranges: ((xmin, xmax), (ymin, ymax)) of the histogram
+        """
+        self._range = ranges
+        (xmin, xmax), (ymin, ymax) = ranges
+
+        self._image.setImage(image, levels=(0.0, 1.0))
+        self._image.setRect(QtCore.QRectF(xmin, ymin, xmax - xmin, ymax - ymin))
+
+        return 0
+
+
+class PlotDataSignals(QtCore.QObject):
+    """
+    Signals of a PlotDataWorker (or LODWorker). They are emitted in the worker thread and delivered in the
+    GUI thread.
+    """
+    ready = QtCore.pyqtSignal(int, object, object, object)  # Generation, dataset, key, data of one dataset
+    finished = QtCore.pyqtSignal(int)  # Generation
+
+
+class PlotDataWorker(QtCore.QRunnable):
+    """
+    Prepares the data of the datasets of a plot in a thread pool, so the GUI stays responsive while the data
+    is read. The data of each dataset is handed back as soon as it is ready. Once the request is cancelled
+    (because a newer one superseded it), the remaining datasets are skipped.
+    """
+
+    def __init__(self, generation, requests, prepare, cancelled):
+        """
+        :param generation: number of the request (sent back with the data)
+        :param requests: list of (dataset, key) to prepare
+        :param prepare: function(dataset, key) returning the data of a dataset, called in the worker thread
+        :param cancelled: function() returning True if the request was superseded
+        """
+        super(PlotDataWorker, self).__init__()
+        self._generation = generation
+        self._requests = requests
+        self._prepare = prepare
+        self._cancelled = cancelled
+        self._signals = PlotDataSignals()
+
+    def run(self):
+
+        for dataset, key in self._requests:
+
+            if self._cancelled():
+                break
+
+            try:
+                data = self._prepare(dataset, key)
+            except Exception as e:  # Exceptions must not leave the thread
+                print("Couldn't prepare the plot data of {}: {}".format(dataset.get_name(), e))
+                continue
+
+            self._signals.ready.emit(self._generation, dataset, key, data)
+
+        self._signals.finished.emit(self._generation)
+
+    def signals(self):
+        return self._signals
+
+
+class LODWorker(QtCore.QRunnable):
+    """
+    Decimates the particles of a LODScatter for a view in a thread pool (see lod.decimate()), so zooming
+    doesn't pass over all particles in the GUI thread. A refinement that was superseded before it started
+    is skipped.
+    """
+
+    def __init__(self, generation, x, y, keys, view, cancelled):
+        """
+        :param generation: number of the refinement (sent back with the result)
+        :param x: x values of all particles
+        :param y: y values of all particles
+        :param keys: random keys of the particles from lod.sample_keys()
+        :param view: (xrange, yrange, width, height)
+        :param cancelled: function() returning True if the refinement was superseded
+        """
+        super(LODWorker, self).__init__()
+        self._generation = generation
+        self._x, self._y, self._keys = x, y, keys
+        self._view = view
+        self._cancelled = cancelled
+        self._signals = PlotDataSignals()
+
+    def run(self):
+
+        if self._cancelled():
+            return
+
+        try:
+            result = lod.decimate(self._x, self._y, self._keys, *self._view)
+        except Exception as e:  # Exceptions must not leave the thread
+            print("Couldn't refine the scatter plot: {}".format(e))
+            return
+
+        self._signals.ready.emit(self._generation, self, self._view, result)
+
+    def signals(self):
+        return self._signals
+
 
 class PlotObject(object):
 
@@ -18,6 +335,12 @@ class PlotObject(object):
         self._graphics_view = graphics_view  # The plot's graphics view object to plot to
         self._plot_settings = {}  # The plot settings for this object
         self._datasets = []  # Datasets being shown in the plot
+        # Items drawn for each dataset, retained between redraws: {dataset: {"key": what is drawn,
+        # "layer": scatter plot (see LODScatter) or heatmap, "items": {name: item}, "range": data range}}
+        self._drawn = {}
+        self._generation = 0  # Number of the latest call of show(), data prepared for older calls is dropped
+        self._worker = None  # PlotDataWorker preparing the data of the latest call of show()
+        self._changed = []  # Datasets whose items were changed since the latest call of show()
 
     def add_dataset(self, dataset):
 
@@ -25,7 +348,21 @@ class PlotObject(object):
 
         return 0
 
+    def cancel(self):
+        """
+        Drops the data that is still being prepared for the plot
+        """
+        self._generation += 1
+        self._worker = None
+
+        return 0
+
     def clear(self):
+        self.cancel()
+
+        for dataset in list(self._drawn.keys()):  # Remove the retained items of each dataset
+            self.remove_items(dataset)
+
         if self._is_3d:  # Check if it's a 3D plot
             self._graphics_view.items = []  # Clear the items list
             self._graphics_view.update()  # Update the graphics view
@@ -34,6 +371,9 @@ class PlotObject(object):
                 self._graphics_view.removeItem(data_item)  # Remove the data item from the graphics view
         return 0
 
+    def is_busy(self):
+        return self._worker is not None  # True while the data of the latest call of show() is prepared
+
     def is_shown(self):
         return self._is_shown  # Returns the shown flag
 
@@ -45,6 +385,78 @@ class PlotObject(object):
         if dataset in self._datasets:  # If the dataset is in the list...
             del self._datasets[self._datasets.index(dataset)]  # Delete it from the list
 
+        self.remove_items(dataset)  # Remove its items from the plot
+
+    def remove_items(self, dataset):
+        """
+        Removes the items that were drawn for a dataset from the plot
+        :param dataset:
+        :return:
+        """
+        drawn = self._drawn.pop(dataset, None)
+
+        if drawn is None:
+            return 1
+
+        if drawn["layer"] is not None:
+            drawn["layer"].detach()
+
+        for item in drawn["items"].values():
+            self._graphics_view.removeItem(item)
+
+        return 0
+
+    def _drawn_items(self, dataset, key):
+        """
+        Returns the retained items of a dataset, or None if they already show what the key describes.
+        Items of another kind (key[0], e.g. a scatter plot instead of a heatmap) are removed first.
+        :param dataset:
+        :param key: tuple of everything the items depend on, starting with the kind of items
+        :return: dictionary of the retained items (see self._drawn) or None
+        """
+        drawn = self._drawn.get(dataset)
+
+        if drawn is not None and drawn["key"] == key:
+            return None  # Nothing changed
+
+        if drawn is not None and drawn["key"][0] != key[0]:
+            self.remove_items(dataset)
+            drawn = None
+
+        if drawn is None:
+            drawn = {"key": key, "layer": None, "items": {}, "range": None}
+            self._drawn[dataset] = drawn
+
+        drawn["key"] = key
+
+        return drawn
+
+    def _set_item(self, items, name, item_type, **kwargs):
+        """
+        Updates a retained item with setData, or creates it and adds it to the plot
+        :param items: dictionary of the retained items of a dataset
+        :param name: name of the item in the dictionary
+        :param item_type: class of the item (its constructor has to take the same arguments as setData)
+        :param kwargs: data and style of the item
+        :return: the item
+        """
+        if name in items:
+            items[name].setData(**kwargs)
+        else:
+            items[name] = item_type(**kwargs)
+            self._graphics_view.addItem(items[name])
+
+        return items[name]
+
+    def _remove_unused_items(self, items, names):
+        """
+        Removes the retained items of a dataset that are not in names
+        """
+        for name in [name for name in items.keys() if name not in names]:
+            self._graphics_view.removeItem(items.pop(name))
+
+        return 0
+
     def set_plot_settings(self, plot_settings):
         self._plot_settings = plot_settings  # Set the instance settings to the supplied plot settings
 
@@ -73,8 +485,12 @@ class PlotObject(object):
             for k, v in self._plot_settings.items():  # Get the key and value of each setting
                 if "_en" in k or "is" in k:  # If it's an enable setting...
                     t_plot_settings[k] = en_val[v]
-                elif "step" in k:  # If it's the step...
+                elif "step" in k or k == "bins":  # If it's the step or number of bins...
                     t_plot_settings[k] = v
+                elif k == "mode":  # Scatter plot or heatmap
+                    t_plot_settings[k] = MODES[v]
+                elif k == "scale":  # Color scale of the heatmap
+                    t_plot_settings[k] = SCALES[v]
                 elif v is None:  # If the value is set to None...
                     t_plot_settings[k] = None
                 else:  # Else, it's a combo box setting
@@ -83,8 +499,16 @@ class PlotObject(object):
             return t_plot_settings
 
     def show(self):
+        """
+        Draws the datasets. The items of every dataset are retained: they are updated with the new data if only
+        the data changed (e.g. the step), created for new datasets, removed for datasets that are no longer in
+        the plot, and left alone if nothing changed. The data is prepared in the thread pool of the PlotManager
+        (see PlotDataWorker) and drawn when it is ready, a newer call cancels the preparation of an older one.
+        :return:
+        """
 
         self._is_shown = False
+        self.cancel()
 
         t_plot_settings = self.get_plot_settings(translated=True)  # Get the translated settings
         # Set the displayed axes to what the combo box settings were (param_c will be None for a 2D plot)
@@ -92,181 +516,373 @@ class PlotObject(object):
         enabled = t_plot_settings["param_en"]
         step = t_plot_settings["step"]  # Get the step from the settings
 
-        # Check if the plot object is a 3D plot
+        # Remove the items of the datasets that are no longer shown (all of them if the plot is disabled)
+        for dataset in list(self._drawn.keys()):
+            if not enabled or dataset not in self._datasets:
+                self.remove_items(dataset)
+
+        if not enabled:
+            return 0
+
+        requests = []  # Datasets whose items are outdated
+
+        for dataset in self._datasets:  # Loop through each dataset
+
+            key = self._draw_key(dataset, axes, step, t_plot_settings)
+
+            if key[0][0] in ("scatter", "heatmap"):
+
+                if step >= dataset.get_nsteps():  # Datasets that are shorter than the step are not shown
+                    self.remove_items(dataset)
+                    continue
+
+                dataset.set_step_view(step)  # Set the step for the current dataset
+
+            if dataset not in self._drawn or self._drawn[dataset]["key"] != key:
+                requests.append((dataset, key))
+
+                if dataset in self._drawn and self._drawn[dataset]["layer"] is not None:
+                    self._drawn[dataset]["layer"].cancel()  # A refinement of the old data would be dropped anyway
+
+        if not self._is_3d and len(self._datasets) > 0:
+            # Create a title for the graph, which is just the axis labels for now
+            title = axes[0].upper() + "-" + axes[1].upper()
+            self._graphics_view.setTitle(title)  # Set the title of the graphics view
+
+        self._is_shown = True  # Set the shown flag
+        self._changed = []
+
+        if len(requests) > 0:
+            generation = self._generation
+
+            if self._is_3d:
+                size = None
+            else:
+                # Size of the plot (pixels) for the first level of detail of the scatter plots
+                view_box = self._graphics_view.getViewBox()
+                size = (int(view_box.width()), int(view_box.height()))
+
+            self._worker = PlotDataWorker(generation, requests,
+                                          lambda dataset, key: self.prepare_data(dataset, key, size),
+                                          lambda: generation != self._generation)
+            self._worker.signals().ready.connect(self._data_ready)
+            self._worker.signals().finished.connect(self._data_finished)
+
+            self._parent.thread_pool().start(self._worker)
+
+        return 0
+
+    def step_keys(self):
+        """
+        Returns the keys that are read per step to draw the plot (none for 3D plots, they show whole trajectories)
+        """
+        if self._is_3d or len(self._plot_settings) == 0:
+            return []
+
+        t_plot_settings = self.get_plot_settings(translated=True)
+
+        if not t_plot_settings["param_en"]:
+            return []
+
+        return [t_plot_settings["param_a"], t_plot_settings["param_b"]]
+
+    def _draw_key(self, dataset, axes, step, t_plot_settings):
+        """
+        Returns a key of everything the items of a dataset depend on, starting with the kind of items
+        :param dataset:
+        :param axes: keys of the axes
+        :param step:
+        :param t_plot_settings: translated plot settings
+        :return: tuple
+        """
         if self._is_3d:
+            # Only do a 3D display for data with more than one step and it's enabled
+            visible = dataset.get_nsteps() > 1 and self._enabled
+            single = dataset.get_npart() == 1
+
+            # Trajectories of single particles are drawn up to the step, all others completely
+            return ("3d", visible, single), axes, step if single else None, dataset.data_version()
+
+        if dataset.get_nsteps() > 1 and dataset.get_npart() == 1:
+            kind = ("trajectory",)
+        elif t_plot_settings.get("mode", "scatter") == "heatmap":
+            kind = ("heatmap", t_plot_settings["bins"], t_plot_settings["scale"])
+        else:
+            kind = ("scatter",)
+
+        return kind, axes[:2], step, dataset.data_version(), dataset.orbit()
+
+    @staticmethod
+    def prepare_data(dataset, key, size=None):
+        """
+        Reads and prepares the data to draw a dataset. This runs in a worker thread, so it must not change
+        any items (or the step view of the dataset).
+        :param dataset:
+        :param key: key from _draw_key()
+        :param size: (width, height) of the plot (pixels), for the level of detail of scatter plots
+        :return: dictionary of arrays
+        """
+        kind, axes, step = key[0], key[1], key[2]
+
+        if kind[0] == "3d":
+
+            if not kind[1]:  # Not visible
+                return {}
+
+            if not kind[2]:
+
+                # All trajectories are read at once (one pass over the steps)
+                trajectories, lengths = dataset.get_trajectories(keys=axes)
+
+                # Make an array of the values (nsteps, npart, 3)
+                pts = np.stack([trajectories[axes[0]], trajectories[axes[1]], trajectories[axes[2]]], axis=-1)
+
+                # Draw all particles as one item of line segments (step i -> i + 1 of each particle)
+                valid = np.arange(pts.shape[0] - 1)[:, np.newaxis] < (lengths - 1)[np.newaxis, :]
+                segments = np.empty((np.count_nonzero(valid), 2, 3))
+                segments[:, 0] = pts[:-1][valid]
+                segments[:, 1] = pts[1:][valid]
+
+                particle_colors = np.array([pg.glColor(colors[particle_id])
+                                            for particle_id in range(dataset.get_npart())])
+                segment_colors = np.repeat(particle_colors[np.nonzero(valid)[1]], 2, axis=0)
+
+                return {"segments": segments.reshape(-1, 3), "colors": segment_colors}
+
+            # Source: https://stackoverflow.com/questions/4296249/how-do-i-convert-a-hex-triplet-to-an-rgb-tuple-and-back
+
+            _NUMERALS = '0123456789abcdefABCDEF'
+            _HEXDEC = {v: int(v, 16) for v in (x + y for x in _NUMERALS for y in _NUMERALS)}
+
+            def rgb(triplet):
+                return [_HEXDEC[triplet[0:2]] / 255.0, _HEXDEC[triplet[2:4]] / 255.0,
+                        _HEXDEC[triplet[4:6]] / 255.0, 255.0 / 255.0]
+
+            trajectories, _ = dataset.get_trajectories(particle_ids=[0], keys=axes, steps=range(step))
+
+            pts = np.array([trajectories[axes[0]][:, 0],
+                            trajectories[axes[1]][:, 0],
+                            trajectories[axes[2]][:, 0]]).T
+            dataset_color = dataset.color()
+
+            return {"curve": pts, "color": rgb(dataset_color[1:])}
+
+        if kind[0] == "trajectory":
+            trajectories, _ = dataset.get_trajectories(particle_ids=[0], keys=axes, steps=range(step))
+            return {"x": np.array(trajectories[axes[0]][:, 0]), "y": np.array(trajectories[axes[1]][:, 0])}
+
+        block = dataset.read_step(step, axes)
+        data = {"x": block[0], "y": block[1], "range": PlotObject.summary_range(dataset, axes, step)}
+
+        if kind[0] == "heatmap":
+            # 2D histogram of the values
+            data["image"], data["range"] = HeatmapLayer.histogram(block[0], block[1], bins=kind[1], scale=kind[2],
+                                                                  ranges=data["range"])
+
+        else:
+            if data["range"] is None:
+                data["range"] = (lod.data_range(block[0]), lod.data_range(block[1]))
+
+            # The first level of detail is made for the view _data_finished() sets if this dataset is the only one,
+            # the GUI thread only draws the rows or the image
+            xrange, yrange = lod.view_range([data["range"]])
+            width, height = size
+            data["keys"] = lod.sample_keys(len(block[0]))
+            data["view"] = (xrange, yrange, width, height)
+            data["lod"] = lod.decimate(block[0], block[1], data["keys"], xrange, yrange, width, height)
+
+        return data
+
+    def _data_ready(self, generation, dataset, key, data):
+        """
+        Draws the data of a dataset that was prepared by the worker (in the GUI thread)
+        :param generation: number of the call of show() the data was prepared for
+        :param dataset:
+        :param key: key from _draw_key()
+        :param data: data from prepare_data()
+        :return:
+        """
+        if generation != self._generation or dataset not in self._datasets:
+            return 1  # Superseded
+
+        drawn = self._drawn_items(dataset, key)
 
-            if enabled:
+        if drawn is None:
+            return 0
 
-                # Note: since the get_color is set to random, you won't be able to distinguish different datasets
-                for dataset in self._datasets:  # Loop through each dataset
+        kind, axes = key[0], key[1]
+        items = drawn["items"]
 
-                    # Only do a 3D display for data with more than one step and it's enabled
-                    if dataset.get_nsteps() > 1 and self._enabled:
+        if kind[0] == "3d":
+            self._draw_3d(items, data)
 
-                        _grid = False
+        elif kind[0] == "trajectory":
+            self._draw_trajectory(dataset, axes, items, data)
 
-                        # Loop through each particle
+        elif kind[0] == "heatmap":
+            if drawn["layer"] is None:
+                drawn["layer"] = HeatmapLayer(self._graphics_view, bins=kind[1], scale=kind[2])
+            drawn["layer"].set_image(data["image"], data["range"])
+            drawn["range"] = data["range"]
 
-                        if dataset.get_npart() > 1:
+        else:
+            # Scatter plot of the values in the color of the dataset, decimated to the view
+            if drawn["layer"] is None:
+                drawn["layer"] = LODScatter(self._graphics_view, dataset.color(), self._parent.thread_pool())
+            drawn["layer"].set_data(data["x"], data["y"], data["keys"])
+            drawn["layer"].draw(data["lod"], data["view"])
+            drawn["range"] = data["range"]
+
+        self._changed.append(dataset)
+
+        return 0
+
+    def _data_finished(self, generation):
+        """
+        Scales the axes after all data of a call of show() was drawn (in the GUI thread)
+        :param generation: number of the call of show()
+        :return:
+        """
+        if generation != self._generation:
+            return 1  # Superseded
+
+        self._worker = None
 
-                            for particle_id in range(dataset.get_npart()):
+        if len(self._changed) == 0:
+            return 0
 
-                                # Get the particle data and color for plotting
-                                particle, _c = dataset.get_particle(particle_id, get_color="random")
-                                # Make an array of the values and transpose it (needed for plotting)
-                                pts = np.array([particle.get(axes[0]), particle.get(axes[1]), particle.get(axes[2])]).T
-                                # Create a line item of all the points corresponding to this particle
-                                plt = pg.opengl.GLLinePlotItem(pos=pts, color=pg.glColor(_c), width=1.,
-                                                               antialias=True)
-                                # Add the line object to the graphics view
-                                self._graphics_view.addItem(plt)
+        if self._is_3d:
+            # Set the "camera" distance
+            self._graphics_view.opts["distance"] = 3e-1  # Seems to be a good value for now
+            self._graphics_view.update()
+
+            return 0
+
+        # Scale the axes with the summary tables if they are available (no pass over the data),
+        # the scatter plots that changed are refined if their first level of detail was made for another view
+        scatter_ranges = [self._drawn[dataset]["range"] for dataset in self._datasets
+                          if dataset in self._drawn and self._drawn[dataset]["range"] is not None]
+
+        if len(scatter_ranges) > 0:
+            xrange, yrange = lod.view_range(scatter_ranges)
+            self._graphics_view.setRange(xRange=xrange, yRange=yrange, padding=0.0)  # Padded by view_range()
+            for dataset in self._changed:
+                if dataset in self._drawn and self._drawn[dataset]["layer"] is not None:
+                    self._drawn[dataset]["layer"].refresh()
 
-                        else:
+        self._graphics_view.repaint()  # Repaint the view
 
-                            # Source: https://stackoverflow.com/questions/4296249/how-do-i-convert-a-hex-triplet-to-an-rgb-tuple-and-back
+        return 0
+
+    def _draw_trajectory(self, dataset, axes, items, data):
+        """
+        Draws the trajectory of a single particle in the 2D plot (or updates its retained items)
+        """
+        _x, _y = data["x"], data["y"]
+        names = ["curve", "start", "end"]
 
-                            _NUMERALS = '0123456789abcdefABCDEF'
-                            _HEXDEC = {v: int(v, 16) for v in (x + y for x in _NUMERALS for y in _NUMERALS)}
+        self._set_item(items, "curve", pg.PlotDataItem, x=_x, y=_y,
+                       pen=pg.mkPen(dataset.color()), brush='b', size=1.0, pxMode=True)
 
-                            def rgb(triplet):
-                                return [_HEXDEC[triplet[0:2]] / 255.0, _HEXDEC[triplet[2:4]] / 255.0,
-                                        _HEXDEC[triplet[4:6]] / 255.0, 255.0 / 255.0]
-
-                            if dataset.get_nsteps() > 1 and dataset.get_npart() == 1:
-                                _x, _y, _z = [], [], []
-
-                                for step_i in range(step):
-                                    dataset.set_step_view(step_i)
-                                    _x.append(float(dataset.get(axes[0])))
-                                    _y.append(float(dataset.get(axes[1])))
-                                    _z.append(float(dataset.get(axes[2])))
-
-                                pts = np.array([_x, _y, _z]).T
-                                dataset_color = dataset.color()
-                                line_color = rgb(dataset_color[1:])
-
-                                plot_curve = pg.opengl.GLLinePlotItem(pos=pts, color=line_color,
-                                                                      width=1., antialias=True)
-                                self._graphics_view.addItem(plot_curve)
-                                self._graphics_view.repaint()
-
-                        if _grid:  # If the grid is enabled for this plot
-                            # TODO: Make the grid size dynamic -PW
-                            # TODO: The maximum and minimum values might be useful to get during import -PW
-
-                            gx = pg.opengl.GLGridItem()
-                            gx.rotate(90, 0, 1, 0)
-                            gx.translate(0.0, 0.0, 0.0)
-                            gx.setSize(x=0.2, y=0.2, z=0.2)
-                            gx.setSpacing(x=0.01, y=0.01, z=0.01)
-
-                            gy = pg.opengl.GLGridItem()
-                            gy.rotate(90, 1, 0, 0)
-                            gy.translate(0.0, 0.0, 0.0)
-                            gy.setSize(x=0.2, y=0.2, z=0.2)
-                            gy.setSpacing(x=0.01, y=0.01, z=0.01)
-
-                            gz = pg.opengl.GLGridItem()
-                            gz.translate(0.0, 0.0, 0.0)
-                            gz.setSize(x=0.2, y=0.2, z=1.0)
-                            gz.setSpacing(x=0.01, y=0.01, z=0.01)
+        self._set_item(items, "start", pg.ScatterPlotItem, x=_x[:1], y=_y[:1],
+                       pen=pg.mkPen(color=(0.0, 255.0, 0.0)), symbol="o", brush='b', size=3.0, pxMode=True)
 
-                            # Add the three grids to the graphics view
-                            self._graphics_view.addItem(gx)
-                            self._graphics_view.addItem(gy)
-                            self._graphics_view.addItem(gz)
+        self._set_item(items, "end", pg.ScatterPlotItem, x=_x[-1:], y=_y[-1:],
+                       pen=pg.mkPen(color=(255.0, 0.0, 0.0)), symbol="o", brush='b', size=3.0, pxMode=True)
 
-                        # Set the "camera" distance
-                        self._graphics_view.opts["distance"] = 3e-1  # Seems to be a good value for now
+        if axes[0] == "x" and axes[1] == "y":
+            self._graphics_view.setAspectLocked(lock=True, ratio=1)
+            if dataset.orbit() is not None:
+                xc, yc, r = dataset.orbit()
+                theta = np.linspace(0, 2*np.pi, 180)
+                xo = r * np.cos(theta) + xc
+                yo = r * np.sin(theta) + yc
 
-                self._is_shown = True
+                self._set_item(items, "orbit_curve", pg.PlotDataItem, x=xo, y=yo,
+                               pen=pg.mkPen(color=dataset.color(), style=QtCore.Qt.DashLine),
+                               brush='b', size=1.0, pxMode=True)
 
-        else:  # If it's not a 3D plot, it's a 2D plot...
+                self._set_item(items, "orbit_center", pg.ScatterPlotItem, x=np.array([xc]), y=np.array([yc]),
+                               pen=pg.mkPen(color=dataset.color()), symbol="s", brush='b', size=3.0, pxMode=True)
 
-            if enabled:
+                names += ["orbit_curve", "orbit_center"]
+            else:
+                self._graphics_view.setAspectLocked(lock=False)
 
-                for dataset in self._datasets:  # Loop through each dataset
+        self._remove_unused_items(items, names)
+        self._graphics_view.showGrid(True, True, 0.5)
 
-                    if dataset.get_nsteps() > 1 and dataset.get_npart() == 1:
-                        _x, _y = [], []
-                        for step_i in range(step):
-                            dataset.set_step_view(step_i)
-                            _x.append(float(dataset.get(axes[0])))
-                            _y.append(float(dataset.get(axes[1])))
+        return 0
 
-                        plot_curve = pg.PlotDataItem(x=np.array(_x),
-                                                     y=np.array(_y),
-                                                     pen=pg.mkPen(dataset.color()), brush='b', size=1.0, pxMode=True)
-
-                        plot_start = pg.ScatterPlotItem(x=np.array([_x[0]]),
-                                                        y=np.array([_y[0]]),
-                                                        pen=pg.mkPen(color=(0.0, 255.0, 0.0)),
-                                                        symbol="o",
-                                                        brush='b',
-                                                        size=3.0,
-                                                        pxMode=True)
-
-                        plot_end = pg.ScatterPlotItem(x=np.array([_x[-1]]),
-                                                      y=np.array([_y[-1]]),
-                                                      pen=pg.mkPen(color=(255.0, 0.0, 0.0)),
-                                                      symbol="o",
-                                                      brush='b',
-                                                      size=3.0,
-                                                      pxMode=True)
-
-                        self._graphics_view.addItem(plot_curve)
-                        self._graphics_view.addItem(plot_start)
-                        self._graphics_view.addItem(plot_end)
-
-                        if axes[0] == "x" and axes[1] == "y":
-                            self._graphics_view.setAspectLocked(lock=True, ratio=1)
-                            if dataset.orbit() is not None:
-                                xc, yc, r = dataset.orbit()
-                                theta = np.linspace(0, 2*np.pi, 180)
-                                xo = r * np.cos(theta) + xc
-                                yo = r * np.sin(theta) + yc
-
-                                orbit_curve = pg.PlotDataItem(x=xo,
-                                                              y=yo,
-                                                              pen=pg.mkPen(color=dataset.color(), style=QtCore.Qt.DashLine),
-                                                              brush='b',
-                                                              size=1.0,
-                                                              pxMode=True)
-
-                                orbit_center = pg.ScatterPlotItem(x=np.array([xc]),
-                                                                  y=np.array([yc]),
-                                                                  pen=pg.mkPen(color=dataset.color()),
-                                                                  symbol="s",
-                                                                  brush='b',
-                                                                  size=3.0,
-                                                                  pxMode=True)
-
-                                self._graphics_view.addItem(orbit_curve)
-                                self._graphics_view.addItem(orbit_center)
-                            else:
-                                self._graphics_view.setAspectLocked(lock=False)
-
-                        self._graphics_view.showGrid(True, True, 0.5)
-                        self._graphics_view.repaint()
-
-                    else:
-                        dataset.set_step_view(step)  # Set the step for the current dataset
-                        # Create a scatter plot item using the values and color from the dataset
-                        scatter = pg.ScatterPlotItem(x=dataset.get(axes[0]),
-                                                     y=dataset.get(axes[1]),
-                                                     pen=pg.mkPen(dataset.color()), brush='b', size=1.0, pxMode=True)
-                        # Add the scatter plot item to the graphics view
-                        self._graphics_view.addItem(scatter)
-
-                    # Create a title for the graph, which is just the axis labels for now
-                    title = axes[0].upper() + "-" + axes[1].upper()
-                    self._graphics_view.setTitle(title)  # Set the title of the graphics view
-                    self._graphics_view.repaint()  # Repaint the view
-
-                self._is_shown = True  # Set the shown flag
+    def _draw_3d(self, items, data):
+        """
+        Draws the trajectories of a dataset in the 3D plot (or updates its retained items)
+        """
+        names = []
+        _grid = False
+
+        if "segments" in data and len(data["segments"]) > 0:
+            # A line item of all the segments
+            self._set_item(items, "segments", pg.opengl.GLLinePlotItem, pos=data["segments"], color=data["colors"],
+                           width=1., antialias=True, mode="lines")
+            names.append("segments")
+
+        elif "curve" in data:
+            self._set_item(items, "curve", pg.opengl.GLLinePlotItem, pos=data["curve"], color=data["color"],
+                           width=1., antialias=True)
+            names.append("curve")
+
+        if _grid and len(names) > 0:  # If the grid is enabled for this plot
+            # TODO: Make the grid size dynamic -PW
+            # TODO: The maximum and minimum values might be useful to get during import -PW
+
+            if "gx" not in items:
+                gx = pg.opengl.GLGridItem()
+                gx.rotate(90, 0, 1, 0)
+                gx.translate(0.0, 0.0, 0.0)
+                gx.setSize(x=0.2, y=0.2, z=0.2)
+                gx.setSpacing(x=0.01, y=0.01, z=0.01)
+
+                gy = pg.opengl.GLGridItem()
+                gy.rotate(90, 1, 0, 0)
+                gy.translate(0.0, 0.0, 0.0)
+                gy.setSize(x=0.2, y=0.2, z=0.2)
+                gy.setSpacing(x=0.01, y=0.01, z=0.01)
+
+                gz = pg.opengl.GLGridItem()
+                gz.translate(0.0, 0.0, 0.0)
+                gz.setSize(x=0.2, y=0.2, z=1.0)
+                gz.setSpacing(x=0.01, y=0.01, z=0.01)
+
+                # Add the three grids to the graphics view
+                for name, grid in (("gx", gx), ("gy", gy), ("gz", gz)):
+                    items[name] = grid
+                    self._graphics_view.addItem(grid)
+
+            names += ["gx", "gy", "gz"]
+
+        self._remove_unused_items(items, names)
 
         return 0
 
+    @staticmethod
+    def summary_range(dataset, axes, step):
+        """
+        Returns the ((min, max), ...) ranges of the axes at a step from the summary table of the dataset,
+        or None if the dataset has no summary table yet or an axis is not in it (e.g. "r").
+        """
+        summary = dataset.summary(build=False)
+
+        if summary is None or step >= len(summary["npart"]) or summary["npart"][step] == 0:
+            return None
+
+        keys = list(summary["keys"])
+
+        if any(axis not in keys for axis in axes):
+            return None
+
+        return [(summary["min"][step, keys.index(axis)], summary["max"][step, keys.index(axis)]) for axis in axes]
+
 
 class PlotManager(object):
 
@@ -281,8 +897,16 @@ class PlotManager(object):
         self._current_plot = None  # Which plot is currently showing (None should be default plots)
         self._default_plots = [None, None, None, None]  # A list of the default plot objects
         self._default_plot_settings = {}  # The plot settings for the default plots
+        # Plot data is prepared in the background, one request at a time, so plots of the same step
+        # find the columns in the cache of the datasource instead of reading them again
+        self._thread_pool = QtCore.QThreadPool()
+        self._thread_pool.setMaxThreadCount(1)
         self._initialize_default_plots()  # Initialization of the default plots
 
+        # The timeline slider shows a step in the plots of the current tab
+        self._timeline = Timeline(self, *parent.get_timeline_widgets(), debug=debug)
+        self._tabs.currentChanged.connect(lambda index: self._timeline.refresh())
+
     def _initialize_default_plots(self):
 
         default_gv = self._parent.get_default_graphics_views()  # Get the default graphics views
@@ -324,6 +948,8 @@ class PlotManager(object):
         prefix_list = ["tl", "tr", "bl", "3d"]  # Create a list of prefixes
         for idx, plot_object in enumerate(self._default_plots):  # Enumerate through the default plot objects
             new_plot_settings = {"step": plot_settings["step"]}  # Add the step parameter
+            for key in ["mode", "scale", "bins"]:  # The rendering settings are the same for all 2D plots
+                new_plot_settings[key] = plot_settings[key]
             for key, val in plot_settings.items():  # Scan through all of the default plot settings
                 if prefix_list[idx] in key:  # If the key has the prefix for this plot object...
                     new_key = "param_"+key.split("_")[1]  # Create a new key that will be used by the plot object
@@ -357,6 +983,14 @@ class PlotManager(object):
         else:
             return [self._plot_objects[tab_index - 1]]  # Return it in a list
 
+    def is_busy(self):
+        # Returns True while the data of a plot in the current tab is still being prepared
+        for plot_object in self.get_plot_object(self._tabs.currentIndex()):
+            if plot_object.is_busy():
+                return True
+
+        return False
+
     def has_default_plot_settings(self):
         # Returns True if the settings for the default plots have been set previously
         for plot_object in self._default_plots:
@@ -414,12 +1048,13 @@ class PlotManager(object):
         return 0
 
     def redraw_default_plots(self):
-        # Clear, then show each plot object in the default plot object list
+        # Show each plot object in the default plot object list (only the items that changed are redrawn)
 
         for plot_object in self._default_plots:
-            plot_object.clear()
             plot_object.show()
 
+        self._timeline.refresh()  # The datasets or the step might have changed
+
         return 0
 
     def redraw_plot(self):
@@ -429,8 +1064,8 @@ class PlotManager(object):
             self.redraw_default_plots()
         else:
             plot_object = self._plot_objects[current_index - 1]  # If not, get the plot object and redraw
-            plot_object.clear()
             plot_object.show()
+            self._timeline.refresh()  # The datasets or the step might have changed
 
         return 0
 
@@ -454,6 +1089,7 @@ class PlotManager(object):
         else:
             self._tabs.setCurrentIndex(current_index - 1)  # This should always exist -PW
             self._tabs.removeTab(current_index)
+            self._plot_objects[current_index - 1].cancel()  # Drop the data that is still being prepared
             del self._plot_objects[current_index - 1]
             del self._gvs[current_index - 1]
 
@@ -462,6 +1098,71 @@ class PlotManager(object):
     def screen_size(self):
         return self._screen_size  # Return the size of the screen
 
+    def set_step(self, step):
+        """
+        Shows a step in the plots of the current tab (e.g. from the timeline)
+        :param step:
+        :return:
+        """
+        current_index = self._tabs.currentIndex()
+
+        if current_index == 0 and len(self._default_plot_settings) > 0:
+            self._default_plot_settings["step"] = step  # So the settings window shows the step
+
+        for plot_object in self.get_plot_object(current_index):
+            if len(plot_object.get_plot_settings()) > 0:
+                plot_object.get_plot_settings()["step"] = step
+
+        self.redraw_plot()
+
+        return 0
+
+    def step_keys(self):
+        """
+        Returns the datasets in the current tab and the keys their plots read per step (see PlotObject.step_keys())
+        :return: list of (dataset, keys)
+        """
+        step_keys = []
+
+        for plot_object in self.get_plot_object(self._tabs.currentIndex()):
+
+            keys = plot_object.step_keys()
+
+            for dataset in plot_object.datasets():
+
+                if dataset.get_npart() <= 1 or len(keys) == 0:  # Single particles are drawn as trajectories
+                    continue
+
+                datasets = [_dataset for _dataset, _ in step_keys]
+
+                if dataset in datasets:
+                    _keys = step_keys[datasets.index(dataset)][1]
+                    _keys += [key for key in keys if key not in _keys]
+                else:
+                    step_keys.append((dataset, list(keys)))
+
+        return step_keys
+
+    def step_range(self):
+        """
+        Returns the number of steps of the longest dataset in the current tab and the step of its plots
+        :return: nsteps, step (None if the plots have no settings yet)
+        """
+        nsteps, step = 0, None
+
+        for plot_object in self.get_plot_object(self._tabs.currentIndex()):
+
+            for dataset in plot_object.datasets():
+                nsteps = max(nsteps, dataset.get_nsteps())
+
+            if step is None and "step" in plot_object.get_plot_settings():
+                step = plot_object.get_plot_settings()["step"]
+
+        return nsteps, step
+
+    def thread_pool(self):
+        return self._thread_pool  # Return the thread pool that prepares the plot data
+
     def set_tab(self, index):
         if index == "last":
             self._tabs.setCurrentIndex(self._tabs.count() - 1)
@@ -559,6 +1260,11 @@ class PlotSettings(object):
         # Step:
         self._settings["step"] = self._plotSettingsWindowGUI.step_input.value()
 
+        # Rendering of the 2D plots (scatter plot or heatmap):
+        self._settings["mode"] = self._plotSettingsWindowGUI.mode_combo.currentIndex()
+        self._settings["scale"] = self._plotSettingsWindowGUI.scale_combo.currentIndex()
+        self._settings["bins"] = self._plotSettingsWindowGUI.bins_input.value()
+
         # 3D Plot:
         self._settings["3d_en"] = self._plotSettingsWindowGUI.three_d_enabled.checkState()
 
@@ -628,6 +1334,11 @@ class PlotSettings(object):
         # Step:
         self._plotSettingsWindowGUI.step_input.setValue(self._settings["step"])
 
+        # Rendering of the 2D plots (scatter plot or heatmap):
+        self._plotSettingsWindowGUI.mode_combo.setCurrentIndex(self._settings["mode"])
+        self._plotSettingsWindowGUI.scale_combo.setCurrentIndex(self._settings["scale"])
+        self._plotSettingsWindowGUI.bins_input.setValue(self._settings["bins"])
+
         # 3D Plot:
         self._plotSettingsWindowGUI.three_d_enabled.setCheckState(self._settings["3d_en"])
 
@@ -1,4 +1,5 @@
 from py_particle_processor_qt.dataset import *
+from py_particle_processor_qt.batch_import import *
 from py_particle_processor_qt.gui.main_window import *
 from py_particle_processor_qt.gui.species_prompt import *
 from py_particle_processor_qt.plotting import *
@@ -30,6 +31,7 @@ class ParticleFile(object):
         self._load_type = load_type
         self._parent = kwargs.get("parent")
         self._c_i = kwargs.get("color_index")
+        self._load_options = kwargs.get("load_options", {})  # Driver specific import options
         self._name = ""
 
         self._datasets_to_load = 1  # TODO: Multispecies
@@ -79,7 +81,7 @@ class ParticleFile(object):
                 self._prompt = SpeciesPrompt(parent=self)
                 self._prompt.run()
             else:
-                self.species_callback(None, species, name)
+                return self.species_callback(None, species, name)
 
             return 0
 
@@ -93,13 +95,17 @@ class ParticleFile(object):
             prompt.close()
 
         _ds = Dataset(indices=(self._index, len(self._datasets)), debug=self._debug, species=species)
-        _ds.load_from_file(filename=self._filename, driver=self._driver, name=name)
+
+        if _ds.load_from_file(filename=self._filename, driver=self._driver, name=name, **self._load_options) != 0:
+            self._parent.loading_failed(self)
+            return 1
+
         _ds.assign_color(self._c_i)
 
         self._c_i += 1
         self._datasets.append(_ds)
 
-        self.load(load_index=len(self._datasets))
+        return self.load(load_index=len(self._datasets))
 
     def remove_dataset(self, selection):
         # if type(selection) is int:
@@ -240,6 +246,20 @@ class PyParticleProcessor(object):
             action.triggered.connect(self.callback_tool_action)
             self._tools_menu.addAction(action)
 
+        # --- Undo/redo/bake the pending transformations (Scale, Translate, Rotate) of the selected datasets --- #
+        self._tools_menu.addSeparator()
+        for action_name, text, shortcut in [("Undo_Transform", "Undo Transform", "Ctrl+Z"),
+                                            ("Redo_Transform", "Redo Transform", "Ctrl+Shift+Z"),
+                                            ("Bake_Transforms", "Bake Transforms", None)]:
+            action = QtWidgets.QAction(self._mainWindow)
+            action.setText(text)
+            action.setObjectName(action_name)
+            if shortcut is not None:
+                action.setShortcut(shortcut)
+            # noinspection PyUnresolvedReferences
+            action.triggered.connect(self.callback_transform_action)
+            self._tools_menu.addAction(action)
+
         # --- Resize the columns in the treewidget --- #
         for i in range(self._treewidget.columnCount()):
             self._treewidget.resizeColumnToContents(i)
@@ -260,6 +280,9 @@ class PyParticleProcessor(object):
         self._gen = GeneratorGUI(self)
         self._gen_data = {}
 
+        # Parallel import of multiple files
+        self._batch_importer = BatchImporter(parent=self, debug=self._debug)
+
         # Go through each property in the list
         for idx, item in enumerate(self._property_list):
 
@@ -445,7 +468,10 @@ class PyParticleProcessor(object):
             return 0
 
         selection = self._selections[0]
-        selection.export_to_file(filename=filename, driver=driver)
+
+        if selection.export_to_file(filename=filename, driver=driver) == 1:
+            self.send_status("Export failed!")
+            return 1
 
         print("Export complete!")
         self.send_status("Export complete!")
@@ -471,28 +497,74 @@ class PyParticleProcessor(object):
         if len(filenames) > 1:
             batch = True
 
+        if batch:
+
+            if self._batch_importer.is_running():
+                self.send_status("Batch import is still running!")
+                return 1
+
+            # All files of a batch get the species of the first dataset
+            species = self._datafiles[0].datasets()[0].get_property("ion")
+            self._batch_importer.start(filenames, driver, species)
+
+            return 0
+
         self.send_status("Loading file with driver: {}".format(driver))
 
         # Create a new datafile with the supplied parameters
-        for filename in filenames:
-
-            # Create a new datafile with the supplied parameters
-            new_df = ParticleFile(filename=filename,
-                                  driver=driver,
-                                  index=0,
-                                  load_type="add",
-                                  debug=self._debug,
-                                  parent=self,
-                                  color_index=self._ci)
-
-            if not batch:
-                new_df.load()
-            else:
-                species = self._datafiles[0].datasets()[0].get_property("ion")
-                name = os.path.splitext(os.path.split(filename)[1])[0]
-                new_df.load(species=species, name=name)
+        new_df = ParticleFile(filename=filenames[0],
+                              driver=driver,
+                              index=0,
+                              load_type="add",
+                              debug=self._debug,
+                              parent=self,
+                              color_index=self._ci)
+
+        self._datafile_buffer.append(new_df)
 
-            self._datafile_buffer.append(new_df)
+        new_df.load()
+
+        return 0
+
+    def batch_file_imported(self, filename, driver, name, species):
+        """
+        Called by the batch importer for every file, files parsed by the workers are loaded from their on-disk cache
+        :return: 0 if successful, 1 otherwise
+        """
+
+        # Create a new datafile with the supplied parameters
+        new_df = ParticleFile(filename=filename,
+                              driver=driver,
+                              index=0,
+                              load_type="add",
+                              debug=self._debug,
+                              parent=self,
+                              color_index=self._ci)
+
+        # The datafile has to be in the buffer before loading, with a species it is attached right away
+        self._datafile_buffer.append(new_df)
+
+        try:
+            result = new_df.load(species=species, name=name)
+        except Exception as e:
+            if self._debug:
+                print("Batch import of {} failed: {}".format(filename, e))
+            if new_df in self._datafile_buffer:
+                self._datafile_buffer.remove(new_df)
+            return 1
+
+        return result
+
+    def loading_failed(self, new_df):
+        """
+        Called by a datafile if one of its datasets couldn't be loaded
+        :param new_df: the datafile
+        :return: 0
+        """
+        if new_df in self._datafile_buffer:
+            self._datafile_buffer.remove(new_df)  # Remove the datafile from the buffer
+
+        self.send_status("Couldn't load file {}!".format(new_df.filename()))
 
         return 0
 
@@ -574,10 +646,10 @@ class PyParticleProcessor(object):
                               parent=self,
                               color_index=self._ci)
 
-        new_df.load()
-
         self._datafile_buffer.append(new_df)
 
+        new_df.load()
+
         return 0
 
     def loaded_new_df(self, new_df):
@@ -764,6 +836,33 @@ class PyParticleProcessor(object):
         if self._current_tool.check_requirements() == 0:
             self._current_tool.open_gui()
 
+    def callback_transform_action(self):
+
+        name = self._mainWindow.sender().objectName()
+        datasets = [selection for selection in self._selections if isinstance(selection, Dataset)]
+
+        if len(datasets) == 0:
+            self.send_status("No dataset selected!")
+            return 1
+
+        changed = 0
+
+        for dataset in datasets:
+            if name == "Undo_Transform":
+                changed += dataset.undo_transform() == 0
+            elif name == "Redo_Transform":
+                changed += dataset.redo_transform() == 0
+            elif name == "Bake_Transforms":
+                changed += len(dataset.transforms()) > 0
+                dataset.bake_transforms()
+
+        if changed > 0:
+            self._plot_manager.redraw_plot()
+
+        self.send_status("{}: {} of {} dataset(s) changed".format(name.replace("_", " "), changed, len(datasets)))
+
+        return 0
+
     def clear_properties_table(self):
 
         self._properties_table.setCurrentItem(None)  # Set the current item to None
@@ -789,6 +888,10 @@ class PyParticleProcessor(object):
 
         return default_gv
 
+    def get_timeline_widgets(self):
+        # Return the slider and the label of the timeline below the plots
+        return self._mainWindowGUI.timeline_slider, self._mainWindowGUI.timeline_value
+
     def get_filename(self, action="open"):
 
         filename, filetype = "", ""
@@ -882,6 +985,8 @@ class PyParticleProcessor(object):
         if self._debug:
             print("DEBUG: Called main_quit")
 
+        self._batch_importer.stop()
+
         self._mainWindow.destroy()  # Close the window
         qApp.quit()  # Quit the application
 
@@ -1,4 +1,5 @@
 from py_particle_processor_qt.py_particle_processor_qt import PyParticleProcessor
 
-ppp = PyParticleProcessor(debug=True)
-ppp.run()
+if __name__ == "__main__":
+    ppp = PyParticleProcessor(debug=True)
+    ppp.run()
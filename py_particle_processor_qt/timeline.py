@@ -0,0 +1,197 @@
+from PyQt5 import QtCore
+
+__author__ = "Philip Weigel, Daniel Winklehner"
+__doc__ = """A timeline slider for the steps in the main window. Moving the slider shows the step in the plots
+of the current tab. While the plots are still drawing, the steps the slider passes are dropped and only the
+latest one is shown next, so the plots follow the slider as fast as the data can be read. Once a step is
+drawn, the steps around it are read ahead in the background (nearest first, in the direction of scrubbing
+first) into the caches of the datasets.
+"""
+
+FRAME_MS = 30  # Interval of checking for a new step while scrubbing
+PREFETCH_STEPS = 8  # Steps read ahead of (and behind) the shown step
+PREFETCH_BYTES = 256 * 1024 ** 2  # Most memory of the steps read ahead per dataset
+
+
+def prefetch_order(step, nsteps, count, direction=1):
+    """
+    Returns the steps around a step, nearest first
+    :param step: the shown step
+    :param nsteps: number of steps
+    :param count: number of steps in each direction
+    :param direction: 1 or -1, the steps in this direction come first
+    :return: list of step numbers
+    """
+    order = []
+
+    for distance in range(1, count + 1):
+        for _step in (step + direction * distance, step - direction * distance):
+            if 0 <= _step < nsteps:
+                order.append(_step)
+
+    return order
+
+
+class StepPrefetcher(QtCore.QRunnable):
+    """
+    Reads steps of datasets into their caches in a thread pool (see Dataset.prefetch()).
+    The nearest steps of all datasets are read first. Stops once it is cancelled.
+    """
+
+    def __init__(self, requests, cancelled):
+        """
+        :param requests: list of (dataset, keys, steps) to read
+        :param cancelled: function() returning True if the prefetch was superseded
+        """
+        super(StepPrefetcher, self).__init__()
+        self._requests = requests
+        self._cancelled = cancelled
+
+    def run(self):
+
+        for i in range(max([len(steps) for _, _, steps in self._requests] + [0])):
+
+            for dataset, keys, steps in self._requests:
+
+                if self._cancelled():
+                    return
+
+                if i >= len(steps):
+                    continue
+
+                try:
+                    dataset.prefetch(steps[i], keys)
+                except Exception as e:  # Exceptions must not leave the thread
+                    print("Couldn't read step {} of {} ahead: {}".format(steps[i], dataset.get_name(), e))
+
+
+class Timeline(object):
+
+    def __init__(self, parent, slider, label, debug=False):
+        """
+        :param parent: the PlotManager
+        :param slider: QSlider of the steps
+        :param label: QLabel showing the step
+        :param debug:
+        """
+        self._parent = parent
+        self._slider = slider
+        self._label = label
+        self._debug = debug
+
+        self._step = None  # Step that was last sent to the plots
+        self._direction = 1  # Direction of scrubbing
+        self._prefetched = True  # A flag indicating the steps around the shown step are being read ahead
+        self._generation = 0  # Number of the latest prefetch, older ones stop
+        self._prefetcher = None
+
+        # Steps are read ahead one at a time, next to the plot data (see PlotManager.thread_pool())
+        self._thread_pool = QtCore.QThreadPool()
+        self._thread_pool.setMaxThreadCount(1)
+
+        # Checks for a new step until the plots caught up with the slider
+        self._timer = QtCore.QTimer()
+        self._timer.setInterval(FRAME_MS)
+        self._timer.timeout.connect(self._next_frame)
+
+        self._slider.valueChanged.connect(self._value_changed)
+
+    def _next_frame(self):
+
+        step = self._slider.value()
+
+        if self._parent.is_busy():
+            # The plots are still drawing an earlier step, the steps the slider passes until then are dropped
+            self._timer.start()
+            return 0
+
+        if step != self._step:
+            self.cancel()  # Steps around the old step are not needed anymore
+
+            if self._step is not None:
+                self._direction = 1 if step > self._step else -1
+
+            self._step = step
+            self._prefetched = False
+            self._parent.set_step(step)
+            self._timer.start()
+
+            return 0
+
+        # The plots show the step of the slider
+        self._timer.stop()
+
+        if not self._prefetched:
+            self._prefetched = True
+            self.prefetch(step)
+
+        return 0
+
+    def _value_changed(self, step):
+
+        self._label.setText(str(step))
+        self._next_frame()
+
+        return 0
+
+    def cancel(self):
+        """
+        Stops reading ahead
+        """
+        self._generation += 1
+        self._prefetcher = None
+
+        return 0
+
+    def prefetch(self, step):
+        """
+        Reads the steps around a step of the datasets in the current tab ahead (in the background)
+        :param step: the shown step
+        :return: 0 if steps are read ahead, 1 if there is nothing to read
+        """
+        self.cancel()
+
+        requests = []
+
+        for dataset, keys in self._parent.step_keys():
+
+            step_bytes = 8 * len(keys) * max(dataset.get_npart(), 1)
+            count = int(min(PREFETCH_STEPS, PREFETCH_BYTES // (2 * step_bytes)))  # Steps in each direction
+            steps = prefetch_order(step, dataset.get_nsteps(), count, self._direction)
+
+            if len(steps) > 0:
+                requests.append((dataset, keys, steps))
+
+        if len(requests) == 0:
+            return 1
+
+        if self._debug:
+            print("Timeline: reading {} step(s) around step {} ahead".format(
+                sum([len(steps) for _, _, steps in requests]), step))
+
+        generation = self._generation
+
+        self._prefetcher = StepPrefetcher(requests, lambda: generation != self._generation)
+        self._thread_pool.start(self._prefetcher)
+
+        return 0
+
+    def refresh(self):
+        """
+        Updates the slider to the datasets and the step of the plots in the current tab
+        """
+        nsteps, step = self._parent.step_range()
+
+        self._slider.blockSignals(True)  # Not a new step
+        self._slider.setMaximum(max(nsteps - 1, 0))
+
+        if step is not None and step != self._step:  # The step was changed elsewhere (e.g. in the plot settings)
+            self._slider.setValue(step)
+            self._step = step
+            self._prefetched = False
+            self._timer.start()  # Read ahead once the step is drawn
+
+        self._slider.blockSignals(False)
+        self._label.setText(str(self._slider.value()))
+
+        return 0
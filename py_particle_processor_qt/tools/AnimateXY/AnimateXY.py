@@ -37,31 +37,6 @@ class AnimateXY(AbstractTool):
         self._settings["lim"] = float(self._animateGUI.lim.text())
         self._settings["fps"] = int(self._animateGUI.fps.text())
 
-    @staticmethod
-    def get_bunch_in_local_frame(datasource, step):
-        x = np.array(datasource["Step#{}".format(step)]["x"])
-        y = np.array(datasource["Step#{}".format(step)]["y"])
-        x_mean = np.mean(x)
-        y_mean = np.mean(y)
-
-        px_mean = np.mean(np.array(datasource["Step#{}".format(step)]["px"]))
-        py_mean = np.mean(np.array(datasource["Step#{}".format(step)]["py"]))
-
-        theta = np.arccos(py_mean / np.sqrt(np.square(px_mean) + np.square(py_mean)))
-
-        if px_mean < 0:
-            theta = -theta
-
-        # Center the beam
-        x -= x_mean
-        y -= y_mean
-
-        # Rotate the beam and return
-        temp_x = x
-        temp_y = y
-
-        return temp_x * np.cos(theta) - temp_y * np.sin(theta),  temp_x * np.sin(theta) + temp_y * np.cos(theta)
-
     def callback_apply(self):
         self.apply_settings()
         self._animateWindow.close()
@@ -80,28 +55,23 @@ class AnimateXY(AbstractTool):
         for dataset in self._selections:
 
             # dataset = self._selections[0]
-            datasource = dataset.get_datasource()
             nsteps = dataset.get_nsteps()
 
             # TODO: Total hack, but I want to tag certain particles RIGHT NOW -DW
             # tag_step = 568
             # tag_y_lim = 5.0 * 1.0e-3  # m
-            # _x, _y = self.get_bunch_in_local_frame(datasource, tag_step)
+            # _x, _y = dataset.beam_frame().block(tag_step, frame="local")
             # tag_idx = np.where(_y >= tag_y_lim)
             # pids = np.array(datasource["Step#{}".format(tag_step)]["id"][tag_idx])
 
             animate = {}
 
-            for step in range(nsteps):
-
-                animate["Step#{}".format(step)] = {"x": np.array(datasource["Step#{}".format(step)]["x"]),
-                                                   "y": np.array(datasource["Step#{}".format(step)]["y"]),
-                                                   "id": np.array(datasource["Step#{}".format(step)]["id"])}
+            # All steps are transformed at once, in batches of a few steps (see beamframe.py)
+            frames = dataset.beam_frame().blocks(range(nsteps), frame="local" if self._settings["local"] else "global",
+                                                 keys=("x", "y"))
 
-                if self._settings["local"]:
-
-                    animate["Step#{}".format(step)]["x"], animate["Step#{}".format(step)]["y"] = \
-                        self.get_bunch_in_local_frame(datasource, step)
+            for step in range(nsteps):
+                animate["Step#{}".format(step)] = {"x": frames[step][0], "y": frames[step][1]}
 
             animate_all.append(animate)
 
@@ -1,6 +1,7 @@
 from ..abstract_tool import AbstractTool
 from PyQt5.QtWidgets import QFileDialog, QMainWindow
 from .beamchargui import Ui_BeamChar
+from py_particle_processor_qt.moments import MomentEngine
 from matplotlib.ticker import LinearLocator, LogLocator
 from matplotlib.ticker import FormatStrFormatter
 import matplotlib.pyplot as plt
@@ -43,6 +44,13 @@ class BeamChar(AbstractTool):
         self._settings["energyHist"] = self._beamCharGUI.ehist.isChecked()
         self._settings["intensity"] = self._beamCharGUI.intens.isChecked()
         self._settings["xz"] = self._beamCharGUI.xz.isChecked()
+        self._settings["fracEmit"] = self._beamCharGUI.femit.isChecked()
+        self._settings["haloCount"] = self._beamCharGUI.halocount.isChecked()
+
+        # Fractional emittances, halo definition (times the rms emittance) and max. number of particles to rank
+        self._settings["fractions"] = (0.9, 0.99)
+        self._settings["haloFactor"] = 9.0
+        self._settings["maxParticles"] = 1000000
 
     def callback_apply(self):
         self.apply_settings()
@@ -55,32 +63,28 @@ class BeamChar(AbstractTool):
 
         for dataset in self._selections:
 
-            corrected = {}
             name = dataset.get_name()
             nsteps, npart = dataset.get_nsteps(), dataset.get_npart()
 
             plot_data = {"name": name,
-                         "xRMS": np.array([]),
-                         "yRMS": np.array([]),
-                         "zRMS": np.array([]),
-                         "xHalo": np.array([]),
-                         "yHalo": np.array([]),
-                         "zHalo": np.array([]),
+                         "xRMS": np.zeros(nsteps),
+                         "yRMS": np.zeros(nsteps),
+                         "zRMS": np.zeros(nsteps),
+                         "xHalo": np.zeros(nsteps),
+                         "yHalo": np.zeros(nsteps),
+                         "zHalo": np.zeros(nsteps),
                          "xCentroid": np.ones(nsteps) * largepos,
                          "yCentroid": np.ones(nsteps) * largepos,
                          "turnSep": np.array([]),
-                         "R": np.array([]),
-                         "energy": np.array([]),
-                         "power": np.array([]),
+                         "R": [],
+                         "meanEnergy": np.zeros(nsteps),
+                         "energy": [],
+                         "power": [],
                          "coords": []}
 
             azimuths = np.ones(nsteps) * largepos
             r_temps = np.ones(nsteps) * largepos
 
-            datasource = dataset.get_datasource()
-
-            index = 0
-
             save_r = True
             r_tsep = []
 
@@ -141,117 +145,104 @@ class BeamChar(AbstractTool):
 
             spt = 1
 
-            for step in range(int(nsteps / spt)):
+            m_amu = 2.01510  # Rest mass of individual H2+, in amu
+            m_mev = 1876.9729554  # Rest mass of individual H2+, in MeV/c^2
 
-                step *= spt
+            # Centroid and mean momentum in the global frame come from the summary table,
+            # the central moments in the local frame of the bunch are calculated here
+            means = dataset.summary()["mean"]
+            keys = ("x", "y", "z", "px", "py", "pz")
+            local_moments = MomentEngine(("x", "y", "z"), nsteps, order=4, covariance=False)
 
-                m_amu = 2.01510  # Rest mass of individual H2+, in amu
-                m_mev = 1876.9729554  # Rest mass of individual H2+, in MeV/c^2
+            emittances = self._settings["fracEmit"] or self._settings["haloCount"]
 
-                if self._settings["rms"] or self._settings["halo"]:
-                    px_val = np.array(datasource["Step#{}".format(step)]["px"])
-                    py_val = np.array(datasource["Step#{}".format(step)]["py"])
-                    pz_val = np.array(datasource["Step#{}".format(step)]["pz"])
-                    betagamma = np.sqrt(np.square(px_val) + np.square(py_val) + np.square(pz_val))
-                    energy = np.mean((np.sqrt(np.square(betagamma * m_mev) + np.square(m_mev)) - m_mev) / m_amu)
-                    plot_data["energy"] = np.append(plot_data["energy"], energy)
+            read_particles = self._settings["rms"] or self._settings["halo"] or self._settings["energyHist"] or \
+                self._settings["intensity"] or self._settings["xz"] or emittances
+
+            # Buffers that are reused for every step
+            block = np.empty((len(keys), npart))
+            local = np.empty((3, npart))
+            work = np.empty(npart)
+
+            for step in range(int(nsteps / spt)):
+
+                step *= spt
 
                 if nsteps > 1:
                     completed = int(100*(step/(nsteps-1)))
                     self._parent.send_status("Plotting progress: {}% complete".format(completed))
 
-                corrected["Step#{}".format(step)] = {}
-
-                x_val = np.array(datasource["Step#{}".format(step)]["x"])
-                y_val = np.array(datasource["Step#{}".format(step)]["y"])
-                z_val = np.array(datasource["Step#{}".format(step)]["z"])
-
-                if self._settings["xz"]:
+                x_mean, y_mean = means[step, :2]
 
-                    r = np.sqrt(np.square(x_val) + np.square(y_val))
+                # Add centroid coordinates
+                if self._settings["centroid"] or self._settings["turnsep"]:
 
-                    plot_data["coords"] = np.append(plot_data["coords"], z_val)
-                    plot_data["R"] = np.append(plot_data["R"], r)
+                    plot_data["xCentroid"][step] = x_mean
+                    plot_data["yCentroid"][step] = y_mean
 
-                px_mean = np.mean(np.array(datasource["Step#{}".format(step)]["px"]))
-                py_mean = np.mean(np.array(datasource["Step#{}".format(step)]["py"]))
-                theta = np.arccos(py_mean/np.linalg.norm([px_mean, py_mean]))
+                    # Calculate turn separation (as close as possible to pos x-axis for now, arbitrary angle later? -DW)
+                    if self._settings["turnsep"]:
+                        azimuth = np.rad2deg(np.arctan2(plot_data["yCentroid"][step], plot_data["xCentroid"][step]))
+                        azimuths[step] = azimuth
+                        r_temp = np.sqrt(np.square(plot_data["xCentroid"][step]) +
+                                         np.square(plot_data["yCentroid"][step]))
+                        r_temps[step] = r_temp
 
-                if px_mean < 0:
-                    theta = -theta
+                        if azimuth > 0 and save_r:
+                            save_r = False
+                            r_tsep.append(r_temp)
+                        if azimuth < 0:
+                            save_r = True
 
-                # Center the beam
-                corrected["Step#{}".format(step)]["x"] = x_val - np.mean(x_val)
-                corrected["Step#{}".format(step)]["y"] = y_val - np.mean(y_val)
-                corrected["Step#{}".format(step)]["z"] = z_val - np.mean(z_val)
+                if not read_particles:
+                    continue
 
-                # Rotate the beam
-                temp_x = corrected["Step#{}".format(step)]["x"]
-                temp_y = corrected["Step#{}".format(step)]["y"]
-                corrected["Step#{}".format(step)]["x"] = temp_x*np.cos(theta) - temp_y*np.sin(theta)
-                corrected["Step#{}".format(step)]["y"] = temp_x*np.sin(theta) + temp_y*np.cos(theta)
+                _block = dataset.read_step(step, keys, out=block)
+                _npart = _block.shape[1]
 
-                # Calculate RMS
-                if self._settings["rms"]:
-                    plot_data["xRMS"] = np.append(plot_data["xRMS"],
-                                                  1000.0 * self.rms(corrected["Step#{}".format(step)]["x"]))
-                    plot_data["yRMS"] = np.append(plot_data["yRMS"],
-                                                  1000.0 * self.rms(corrected["Step#{}".format(step)]["y"]))
-                    plot_data["zRMS"] = np.append(plot_data["zRMS"],
-                                                  1000.0 * self.rms(corrected["Step#{}".format(step)]["z"]))
+                if _npart > block.shape[1]:
+                    block = _block
+                    local = np.empty((3, _npart))
+                    work = np.empty(_npart)
 
-                # Calculate halo parameter
-                if self._settings["halo"]:
-                    plot_data["xHalo"] = np.append(plot_data["xHalo"],
-                                                   self.halo(corrected["Step#{}".format(step)]["x"]))
-                    plot_data["yHalo"] = np.append(plot_data["yHalo"],
-                                                   self.halo(corrected["Step#{}".format(step)]["y"]))
-                    plot_data["zHalo"] = np.append(plot_data["zHalo"],
-                                                   self.halo(corrected["Step#{}".format(step)]["z"]))
+                x_val, y_val, z_val = _block[0], _block[1], _block[2]
 
-                # Calculate energy
-                if self._settings["energyHist"] or self._settings["intensity"]:
-                    m_amu = 2.01510  # Rest mass of individual H2+, in amu
-                    m_mev = 1876.9729554  # Rest mass of individual H2+, in MeV/c^2
+                if self._settings["rms"] or self._settings["halo"] or emittances or \
+                        self._settings["energyHist"] or self._settings["intensity"]:
 
-                    px_val = np.array(datasource["Step#{}".format(step)]["px"])
-                    py_val = np.array(datasource["Step#{}".format(step)]["py"])
-                    pz_val = np.array(datasource["Step#{}".format(step)]["pz"])
+                    # Kinetic energy per particle (MeV/amu)
+                    energy = work[:_npart]
+                    np.einsum("ij,ij->j", _block[3:], _block[3:], out=energy)  # (beta * gamma)^2
+                    energy *= m_mev ** 2.0
+                    energy += m_mev ** 2.0
+                    np.sqrt(energy, out=energy)
+                    energy -= m_mev
+                    energy /= m_amu
 
-                    betagamma = np.sqrt(np.square(px_val) + np.square(py_val) + np.square(pz_val))
-                    energy = (np.sqrt(np.square(betagamma * m_mev) + np.square(m_mev)) - m_mev) / m_amu  # MeV/amu
+                    plot_data["meanEnergy"][step] = np.mean(energy)
 
-                    plot_data["energy"] = np.append(plot_data["energy"], energy)
+                    if self._settings["energyHist"] or self._settings["intensity"]:
+                        plot_data["energy"].append(energy.copy())
 
-                    if self._settings["intensity"]:
+                        if self._settings["intensity"]:
+                            # Power deposition of a single h2+ particle (need to use full energy here!) (W)
+                            plot_data["power"].append(q_macro * f_cyclo * energy * 1e6 * m_amu * duty_factor)
 
-                        # Power deposition of a single h2+ particle (need to use full energy here!) (W)
-                        power = q_macro * f_cyclo * energy * 1e6 * m_amu * duty_factor
-                        plot_data["power"] = np.append(plot_data["power"], power)
+                if self._settings["xz"] or self._settings["intensity"]:
 
-                        # Radii (m)
-                        r = np.sqrt(np.square(x_val) + np.square(y_val))
-                        plot_data["R"] = np.append(plot_data["R"], r)
+                    # Radii (m)
+                    plot_data["R"].append(np.sqrt(x_val ** 2.0 + y_val ** 2.0))
 
-                # Add centroid coordinates
-                if self._settings["centroid"] or self._settings["turnsep"]:
+                    if self._settings["xz"]:
+                        plot_data["coords"].append(z_val.copy())
 
-                    plot_data["xCentroid"][step] = np.mean(x_val)
-                    plot_data["yCentroid"][step] = np.mean(y_val)
+                if self._settings["rms"] or self._settings["halo"]:
 
-                    # Calculate turn separation (as close as possible to pos x-axis for now, arbitrary angle later? -DW)
-                    if self._settings["turnsep"]:
-                        azimuth = np.rad2deg(np.arctan2(plot_data["yCentroid"][step], plot_data["xCentroid"][step]))
-                        azimuths[step] = azimuth
-                        r_temp = np.sqrt(np.square(plot_data["xCentroid"][step]) +
-                                         np.square(plot_data["yCentroid"][step]))
-                        r_temps[step] = r_temp
+                    # Rotate the beam into the local frame
+                    _local = dataset.beam_frame().transform(_block[:3], keys[:3], step, frame="local",
+                                                            out=local[:, :_npart])
 
-                        if azimuth > 0 and save_r:
-                            save_r = False
-                            r_tsep.append(r_temp)
-                        if azimuth < 0:
-                            save_r = True
+                    local_moments.add_step(step, _local)
 
                 # if step >= (16 * 95) + 6 and step % 16 == 6 and self._settings["turnsep"]:
                 #     r = np.sqrt(np.square(np.mean(x_val)) + np.square(np.mean(y_val)))
@@ -261,6 +252,25 @@ class BeamChar(AbstractTool):
                 #     difference = np.abs(plot_data["R"][index-1] - plot_data["R"][index])
                 #     plot_data["turnSep"] = np.append(plot_data["turnSep"], difference)
 
+            # Calculate RMS (mm) and halo parameter in the local frame
+            if self._settings["rms"]:
+                plot_data["xRMS"], plot_data["yRMS"], plot_data["zRMS"] = 1000.0 * np.sqrt(local_moments.m2.T)
+
+            if self._settings["halo"]:
+                plot_data["xHalo"], plot_data["yHalo"], plot_data["zHalo"] = \
+                    (local_moments.m4 / np.square(local_moments.m2) - 1.0).T
+
+            for key in ["R", "energy", "power", "coords"]:
+                plot_data[key] = np.concatenate(plot_data[key]) if len(plot_data[key]) > 0 else np.array([])
+
+            # Fractional emittances and halo particles (particles ranked by their Courant-Snyder invariant)
+            if emittances:
+                self._parent.send_status("Calculating emittances...")
+                plot_data["twiss"] = dataset.twiss(fractions=self._settings["fractions"],
+                                                   halo_factor=self._settings["haloFactor"],
+                                                   max_particles=self._settings["maxParticles"], seed=0,
+                                                   frame="local")
+
             plots["plot_data{}".format(num)] = plot_data
 
             num += 1
@@ -284,7 +294,7 @@ class BeamChar(AbstractTool):
             ax1 = plt.subplot(311)
             plt.title("RMS Beam Size (mm)")
             for n in range(num):
-                plt.plot(plots["plot_data{}".format(n)]["energy"], plots["plot_data{}".format(n)]["xRMS"], lw=0.8,
+                plt.plot(plots["plot_data{}".format(n)]["meanEnergy"], plots["plot_data{}".format(n)]["xRMS"], lw=0.8,
                          label=plots["plot_data{}".format(n)]["name"])
                 # print("Mean x RMS: {}".format(np.mean(plots["plot_data{}".format(n)]["xRMS"][40:])))
             ax1.get_yaxis().set_major_locator(LinearLocator(numticks=5))
@@ -298,7 +308,7 @@ class BeamChar(AbstractTool):
 
             ax2 = plt.subplot(312, sharex=ax1)
             for n in range(num):
-                plt.plot(plots["plot_data{}".format(n)]["energy"], plots["plot_data{}".format(n)]["yRMS"], lw=0.8,
+                plt.plot(plots["plot_data{}".format(n)]["meanEnergy"], plots["plot_data{}".format(n)]["yRMS"], lw=0.8,
                          label=plots["plot_data{}".format(n)]["name"])
                 # print("Mean y RMS: {}".format(np.mean(plots["plot_data{}".format(n)]["yRMS"][40:])))
             plt.legend(loc=9)
@@ -312,7 +322,7 @@ class BeamChar(AbstractTool):
 
             ax3 = plt.subplot(313, sharex=ax1)
             for n in range(num):
-                plt.plot(plots["plot_data{}".format(n)]["energy"], plots["plot_data{}".format(n)]["zRMS"], lw=0.8,
+                plt.plot(plots["plot_data{}".format(n)]["meanEnergy"], plots["plot_data{}".format(n)]["zRMS"], lw=0.8,
                          label=plots["plot_data{}".format(n)]["name"])
                 # print("Mean z RMS: {}".format(np.mean(plots["plot_data{}".format(n)]["zRMS"][40:])))
             ax3.get_yaxis().set_major_locator(LinearLocator(numticks=5))
@@ -341,7 +351,7 @@ class BeamChar(AbstractTool):
             ax1 = plt.subplot(311)
             plt.title("Halo Parameter")
             for n in range(num):
-                plt.plot(plots["plot_data{}".format(n)]["energy"], plots["plot_data{}".format(n)]["xHalo"], lw=0.8,
+                plt.plot(plots["plot_data{}".format(n)]["meanEnergy"], plots["plot_data{}".format(n)]["xHalo"], lw=0.8,
                          label=plots["plot_data{}".format(n)]["name"])
             ax1.get_yaxis().set_major_locator(LinearLocator(numticks=5))
             ax1.tick_params(labelbottom=False)
@@ -352,7 +362,7 @@ class BeamChar(AbstractTool):
 
             ax2 = plt.subplot(312, sharex=ax1)
             for n in range(num):
-                plt.plot(plots["plot_data{}".format(n)]["energy"], plots["plot_data{}".format(n)]["yHalo"], lw=0.8,
+                plt.plot(plots["plot_data{}".format(n)]["meanEnergy"], plots["plot_data{}".format(n)]["yHalo"], lw=0.8,
                          label=plots["plot_data{}".format(n)]["name"])
             plt.legend(loc=9)
             ax2.get_yaxis().set_major_locator(LinearLocator(numticks=5))
@@ -364,7 +374,7 @@ class BeamChar(AbstractTool):
 
             ax3 = plt.subplot(313, sharex=ax1)
             for n in range(num):
-                plt.plot(plots["plot_data{}".format(n)]["energy"], plots["plot_data{}".format(n)]["zHalo"], lw=0.8,
+                plt.plot(plots["plot_data{}".format(n)]["meanEnergy"], plots["plot_data{}".format(n)]["zHalo"], lw=0.8,
                          label=plots["plot_data{}".format(n)]["name"])
             ax3.get_yaxis().set_major_locator(LinearLocator(numticks=5))
             ax3.set_ylim([0, _ylim])
@@ -375,6 +385,86 @@ class BeamChar(AbstractTool):
             # fig.tight_layout()
             fig.savefig(self._filename[0] + '_haloParameter.png', bbox_inches='tight', dpi=1200)
 
+        if self._settings["fracEmit"]:
+            _xlim = 62.2
+            _figsize = (7, 5)
+            _fs = 12
+
+            fig = plt.figure(figsize=_figsize)
+            plt.rc('font', **{'family': 'serif', 'serif': ['Computer Modern'], 'weight': 100, 'size': _fs})
+            plt.rc('text', usetex=True)
+            plt.rc('grid', linestyle=':')
+            plt.rc('ytick', labelsize=_fs)
+            plt.rc('xtick', labelsize=_fs)
+
+            ax1 = None
+            for j, label in enumerate(["Horizontal", "Vertical", "Longitudinal"]):
+                ax = plt.subplot(311 + j, sharex=ax1)
+                ax1 = ax1 or ax
+                if j == 0:
+                    plt.title(r"Normalized Emittance ($\pi$-mm-mrad)")
+                for n in range(num):
+                    _energy = plots["plot_data{}".format(n)]["meanEnergy"]
+                    _twiss = plots["plot_data{}".format(n)]["twiss"]
+                    plt.plot(_energy, 1.0e6 * _twiss["emittance_norm"][:, j], lw=0.8,
+                             label="{}, rms".format(plots["plot_data{}".format(n)]["name"]))
+                    for fraction in self._settings["fractions"]:
+                        lines = plt.plot(_energy, 1.0e6 * _twiss["fractional_norm"][fraction][:, j], lw=0.8,
+                                         label=r"{}, {:g}\%".format(plots["plot_data{}".format(n)]["name"],
+                                                                    100.0 * fraction))
+                        # Confidence band if the particles were sampled
+                        scale = 1.0e6 * _twiss["betagamma"]
+                        plt.fill_between(_energy, scale * _twiss["fractional_lower"][fraction][:, j],
+                                         scale * _twiss["fractional_upper"][fraction][:, j],
+                                         color=lines[0].get_color(), alpha=0.3, lw=0)
+                if j == 1:
+                    plt.legend(loc=9, fontsize=_fs - 4)
+                ax.get_yaxis().set_major_locator(LinearLocator(numticks=5))
+                ax.tick_params(labelbottom=(j == 2))
+                ax.set_xlim([0, _xlim])
+                plt.grid()
+                plt.ylabel(label)
+            plt.xlabel("Energy (MeV/amu)")
+            fig.savefig(self._filename[0] + '_fractionalEmittance.png', bbox_inches='tight', dpi=1200)
+
+        if self._settings["haloCount"]:
+            _xlim = 62.2
+            _figsize = (7, 5)
+            _fs = 12
+
+            fig = plt.figure(figsize=_figsize)
+            plt.rc('font', **{'family': 'serif', 'serif': ['Computer Modern'], 'weight': 100, 'size': _fs})
+            plt.rc('text', usetex=True)
+            plt.rc('grid', linestyle=':')
+            plt.rc('ytick', labelsize=_fs)
+            plt.rc('xtick', labelsize=_fs)
+
+            ax1 = None
+            for j, label in enumerate(["Horizontal", "Vertical", "Longitudinal"]):
+                ax = plt.subplot(311 + j, sharex=ax1)
+                ax1 = ax1 or ax
+                if j == 0:
+                    plt.title(r"Halo Particles (\%, outside {:g} $\times$ rms Emittance)".format(
+                        self._settings["haloFactor"]))
+                for n in range(num):
+                    _energy = plots["plot_data{}".format(n)]["meanEnergy"]
+                    _twiss = plots["plot_data{}".format(n)]["twiss"]
+                    _npart = np.maximum(_twiss["npart"], 1)
+                    _halo = 100.0 * _twiss["halo_count"][:, j] / _npart
+                    _error = 100.0 * _twiss["halo_count_error"][:, j] / _npart
+                    lines = plt.plot(_energy, _halo, lw=0.8, label=plots["plot_data{}".format(n)]["name"])
+                    plt.fill_between(_energy, _halo - _error, _halo + _error, color=lines[0].get_color(),
+                                     alpha=0.3, lw=0)
+                if j == 1:
+                    plt.legend(loc=9)
+                ax.get_yaxis().set_major_locator(LinearLocator(numticks=5))
+                ax.tick_params(labelbottom=(j == 2))
+                ax.set_xlim([0, _xlim])
+                plt.grid()
+                plt.ylabel(label)
+            plt.xlabel("Energy (MeV/amu)")
+            fig.savefig(self._filename[0] + '_haloParticles.png', bbox_inches='tight', dpi=1200)
+
         if self._settings["centroid"]:
             fig = plt.figure()
             plt.rc('font', **{'family': 'serif', 'serif': ['Computer Modern']})
@@ -501,17 +591,6 @@ class BeamChar(AbstractTool):
 
         self._parent.send_status("Plot(s) saved successfully!")
 
-    @staticmethod
-    def rms(nparray):
-        mean_sqrd = np.mean(np.square(nparray))
-        return np.sqrt(mean_sqrd)
-
-    @staticmethod
-    def halo(nparray):
-        mean_sqrd = np.mean(np.square(nparray))
-        mean_frth = np.mean(np.square(np.square(nparray)))
-        return mean_frth/(np.square(mean_sqrd)) - 1.0
-
     def run(self):
         # --- Calculate the positions to center the window --- #
         screen_size = self._parent.screen_size()
@@ -11,7 +11,7 @@ from PyQt5 import QtCore, QtGui, QtWidgets
 class Ui_BeamChar(object):
     def setupUi(self, BeamChar):
         BeamChar.setObjectName("BeamChar")
-        BeamChar.resize(421, 303)
+        BeamChar.resize(421, 353)
         sizePolicy = QtWidgets.QSizePolicy(QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Minimum)
         sizePolicy.setHorizontalStretch(0)
         sizePolicy.setVerticalStretch(0)
@@ -25,7 +25,7 @@ class Ui_BeamChar(object):
         self.centralwidget.setSizePolicy(sizePolicy)
         self.centralwidget.setObjectName("centralwidget")
         self.verticalLayoutWidget = QtWidgets.QWidget(self.centralwidget)
-        self.verticalLayoutWidget.setGeometry(QtCore.QRect(10, 3, 401, 299))
+        self.verticalLayoutWidget.setGeometry(QtCore.QRect(10, 3, 401, 349))
         self.verticalLayoutWidget.setObjectName("verticalLayoutWidget")
         self.verticalLayout_3 = QtWidgets.QVBoxLayout(self.verticalLayoutWidget)
         self.verticalLayout_3.setSizeConstraint(QtWidgets.QLayout.SetMinimumSize)
@@ -45,11 +45,11 @@ class Ui_BeamChar(object):
         self.gridLayout.setObjectName("gridLayout")
         self.label_9 = QtWidgets.QLabel(self.verticalLayoutWidget)
         self.label_9.setObjectName("label_9")
-        self.gridLayout.addWidget(self.label_9, 7, 0, 1, 1)
+        self.gridLayout.addWidget(self.label_9, 8, 0, 1, 1)
         self.intens = QtWidgets.QCheckBox(self.verticalLayoutWidget)
         self.intens.setText("")
         self.intens.setObjectName("intens")
-        self.gridLayout.addWidget(self.intens, 10, 1, 1, 1, QtCore.Qt.AlignHCenter)
+        self.gridLayout.addWidget(self.intens, 11, 1, 1, 1, QtCore.Qt.AlignHCenter)
         self.label_8 = QtWidgets.QLabel(self.verticalLayoutWidget)
         self.label_8.setObjectName("label_8")
         self.gridLayout.addWidget(self.label_8, 1, 0, 1, 1)
@@ -77,7 +77,7 @@ class Ui_BeamChar(object):
         self.gridLayout.addWidget(self.label_2, 2, 0, 1, 1, QtCore.Qt.AlignHCenter)
         self.label_6 = QtWidgets.QLabel(self.verticalLayoutWidget)
         self.label_6.setObjectName("label_6")
-        self.gridLayout.addWidget(self.label_6, 9, 0, 1, 1, QtCore.Qt.AlignHCenter)
+        self.gridLayout.addWidget(self.label_6, 10, 0, 1, 1, QtCore.Qt.AlignHCenter)
         self.turnsep = QtWidgets.QCheckBox(self.verticalLayoutWidget)
         self.turnsep.setText("")
         self.turnsep.setObjectName("turnsep")
@@ -88,17 +88,31 @@ class Ui_BeamChar(object):
         self.ehist = QtWidgets.QCheckBox(self.verticalLayoutWidget)
         self.ehist.setText("")
         self.ehist.setObjectName("ehist")
-        self.gridLayout.addWidget(self.ehist, 9, 1, 1, 1, QtCore.Qt.AlignHCenter)
+        self.gridLayout.addWidget(self.ehist, 10, 1, 1, 1, QtCore.Qt.AlignHCenter)
         self.label_7 = QtWidgets.QLabel(self.verticalLayoutWidget)
         self.label_7.setObjectName("label_7")
-        self.gridLayout.addWidget(self.label_7, 10, 0, 1, 1, QtCore.Qt.AlignHCenter)
+        self.gridLayout.addWidget(self.label_7, 11, 0, 1, 1, QtCore.Qt.AlignHCenter)
         self.label_10 = QtWidgets.QLabel(self.verticalLayoutWidget)
         self.label_10.setObjectName("label_10")
-        self.gridLayout.addWidget(self.label_10, 8, 0, 1, 1, QtCore.Qt.AlignHCenter)
+        self.gridLayout.addWidget(self.label_10, 9, 0, 1, 1, QtCore.Qt.AlignHCenter)
         self.xz = QtWidgets.QCheckBox(self.verticalLayoutWidget)
         self.xz.setText("")
         self.xz.setObjectName("xz")
-        self.gridLayout.addWidget(self.xz, 8, 1, 1, 1, QtCore.Qt.AlignHCenter)
+        self.gridLayout.addWidget(self.xz, 9, 1, 1, 1, QtCore.Qt.AlignHCenter)
+        self.label_11 = QtWidgets.QLabel(self.verticalLayoutWidget)
+        self.label_11.setObjectName("label_11")
+        self.gridLayout.addWidget(self.label_11, 3, 0, 1, 1, QtCore.Qt.AlignHCenter)
+        self.femit = QtWidgets.QCheckBox(self.verticalLayoutWidget)
+        self.femit.setText("")
+        self.femit.setObjectName("femit")
+        self.gridLayout.addWidget(self.femit, 3, 1, 1, 1, QtCore.Qt.AlignHCenter)
+        self.label_12 = QtWidgets.QLabel(self.verticalLayoutWidget)
+        self.label_12.setObjectName("label_12")
+        self.gridLayout.addWidget(self.label_12, 7, 0, 1, 1, QtCore.Qt.AlignHCenter)
+        self.halocount = QtWidgets.QCheckBox(self.verticalLayoutWidget)
+        self.halocount.setText("")
+        self.halocount.setObjectName("halocount")
+        self.gridLayout.addWidget(self.halocount, 7, 1, 1, 1, QtCore.Qt.AlignHCenter)
         self.verticalLayout_3.addLayout(self.gridLayout)
         spacerItem = QtWidgets.QSpacerItem(20, 10, QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Fixed)
         self.verticalLayout_3.addItem(spacerItem)
@@ -124,4 +138,6 @@ class Ui_BeamChar(object):
         self.label_5.setText(_translate("BeamChar", "Turn Separation"))
         self.label_7.setText(_translate("BeamChar", "Beam Intensity vs Radius"))
         self.label_10.setText(_translate("BeamChar", "R-Z Scatter Plot"))
+        self.label_11.setText(_translate("BeamChar", "Fractional Emittance"))
+        self.label_12.setText(_translate("BeamChar", "Halo Particles"))
 
@@ -21,6 +21,7 @@ class CollimOPAL(AbstractTool):
         self._filename = ""
         self._settings = {}
         self._datasource = None  # h5py datasource for orbit data
+        self._dataset = None
 
         # --- Initialize the GUI --- #
         self._collimOPALWindow = QMainWindow()
@@ -97,12 +98,18 @@ class CollimOPAL(AbstractTool):
     #
     #     return np.array([x, px, y, py])
 
+    def get_means_at_step(self, step):
+
+        # The search for the collimator positions visits many steps, take the centroids from the summary table
+        x, y, _, px, py, _ = self._dataset.summary()["mean"][step]
+
+        return x, y, px, py
+
     def get_xy_mean_at_step_mm(self, step):
 
-        x = 1e3 * np.mean(np.array(self._datasource["Step#{}".format(step)]["x"]))
-        y = 1e3 * np.mean(np.array(self._datasource["Step#{}".format(step)]["y"]))
+        x, y, _, _ = self.get_means_at_step(step)
 
-        return x, y
+        return 1e3 * x, 1e3 * y
 
     def gen_script(self):
         script = ""
@@ -128,8 +135,7 @@ class CollimOPAL(AbstractTool):
                         x_temp, y_temp = self.get_xy_mean_at_step_mm(i)
 
             x_new, y_new = self.get_xy_mean_at_step_mm(i)
-            px_new = np.mean(np.array(self._datasource["Step#{}".format(i)]["px"]))
-            py_new = np.mean(np.array(self._datasource["Step#{}".format(i)]["py"]))
+            _, _, px_new, py_new = self.get_means_at_step(i)
 
             collim = self.gen_collim(x_new, y_new, px_new, py_new)
 
@@ -196,7 +202,7 @@ class CollimOPAL(AbstractTool):
     def open_gui(self):
 
         # Get parent dataset/source for orbit data
-        dataset = self._selections[0]
-        self._datasource = dataset.get_datasource()
+        self._dataset = self._selections[0]
+        self._datasource = self._dataset.get_datasource()
 
         self.run()
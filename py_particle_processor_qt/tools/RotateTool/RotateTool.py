@@ -1,5 +1,6 @@
 from ..abstract_tool import AbstractTool
 from .rotatetoolgui import Ui_RotateToolGUI
+from py_particle_processor_qt.transforms import AffineTransform
 from PyQt5 import QtGui
 import numpy as np
 
@@ -76,31 +77,10 @@ class RotateTool(AbstractTool):
         # TODO: Radians?
         self._angle = np.deg2rad(self._angle)
 
-        rotation_matrix = np.array([[np.cos(self._angle), -np.sin(self._angle), 0.0],
-                                    [np.sin(self._angle), np.cos(self._angle), 0.0],
-                                    [0.0, 0.0, 1.0]])
+        # Rotation of positions and momenta around the z axis
+        transform = AffineTransform.rotate(self._angle, axis="z")
 
         for dataset in self._selections:
-
-            datasource = dataset.get_datasource()
-            nsteps, npart = dataset.get_nsteps(), dataset.get_npart()
-
-            for step in range(nsteps):
-                for part in range(npart):
-
-                    position, momentum = np.array([0.0, 0.0, 0.0]), np.array([0.0, 0.0, 0.0])
-
-                    for i, v in enumerate(["x", "y", "z"]):
-                        position[i] = datasource["Step#{}".format(step)][v][part]
-                    for i, v in enumerate(["px", "py", "pz"]):
-                        momentum[i] = datasource["Step#{}".format(step)][v][part]
-
-                    rot_position = np.matmul(rotation_matrix, position)
-                    rot_momentum = np.matmul(rotation_matrix, momentum)
-
-                    for i, v in enumerate(["x", "y", "z"]):
-                        datasource["Step#{}".format(step)][v][part] = float(rot_position[i])
-                    for i, v in enumerate(["px", "py", "pz"]):
-                        datasource["Step#{}".format(step)][v][part] = float(rot_momentum[i])
+            dataset.push_transform(transform)  # Applied when the data is read, until it is baked
 
         return 0
\ No newline at end of file
@@ -1,5 +1,6 @@
 from ..abstract_tool import AbstractTool
 from .scaletoolgui import Ui_ScaleToolGUI
+from py_particle_processor_qt.transforms import AffineTransform
 from PyQt5 import QtGui
 
 
@@ -86,13 +87,9 @@ class ScaleTool(AbstractTool):
         # Let's do this on a text basis instead of inferring from the indices
         properties = [t.rstrip(",").lower() for t in prop_txt.split(" ") if "(" not in t]
 
-        for dataset in self._selections:
-            datasource = dataset.get_datasource()
-            nsteps, npart = dataset.get_nsteps(), dataset.get_npart()
+        transform = AffineTransform.scale(dict((prop, scaling_factor) for prop in properties))
 
-            for step in range(nsteps):
-                for part in range(npart):
-                    for prop in properties:
-                        datasource["Step#{}".format(step)][prop][part] *= scaling_factor
+        for dataset in self._selections:
+            dataset.push_transform(transform)  # Applied when the data is read, until it is baked
 
         return 0
@@ -1,5 +1,6 @@
 from ..abstract_tool import AbstractTool
 from .translatetoolgui import Ui_TranslateToolGUI
+from py_particle_processor_qt.transforms import AffineTransform
 from PyQt5 import QtGui
 
 
@@ -95,13 +96,9 @@ class TranslateTool(AbstractTool):
         # Let's do this on a text basis instead of inferring from the indices
         translations = [float(item) for item in [dx, dy, dz]]
 
-        for dataset in self._selections:
-            datasource = dataset.get_datasource()
-            nsteps, npart = dataset.get_nsteps(), dataset.get_npart()
+        transform = AffineTransform.translate(dict(zip(["x", "y", "z"], translations)))
 
-            for step in range(nsteps):
-                for part in range(npart):
-                    for i, direction in enumerate(["x", "y", "z"]):
-                        datasource["Step#{}".format(step)][direction][part] += translations[i]
+        for dataset in self._selections:
+            dataset.push_transform(transform)  # Applied when the data is read, until it is baked
 
         return 0
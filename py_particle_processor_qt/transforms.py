@@ -0,0 +1,288 @@
+from py_particle_processor_qt.drivers.h5datasource import LRUCache
+from py_particle_processor_qt.emittance import PARTICLE_KEYS
+import numpy as np
+
+__author__ = "Daniel Winklehner, Philip Weigel"
+__doc__ = """Affine transformations of the particle data. A transformation is a (7, 7) matrix acting
+on (x, y, z, px, py, pz, 1), so scaling, translation, rotation and any composition of them
+are a single matrix. Applying it to a step is one matrix product on the (nkeys, npart) block
+of the step, and only the coordinates that actually change are read and written.
+A TransformedSource applies a transformation lazily, whenever a step is read.
+"""
+
+TRANSFORM_CACHE_BYTES = 256 * 1024 ** 2  # Memory for transformed steps per dataset
+
+_ROTATION_PLANES = {"x": ((1, 2), (4, 5)),  # Coordinates that are mixed by a rotation around each axis
+                    "y": ((2, 0), (5, 3)),
+                    "z": ((0, 1), (3, 4))}
+
+
+class AffineTransform(object):
+    """
+    An affine map of the 6D phase space. Momenta are rotated with the positions, translations and
+    scaling factors are given per coordinate.
+    """
+
+    def __init__(self, matrix=None):
+        """
+        :param matrix: (7, 7) array, default: identity
+        """
+        if matrix is None:
+            matrix = np.identity(7)
+
+        self._matrix = np.array(matrix, dtype=float)
+
+        assert self._matrix.shape == (7, 7), "Expected a (7, 7) matrix, got {}".format(self._matrix.shape)
+
+    def __repr__(self):
+        return "AffineTransform({})".format(self._matrix.tolist())
+
+    @classmethod
+    def scale(cls, factors):
+        """
+        :param factors: dictionary of key: scaling factor, e.g. {"x": 1e-3, "y": 1e-3}
+        :return: AffineTransform
+        """
+        matrix = np.identity(7)
+
+        for key, factor in factors.items():
+            k = PARTICLE_KEYS.index(key)
+            matrix[k, k] = factor
+
+        return cls(matrix)
+
+    @classmethod
+    def translate(cls, offsets):
+        """
+        :param offsets: dictionary of key: offset, e.g. {"x": dx, "y": dy, "z": dz}
+        :return: AffineTransform
+        """
+        matrix = np.identity(7)
+
+        for key, offset in offsets.items():
+            matrix[PARTICLE_KEYS.index(key), 6] = offset
+
+        return cls(matrix)
+
+    @classmethod
+    def rotate(cls, angle, axis="z"):
+        """
+        Rotation of positions and momenta around an axis through the origin (right-handed)
+        :param angle: angle (rad)
+        :param axis: "x", "y" or "z"
+        :return: AffineTransform
+        """
+        matrix = np.identity(7)
+        c, s = np.cos(angle), np.sin(angle)
+
+        for i, j in _ROTATION_PLANES[axis]:
+            matrix[i, i], matrix[i, j] = c, -s
+            matrix[j, i], matrix[j, j] = s, c
+
+        return cls(matrix)
+
+    def matrix(self):
+        return self._matrix
+
+    def then(self, other):
+        """
+        :param other: AffineTransform that is applied after this one
+        :return: new AffineTransform doing both
+        """
+        return AffineTransform(np.dot(other.matrix(), self._matrix))
+
+    def inverse(self):
+        return AffineTransform(np.linalg.inv(self._matrix))
+
+    def is_identity(self, atol=1e-12):
+        """
+        :param atol: tolerance, e.g. for a rotation followed by its inverse
+        :return: True if the transformation doesn't change the data
+        """
+        return np.allclose(self._matrix, np.identity(7), rtol=0.0, atol=atol)
+
+    def rows(self):
+        """
+        :return: indices of the coordinates (in PARTICLE_KEYS) that are changed by the transformation
+        """
+        return np.flatnonzero(np.any(self._matrix[:6] != np.identity(7)[:6], axis=1))
+
+    def columns(self):
+        """
+        :return: indices of the coordinates (in PARTICLE_KEYS) the changed coordinates depend on
+        """
+        return np.flatnonzero(np.any(self._matrix[self.rows(), :6] != 0.0, axis=0))
+
+    def keys(self):
+        """
+        :return: keys that are changed and keys that have to be read to calculate them
+        """
+        return [PARTICLE_KEYS[k] for k in self.rows()], [PARTICLE_KEYS[k] for k in self.columns()]
+
+    def apply_block(self, block, out=None):
+        """
+        Transforms a block of particle data
+        :param block: (len(columns()), npart) array, rows in the order of keys()[1]
+        :param out: optional (len(rows()), npart) buffer (not the block itself)
+        :return: (len(rows()), npart) array of the changed coordinates in the order of keys()[0]
+        """
+        rows, columns = self.rows(), self.columns()
+
+        if out is None:
+            out = np.empty((len(rows), np.shape(block)[1]))
+
+        np.matmul(self._matrix[np.ix_(rows, columns)], block, out=out)
+        out += self._matrix[rows, 6][:, np.newaxis]
+
+        return out
+
+
+class TransformedStepView(object):
+    """
+    A view of a single step of a TransformedSource. Assigning a column bakes the transformation first
+    (see TransformedSource.write()).
+    """
+
+    __slots__ = ("_source", "_step", "_data")
+
+    def __init__(self, source, step, data):
+        self._source = source
+        self._step = step
+        self._data = data
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __getitem__(self, key):
+        value = self.get(key)
+
+        if value is None:
+            raise KeyError(key)
+
+        return value
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __setitem__(self, key, value):
+        self._source.write(self._step, self._data, key, value)
+
+    @property
+    def attrs(self):
+        return self._data.attrs
+
+    def get(self, key, default=None):
+        value = self._source.read(self._step, self._data, key)
+
+        if value is None:
+            return default
+
+        return value
+
+    def keys(self):
+        return self._data.keys()
+
+    def step(self):
+        return self._step
+
+
+class TransformedSource(object):
+    """
+    Wraps a datasource ({"Step#N": {"x": ...}} access) and applies a transformation to every step that is read.
+    The changed coordinates of a step are calculated at once on the first read and cached (read-only).
+    Once the transformation is baked into the source, the data is passed through unchanged.
+    """
+
+    def __init__(self, source, transform, bake=None, max_bytes=TRANSFORM_CACHE_BYTES):
+        """
+        :param source: the datasource with the original data
+        :param transform: AffineTransform
+        :param bake: function() that applies the transformation to the source, called before the first write
+        :param max_bytes: memory for transformed steps
+        """
+        self._source = source
+        self._transform = transform
+        self._write_keys, self._read_keys = transform.keys()
+        self._cache = LRUCache(max_bytes=max_bytes)
+        self._bake = bake
+        self._baked = False
+
+    def __contains__(self, step):
+        return step in self._source
+
+    def __getitem__(self, step):
+        return TransformedStepView(self, step, self._source[step])
+
+    def __len__(self):
+        return len(self._source)
+
+    def close(self):
+        self._cache.clear()
+        return self._source.close()
+
+    def detach(self):
+        """
+        Called once the transformation was applied to the source: views that are still around read
+        the (now transformed) source directly instead of transforming it again.
+        """
+        self._baked = True
+        self._cache.clear()
+
+        return 0
+
+    def get(self, step, default=None):
+        data = self._source.get(step)
+
+        if data is None:
+            return default
+
+        return TransformedStepView(self, step, data)
+
+    def keys(self):
+        return self._source.keys()
+
+    def read(self, step, data, key):
+        """
+        :param step: "Step#N"
+        :param data: the original data of the step
+        :param key: column name
+        :return: read-only array, None if the column doesn't exist
+        """
+        if self._baked or key not in self._write_keys:
+            return data.get(key)
+
+        block = self._cache.get(step)
+
+        if block is None:
+            block = self._transform.apply_block(np.array([data.get(k)[()] for k in self._read_keys]))
+            block.flags.writeable = False
+            self._cache.put(step, block)
+
+        return block[self._write_keys.index(key)]
+
+    def source(self):
+        return self._source
+
+    def transform(self):
+        return self._transform
+
+    def write(self, step, data, key, value):
+        """
+        Assigns a column of a step. The pending transformation is baked into the source first, so the value
+        is written as it is and isn't transformed again when it is read.
+        :param step: "Step#N"
+        :param data: the original data of the step
+        :param key: column name
+        :param value: array_like
+        :return: 0
+        """
+        if not self._baked:
+
+            if self._bake is None:
+                raise TypeError("Can't write to a transformed datasource, call Dataset.bake_transforms() first")
+
+            self._bake()
+
+        data[key] = value
+
+        return 0